@@ -1,21 +1,26 @@
 from flask import Flask, jsonify
 from flask_cors import CORS
+from werkzeug.middleware.proxy_fix import ProxyFix
 import os
 import logging
-from logging.handlers import RotatingFileHandler
-from models import db, User, Project, PhoneNumber, BlacklistedPhone
+from models import db, User, Project, PhoneNumber, BlacklistedPhone, SmsMessage, BalanceEntry, BalanceSnapshot, PooledPhone
 from config import config
+from async_util import configure_executor, configure_rate_limit_storage
+from billing import get_balance_compactor_counters, start_balance_compactor
+from lease_reaper import get_lease_reaper_counters, start_lease_reaper
+from number_pool import get_number_pool_counters, start_number_pool
+from log_util import configure_json_logging, init_request_logging
+from metrics import init_metrics, metrics
+from migrations import ensure_indexes, relax_blacklist_uniqueness
+from sms_extract import configure_code_extractor
+from sms_inbox import configure_sms_inbox
+from sqlite_tuning import configure_sqlite
 
 # 配置日志
 def configure_logging(app):
-    if not os.path.exists('logs'):
-        os.mkdir('logs')
-    file_handler = RotatingFileHandler('logs/sms_api.log', maxBytes=10240, backupCount=10, encoding='utf-8')
-    file_handler.setFormatter(logging.Formatter(
-        '%(asctime)s %(levelname)s: %(message)s [in %(pathname)s:%(lineno)d]'
-    ))
-    file_handler.setLevel(logging.INFO)
-    app.logger.addHandler(file_handler)
+    # JSON日志由每个进程的后台线程写入，请求线程只负责入队
+    configure_json_logging(app)
+    init_request_logging(app)
     app.logger.setLevel(logging.INFO)
     app.logger.info('SMS API启动')
 
@@ -42,6 +47,34 @@ def create_app(config_name='default'):
     # 初始化数据库实例
     db.init_app(app)
     
+    # SQLite文件数据库启用WAL和进程内单写入者
+    with app.app_context():
+        configure_sqlite(db.engine, app.config)
+    
+    # 创建数据库操作线程池
+    configure_executor(app.config['ASYNC_MAX_WORKERS'], app.config['ASYNC_MAX_PENDING'])
+    
+    # 选择限流计数存储
+    configure_rate_limit_storage(app.config['RATE_LIMIT_STORAGE'])
+    
+    # 经过反向代理时从X-Forwarded-For取客户端IP，只信任配置的代理层数
+    if app.config['TRUSTED_PROXY_COUNT'] > 0:
+        proxies = app.config['TRUSTED_PROXY_COUNT']
+        app.wsgi_app = ProxyFix(app.wsgi_app, x_for=proxies, x_proto=proxies)
+    
+    # 设置短信收件箱和短信服务商
+    configure_sms_inbox(app.config['SMS_INBOX_BATCH_SIZE'], app.config['SMS_INBOX_MAX_QUEUE'],
+                        app.config['SMS_PROVIDER'])
+    
+    # 注册各项目的短信模板
+    configure_code_extractor(app.config['SMS_CODE_TEMPLATES'])
+    
+    # 请求指标及/metrics接口
+    init_metrics(app, db)
+    metrics.register_collector(get_lease_reaper_counters)
+    metrics.register_collector(get_balance_compactor_counters)
+    metrics.register_collector(get_number_pool_counters)
+    
     # 错误处理
     @app.errorhandler(404)
     def not_found_error(error):
@@ -76,6 +109,9 @@ def create_app(config_name='default'):
 def create_tables(app):
     with app.app_context():
         db.create_all()
+        # 已有数据库去掉黑名单的全局唯一约束，补建新增的索引
+        relax_blacklist_uniqueness(db.engine, app.logger)
+        ensure_indexes(db.engine, app.logger)
         app.logger.info("数据库表创建成功")
 
 # 主入口
@@ -89,6 +125,11 @@ if __name__ == '__main__':
     # 创建数据库表
     create_tables(app)
     
+    # 启动过期号码回收、余额快照汇总和号码池补充线程
+    start_lease_reaper(app)
+    start_balance_compactor(app)
+    start_number_pool(app)
+    
     # 开发环境使用Flask内置服务器
     app.run(host='0.0.0.0', port=app.config['PORT'], debug=app.config['DEBUG'])
     
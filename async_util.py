@@ -1,124 +1,300 @@
-import threading
-import asyncio
+import contextvars
 import functools
-from concurrent.futures import ThreadPoolExecutor
+import os
+import sqlite3
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
 
-# 全局线程池，增加最大工作线程数以处理更高的并发
-thread_pool = ThreadPoolExecutor(max_workers=50)
+from flask import current_app, jsonify, request
+
+class BoundedExecutor:
+    """
+    有界线程池
+    
+    同时执行的任务数和排队等待的任务数都有上限，
+    超出上限时立即拒绝新任务，而不是无限排队占满数据库连接池。
+    """
+    
+    def __init__(self, max_workers=10, max_pending=100):
+        """
+        初始化线程池
+        
+        参数:
+        - max_workers: 最大工作线程数，0表示在调用线程中同步执行
+        - max_pending: 最大排队任务数
+        """
+        self.max_workers = max_workers
+        self.max_pending = max_pending
+        self._slots = threading.BoundedSemaphore(max_workers + max_pending)
+        self._executor = None
+        self._pid = None
+        self._lock = threading.Lock()
+        self.in_flight = 0
+        self.rejected = 0
+    
+    def _get_executor(self):
+        """获取当前进程的线程池，fork后的子进程重新创建"""
+        pid = os.getpid()
+        if self._executor is None or self._pid != pid:
+            with self._lock:
+                if self._executor is None or self._pid != pid:
+                    self._executor = ThreadPoolExecutor(max_workers=self.max_workers,
+                                                        thread_name_prefix='sms-api-worker')
+                    self._pid = pid
+        return self._executor
+    
+    def submit(self, func):
+        """
+        提交任务
+        
+        参数:
+        - func: 需要执行的函数
+        
+        返回:
+        - 任务的Future，线程池已满时返回None
+        """
+        if not self._slots.acquire(blocking=False):
+            with self._lock:
+                self.rejected += 1
+            return None
+        
+        with self._lock:
+            self.in_flight += 1
+        
+        def release(_future):
+            with self._lock:
+                self.in_flight -= 1
+            self._slots.release()
+        
+        if self.max_workers <= 0:
+            future = Future()
+            try:
+                future.set_result(func())
+            except BaseException as e:
+                future.set_exception(e)
+        else:
+            future = self._get_executor().submit(func)
+        future.add_done_callback(release)
+        return future
+    
+    def stats(self):
+        """
+        获取线程池使用情况
+        
+        返回:
+        - 最大工作线程数、最大排队数、正在执行和排队的任务数、累计拒绝数
+        """
+        with self._lock:
+            return {
+                'max_workers': self.max_workers,
+                'max_pending': self.max_pending,
+                'in_flight': self.in_flight,
+                'rejected': self.rejected
+            }
+
+# 全局线程池，在create_app中按配置重新创建
+executor = BoundedExecutor()
+
+def configure_executor(max_workers, max_pending):
+    """
+    按配置创建全局线程池
+    
+    参数:
+    - max_workers: 最大工作线程数，0表示同步执行
+    - max_pending: 最大排队任务数
+    """
+    global executor
+    executor = BoundedExecutor(max_workers=max_workers, max_pending=max_pending)
+
+def get_executor_stats():
+    """获取全局线程池使用情况"""
+    return executor.stats()
 
 def run_async(func):
     """
-    运行异步函数并等待结果
+    在线程池中执行数据库操作并等待结果
+    
+    任务在工作线程中推入当前应用的应用上下文，使用独立的作用域会话，
+    并在调用线程的上下文变量副本中执行(请求指标据此统计线程池中的查询)；
+    线程池已满时不排队，直接返回服务器繁忙(503)的结果。
     
     参数:
-    - func: 异步函数
+    - func: 需要执行的函数，返回带status_code的结果字典
     
     返回:
     - 函数结果
     """
-    result = func()
-    return result
+    app = current_app._get_current_object()
+    context = contextvars.copy_context()
+    
+    def run():
+        with app.app_context():
+            return func()
+    
+    def task():
+        return context.run(run)
+    
+    future = executor.submit(task)
+    if future is None:
+        return {
+            'message': '服务器繁忙，请稍后再试',
+            'code': -1,
+            'data': None,
+            'status_code': 503  # Service Unavailable
+        }
+    return future.result()
 
-def run_in_thread(func):
+def _slide(entry, window, offset, time_frame, max_calls):
     """
-    在线程池中运行函数
+    滑动窗口判断
     
     参数:
-    - func: 需要在线程中执行的函数
+    - entry: [窗口编号, 当前窗口请求数, 上一窗口请求数]，允许请求时原地更新
+    - window: 当前时间所在的窗口编号
+    - offset: 当前时间在窗口内已经过的秒数
+    - time_frame: 时间窗口(秒)
+    - max_calls: 时间窗口内最大请求数
     
     返回:
-    - 函数执行的Future
+    - 是否允许请求
     """
-    return thread_pool.submit(func)
-
-# 数据库连接池管理
-class DBConnectionPool:
-    """
-    数据库连接池管理类
+    if entry[0] != window:
+        # 进入新窗口，上一窗口之前的计数已完全滑出
+        entry[2] = entry[1] if entry[0] == window - 1 else 0
+        entry[1] = 0
+        entry[0] = window
     
-    管理SQLAlchemy数据库连接池配置
-    """
-    @staticmethod
-    def configure(app, pool_size=20, max_overflow=30, timeout=60):
-        """
-        配置SQLAlchemy数据库连接池
-        
-        参数:
-        - app: Flask应用实例
-        - pool_size: 连接池大小
-        - max_overflow: 最大溢出连接数
-        - timeout: 连接超时时间(秒)
-        """
-        app.config['SQLALCHEMY_ENGINE_OPTIONS'] = {
-            'pool_size': pool_size,
-            'max_overflow': max_overflow,
-            'pool_timeout': timeout,
-            'pool_recycle': 1800,  # 30分钟后回收连接
-            'pool_pre_ping': True  # 使用前测试连接是否有效
-        }
+    # 上一个窗口按剩余比例计入
+    estimated = entry[2] * (1 - offset / time_frame) + entry[1]
+    if estimated >= max_calls:
+        return False
+    
+    entry[1] += 1
+    return True
 
-class AsyncDatabase:
+class SqliteRateLimitStorage:
     """
-    异步数据库操作工具类
+    跨进程共享的限流计数存储
     
-    提供异步方式执行数据库操作的方法
+    计数保存在本机的SQLite文件中，每次判断在一个IMMEDIATE事务内完成读取和更新，
+    所有Gunicorn工作进程共用同一份计数，不需要额外的外部服务。
     """
     
-    @staticmethod
-    async def execute_query(query_func, *args, **kwargs):
+    def __init__(self, path, sweep_every=1000):
         """
-        异步执行数据库查询
+        初始化存储
         
         参数:
-        - query_func: 查询函数
-        - args, kwargs: 传递给查询函数的参数
-        
-        返回:
-        - 查询结果
+        - path: SQLite文件路径
+        - sweep_every: 每个连接处理多少次请求后清理一次过期计数
         """
-        loop = asyncio.get_event_loop()
-        return await loop.run_in_executor(
-            thread_pool, 
-            functools.partial(query_func, *args, **kwargs)
-        )
+        self.path = path
+        self.sweep_every = sweep_every
+        self._local = threading.local()
+        directory = os.path.dirname(os.path.abspath(path))
+        if not os.path.exists(directory):
+            os.makedirs(directory)
     
-    @staticmethod
-    async def execute_transaction(transaction_func, *args, **kwargs):
+    def _connect(self):
+        """获取当前线程的连接，fork后的子进程重新连接"""
+        conn = getattr(self._local, 'conn', None)
+        if conn is None or self._local.pid != os.getpid():
+            conn = sqlite3.connect(self.path, timeout=5, isolation_level=None)
+            # 计数只是临时数据，不需要每次同步到磁盘
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=OFF')
+            conn.execute('CREATE TABLE IF NOT EXISTS rate_limit ('
+                         'key TEXT PRIMARY KEY, time_frame REAL NOT NULL, window INTEGER NOT NULL, '
+                         'current INTEGER NOT NULL, previous INTEGER NOT NULL)')
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+            self._local.calls = 0
+        return conn
+    
+    def hit(self, name, client_id, max_calls, time_frame):
         """
-        异步执行数据库事务
+        记录一次请求并判断是否允许
         
         参数:
-        - transaction_func: 事务函数
-        - args, kwargs: 传递给事务函数的参数
+        - name: 限流器名称
+        - client_id: 客户端标识
+        - max_calls: 时间窗口内最大请求数
+        - time_frame: 时间窗口(秒)
         
         返回:
-        - 事务执行结果
+        - 是否允许请求
         """
-        loop = asyncio.get_event_loop()
-        return await loop.run_in_executor(
-            thread_pool, 
-            functools.partial(transaction_func, *args, **kwargs)
-        )
+        conn = self._connect()
+        key = f'{name}:{client_id}'
+        # 各进程的单调时钟互不相关，使用系统时间划分窗口
+        window, offset = divmod(time.time(), time_frame)
+        window = int(window)
+        
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            self._local.calls += 1
+            if self._local.calls % self.sweep_every == 0:
+                # 清理两个窗口内没有请求的客户端
+                conn.execute('DELETE FROM rate_limit WHERE window < CAST(? / time_frame AS INTEGER) - 1',
+                             (time.time(),))
+            
+            row = conn.execute('SELECT window, current, previous FROM rate_limit WHERE key = ?', (key,)).fetchone()
+            entry = list(row) if row else [window, 0, 0]
+            allowed = _slide(entry, window, offset, time_frame, max_calls)
+            if allowed:
+                conn.execute('INSERT OR REPLACE INTO rate_limit (key, time_frame, window, current, previous) '
+                             'VALUES (?, ?, ?, ?, ?)', (key, time_frame, entry[0], entry[1], entry[2]))
+            conn.execute('COMMIT')
+            return allowed
+        except Exception:
+            conn.execute('ROLLBACK')
+            raise
+
+# 跨进程共享的限流存储，为None时各进程在内存中独立计数
+shared_storage = None
+
+def configure_rate_limit_storage(storage):
+    """
+    按配置选择限流计数存储
+    
+    参数:
+    - storage: memory表示进程内存计数，其他值为共享计数的SQLite文件路径
+    """
+    global shared_storage
+    if not storage or storage == 'memory':
+        shared_storage = None
+    else:
+        shared_storage = SqliteRateLimitStorage(storage)
 
 class RateLimiter:
     """
     请求限流器
     
-    控制API请求速率，防止系统过载
+    控制API请求速率，防止系统过载。
+    使用滑动窗口计数：每个客户端只保存当前窗口和上一个窗口的请求数，
+    按上一个窗口在滑动窗口中剩余的比例估算请求数，判断复杂度为O(1)。
+    配置了共享存储时计数保存在共享存储中，对所有工作进程生效；
+    否则在进程内存中计数，客户端按哈希分散到多个分段锁上，长时间没有请求的客户端会被清理。
     """
     
-    def __init__(self, max_calls, time_frame):
+    def __init__(self, max_calls, time_frame, name='default', stripes=16, sweep_every=1024):
         """
         初始化限流器
         
         参数:
         - max_calls: 时间窗口内最大请求数
         - time_frame: 时间窗口(秒)
+        - name: 限流器名称，在共享存储中区分不同限流器的计数
+        - stripes: 分段锁数量
+        - sweep_every: 每个分段处理多少次请求后清理一次空闲客户端
         """
         self.max_calls = max_calls
         self.time_frame = time_frame
-        self.calls = {}  # 改为字典存储，key为客户端标识
-        self.lock = threading.Lock()
+        self.name = name
+        self.sweep_every = sweep_every
+        # 每个分段: [锁, {客户端标识: [窗口编号, 当前窗口请求数, 上一窗口请求数]}, 请求计数]
+        self._stripes = [[threading.Lock(), {}, 0] for _ in range(stripes)]
     
     def try_acquire(self, client_id=None):
         """
@@ -130,60 +306,96 @@ class RateLimiter:
         返回:
         - 是否允许请求
         """
-        current_time = asyncio.get_event_loop().time()
+        storage = shared_storage
+        if storage is not None:
+            try:
+                return storage.hit(self.name, client_id, self.max_calls, self.time_frame)
+            except sqlite3.Error as e:
+                # 共享存储不可用时不拦截请求
+                current_app.logger.warning('限流计数存储异常: %s', str(e))
+                return True
         
-        with self.lock:
-            # 为每个客户端单独计数
-            if client_id not in self.calls:
-                self.calls[client_id] = []
-            
-            # 移除过期的请求记录
-            self.calls[client_id] = [call_time for call_time in self.calls[client_id] 
-                                    if current_time - call_time < self.time_frame]
-            
-            # 检查是否超过限制
-            if len(self.calls[client_id]) >= self.max_calls:
-                return False
+        now = time.monotonic()
+        window, offset = divmod(now, self.time_frame)
+        window = int(window)
+        stripe = self._stripes[hash(client_id) % len(self._stripes)]
+        
+        with stripe[0]:
+            calls = stripe[1]
+            stripe[2] += 1
+            if stripe[2] % self.sweep_every == 0:
+                self._sweep(calls, window)
             
-            # 记录新请求
-            self.calls[client_id].append(current_time)
-            return True
+            entry = calls.get(client_id)
+            if entry is None:
+                entry = calls[client_id] = [window, 0, 0]
+            return _slide(entry, window, offset, self.time_frame, self.max_calls)
+    
+    @staticmethod
+    def _sweep(calls, window):
+        """清理两个窗口内没有请求的客户端"""
+        idle = [client_id for client_id, entry in calls.items() if entry[0] < window - 1]
+        for client_id in idle:
+            del calls[client_id]
+    
+    def __len__(self):
+        """当前在进程内存中跟踪的客户端数"""
+        return sum(len(stripe[1]) for stripe in self._stripes)
 
 # 全局API速率限制器
-api_rate_limiter = RateLimiter(max_calls=100, time_frame=60)  # 每个客户端每分钟100个请求
+api_rate_limiter = RateLimiter(max_calls=100, time_frame=60, name='api')  # 每个客户端每分钟100个请求
 
-# 请求并发控制函数
-def concurrency_control(max_concurrent=50):
+def get_client_key(key):
     """
-    并发控制装饰器
+    获取当前请求的限流标识
     
-    限制函数的并发执行数量
+    参数:
+    - key: 标识类型，ip为客户端IP，其他值为同名的URL参数(如token、phone)
+    
+    返回:
+    - 标识值，请求中没有该参数时返回None
+    """
+    if key == 'ip':
+        return request.remote_addr
+    return request.args.get(key)
+
+def rate_limited_response(limiter):
+    """构造超出限流时的响应"""
+    response = jsonify({
+        'message': '请求过于频繁，请稍后再试',
+        'code': -1,
+        'data': None
+    })
+    response.status_code = 429  # Too Many Requests
+    response.headers['Retry-After'] = str(int(limiter.time_frame))
+    return response
+
+def rate_limit(max_calls, time_frame, key='ip'):
+    """
+    路由限流装饰器
+    
+    按指定的标识对单个路由限流，可叠加多个装饰器同时按不同标识限流。
     
     参数:
-    - max_concurrent: 最大并发数
+    - max_calls: 时间窗口内最大请求数
+    - time_frame: 时间窗口(秒)
+    - key: 限流标识，ip、token、phone等
     
     返回:
     - 装饰后的函数
     """
-    semaphore = threading.Semaphore(max_concurrent)
-    
     def decorator(func):
+        limiter = RateLimiter(max_calls=max_calls, time_frame=time_frame, name=f'{func.__name__}:{key}')
+        
         @functools.wraps(func)
         def wrapper(*args, **kwargs):
-            acquired = semaphore.acquire(blocking=False)
-            if not acquired:
-                return {
-                    'message': '服务器繁忙，请稍后再试',
-                    'code': -1,
-                    'data': None,
-                    'status_code': 503  # Service Unavailable
-                }
-            
-            try:
-                return func(*args, **kwargs)
-            finally:
-                semaphore.release()
+            if current_app.config.get('RATE_LIMIT_ENABLED', True):
+                client_id = get_client_key(key)
+                if client_id is not None and not limiter.try_acquire(client_id):
+                    return rate_limited_response(limiter)
+            return func(*args, **kwargs)
         
+        wrapper.rate_limiter = limiter
         return wrapper
     
-    return decorator 
\ No newline at end of file
+    return decorator
@@ -0,0 +1,143 @@
+import threading
+import time
+from collections import OrderedDict
+
+import jwt
+from flask import current_app
+
+from log_util import bind_log_context
+from models import User
+
+# 认证失败时返回的错误信息
+INVALID_TOKEN_MESSAGE = '无效的token，请重新登录'
+EXPIRED_TOKEN_MESSAGE = 'token已过期，请重新登录'
+MALFORMED_TOKEN_MESSAGE = '无效的token格式'
+
+
+class TokenCache:
+    """
+    已验证token缓存
+
+    缓存 token -> 用户ID 的映射，带容量上限(LRU淘汰)和过期时间(TTL)，
+    命中时可跳过按token查表和jwt签名校验。
+    """
+
+    def __init__(self, max_size=10000, ttl=300):
+        """
+        初始化token缓存
+
+        参数:
+        - max_size: 最大缓存条目数，超出后淘汰最久未使用的条目
+        - ttl: 条目有效期(秒)，不会超过token自身的过期时间
+        """
+        self.max_size = max_size
+        self.ttl = ttl
+        self._entries = OrderedDict()  # token -> (user_id, 过期时间戳)
+        self._lock = threading.Lock()
+
+    def get(self, token):
+        """
+        查询缓存
+
+        参数:
+        - token: 用户token
+
+        返回:
+        - 用户ID，未命中或已过期时返回None
+        """
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(token)
+            if entry is None:
+                return None
+            user_id, expires_at = entry
+            if expires_at <= now:
+                del self._entries[token]
+                return None
+            self._entries.move_to_end(token)
+            return user_id
+
+    def put(self, token, user_id, token_exp=None):
+        """
+        写入缓存
+
+        参数:
+        - token: 用户token
+        - user_id: 用户ID
+        - token_exp: token自身的过期时间戳(jwt中的exp字段)，可选
+        """
+        expires_at = time.time() + self.ttl
+        if token_exp is not None:
+            expires_at = min(expires_at, token_exp)
+        with self._lock:
+            self._entries[token] = (user_id, expires_at)
+            self._entries.move_to_end(token)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def discard(self, token):
+        """
+        使token缓存失效，在登录、修改密码等更换token的操作时调用
+
+        参数:
+        - token: 需要失效的token
+        """
+        if not token:
+            return
+        with self._lock:
+            self._entries.pop(token, None)
+
+    def clear(self):
+        """清空缓存"""
+        with self._lock:
+            self._entries.clear()
+
+
+# 全局token缓存
+token_cache = TokenCache(max_size=10000, ttl=300)
+
+
+def authenticate(session, token):
+    """
+    根据token验证用户身份
+
+    先查询已验证token缓存，命中时只需按主键加载用户并确认token未被更换；
+    未命中时通过token索引查找用户并校验jwt有效期，校验通过后写入缓存。
+
+    参数:
+    - session: 数据库会话
+    - token: 用户token
+
+    返回:
+    - (user, None): 验证成功
+    - (None, message): 验证失败及失败原因
+    """
+    if not token:
+        return None, INVALID_TOKEN_MESSAGE
+
+    user_id = token_cache.get(token)
+    if user_id is not None:
+        user = session.get(User, user_id)
+        # 其他工作进程可能已经更换了token，以数据库中的token为准
+        if user is not None and user.token == token:
+            bind_log_context(user_id=user.id)
+            return user, None
+        token_cache.discard(token)
+        return None, INVALID_TOKEN_MESSAGE
+
+    # 查找具有该token的用户
+    user = session.query(User).filter_by(token=token).first()
+    if not user:
+        return None, INVALID_TOKEN_MESSAGE
+
+    try:
+        # 验证token有效期
+        decoded_token = jwt.decode(token, current_app.config['SECRET_KEY'], algorithms=["HS256"])
+    except jwt.ExpiredSignatureError:
+        return None, EXPIRED_TOKEN_MESSAGE
+    except jwt.InvalidTokenError:
+        return None, MALFORMED_TOKEN_MESSAGE
+
+    token_cache.put(token, user.id, decoded_token.get('exp'))
+    bind_log_context(user_id=user.id)
+    return user, None
@@ -0,0 +1,126 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+短信验证码提取基准测试
+生成多种格式的短信，比较逐条逐模板匹配与预编译模板批量提取的耗时，
+并校验提取结果是否正确
+
+用法: python benchmarks/bench_extract.py [--messages 100000] [--projects 50] [--templates 4]
+"""
+
+import argparse
+import os
+import random
+import re
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from sms_extract import CODE_PATTERN, CodeExtractor, GENERIC_DIGITS_RE, GENERIC_KEYWORD_RE  # noqa: E402
+
+# 模板格式，{name}为项目名称
+TEMPLATE_FORMATS = [
+    '【{name}】您的登录验证码{{code}}。如非本人操作，请不要把验证码泄露给任何人。',
+    '【{name}】验证码：{{code}}，5分钟内有效，请勿告知他人。',
+    '[{name}] Your verification code is {{code}}. It expires in 10 minutes.',
+    '【{name}】您正在注册{name}账号，校验码{{code}}，如非本人操作请忽略。',
+    '{name}: {{code}} is your code. Do not share it.',
+    '【{name}】动态密码{{code}}，您正在进行身份验证，切勿泄露。',
+]
+
+# 没有注册模板的短信格式，由通用规则处理
+UNREGISTERED_FORMATS = [
+    '【{name}】您的验证码是{code}，请于2分钟内填写。客服电话4008123123。',
+    '{name}提醒您：确认码 {code}，10分钟内有效。',
+    '尊敬的用户，本次操作的动态码为{code}。',
+]
+
+
+def build_messages(count, projects, templates_per_project, rng):
+    """生成测试短信，返回(模板配置, 短信列表, 期望验证码列表)"""
+    templates = {}
+    for i in range(projects):
+        name = f'项目{i}'
+        formats = rng.sample(TEMPLATE_FORMATS, templates_per_project)
+        templates[f'p{i}'] = [fmt.format(name=name) for fmt in formats]
+
+    messages = []
+    expected = []
+    for _ in range(count):
+        project_id = f'p{rng.randrange(projects)}'
+        code = '%06d' % rng.randrange(10 ** 6)
+        if rng.random() < 0.8:
+            content = rng.choice(templates[project_id]).replace('{code}', code)
+        else:
+            content = rng.choice(UNREGISTERED_FORMATS).format(name=project_id, code=code)
+        messages.append({'project_id': project_id, 'content': content})
+        expected.append(code)
+    return templates, messages, expected
+
+
+def naive_extract_many(templates, messages):
+    """逐条短信、逐个模板调用re.search的朴素实现，作为对照"""
+    patterns = {
+        project_id: [re.escape(prefix) + f'({CODE_PATTERN})' + re.escape(suffix)
+                     for prefix, suffix in (template.split('{code}') for template in project_templates)]
+        for project_id, project_templates in templates.items()
+    }
+    codes = []
+    for message in messages:
+        content = message['content']
+        for pattern in patterns.get(message['project_id'], ()):
+            match = re.search(pattern, content)
+            if match:
+                codes.append(match.group(1))
+                break
+        else:
+            match = re.search(GENERIC_KEYWORD_RE.pattern, content, re.IGNORECASE) or \
+                re.search(GENERIC_DIGITS_RE.pattern, content)
+            codes.append(match.group(1) if match else None)
+    return codes
+
+
+def measure(func, repeat):
+    """执行repeat次，返回最短耗时(秒)和最后一次的结果"""
+    best = None
+    result = None
+    for _ in range(repeat):
+        started = time.perf_counter()
+        result = func()
+        elapsed = time.perf_counter() - started
+        best = elapsed if best is None else min(best, elapsed)
+    return best, result
+
+
+def main():
+    parser = argparse.ArgumentParser(description='短信验证码提取基准测试')
+    parser.add_argument('--messages', type=int, default=100000, help='短信数量')
+    parser.add_argument('--projects', type=int, default=50, help='项目数量')
+    parser.add_argument('--templates', type=int, default=4, help='每个项目的模板数')
+    parser.add_argument('--repeat', type=int, default=3, help='重复次数，取最短耗时')
+    parser.add_argument('--seed', type=int, default=0, help='随机种子')
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    templates, messages, expected = build_messages(args.messages, args.projects, args.templates, rng)
+
+    extractor = CodeExtractor()
+    for project_id, project_templates in templates.items():
+        extractor.register(project_id, *project_templates)
+
+    results = {
+        '逐模板re.search': measure(lambda: naive_extract_many(templates, messages), args.repeat),
+        '预编译extract_many': measure(lambda: extractor.extract_many(messages), args.repeat),
+    }
+
+    print(f"短信 {args.messages} 条，项目 {args.projects} 个，每个项目模板 {args.templates} 个")
+    for name, (elapsed, codes) in results.items():
+        correct = sum(code == want for code, want in zip(codes, expected))
+        print(f"{name:<20} {elapsed * 1e6 / args.messages:6.2f} µs/条  "
+              f"{args.messages / elapsed:10.0f} 条/秒  正确 {correct}/{args.messages}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,126 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+索引基准测试
+在大数据量下比较补建组合索引前后热点查询的延迟
+
+用法: python benchmarks/bench_indexes.py [--rows 1000000] [--database URI] [--repeat 200]
+"""
+
+import argparse
+import os
+import random
+import statistics
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from sqlalchemy import create_engine, insert, text
+from sqlalchemy.orm import Session
+
+from migrations import ensure_indexes
+from models import db, User, PhoneNumber, BlacklistedPhone
+
+PROJECT_COUNT = 100
+CHUNK_SIZE = 50000
+
+
+def populate(engine, rows):
+    """写入测试数据：rows条已分配号码和rows条黑名单号码"""
+    user_count = max(1, rows // 1000)
+    with engine.begin() as conn:
+        conn.execute(insert(User.__table__), [{
+            'id': i + 1,
+            'username': f'bench{i}',
+            'password': 'x',
+            'email': f'bench{i}@example.com',
+            'security_question': 'q? a',
+            'balance': 0.0
+        } for i in range(user_count)])
+
+    for start in range(0, rows, CHUNK_SIZE):
+        end = min(start + CHUNK_SIZE, rows)
+        with engine.begin() as conn:
+            conn.execute(insert(PhoneNumber.__table__), [{
+                'phone': f'1{i:010d}',
+                'user_id': i % user_count + 1,
+                'project_id': f'p{i % PROJECT_COUNT}',
+                'status': i % 2
+            } for i in range(start, end)])
+            conn.execute(insert(BlacklistedPhone.__table__), [{
+                'phone': f'2{i:010d}',
+                'user_id': i % user_count + 1,
+                'project_id': f'p{i % PROJECT_COUNT}'
+            } for i in range(start, end)])
+    return user_count
+
+
+def drop_indexes(engine):
+    """删除模型中声明的非唯一索引，模拟迁移前的数据库"""
+    with engine.begin() as conn:
+        for table in db.metadata.sorted_tables:
+            for index in table.indexes:
+                conn.execute(text(f'DROP INDEX IF EXISTS {index.name}'))
+
+
+def measure(engine, rows, user_count, repeat):
+    """执行各热点查询并统计延迟(毫秒)"""
+    rng = random.Random(42)
+    queries = {
+        'phone+user+project': lambda s, i: s.query(PhoneNumber).filter_by(
+            phone=f'1{i:010d}', user_id=i % user_count + 1, project_id=f'p{i % PROJECT_COUNT}').first(),
+        'user+project+status': lambda s, i: s.query(PhoneNumber.phone).filter_by(
+            user_id=i % user_count + 1, project_id=f'p{i % PROJECT_COUNT}', status=1).all(),
+        'blacklist phone+project': lambda s, i: s.query(BlacklistedPhone).filter_by(
+            phone=f'2{i:010d}', project_id=f'p{i % PROJECT_COUNT}').first(),
+    }
+    results = {}
+    with Session(engine) as session:
+        for name, query in queries.items():
+            samples = []
+            for _ in range(repeat):
+                i = rng.randrange(rows)
+                started = time.perf_counter()
+                query(session, i)
+                samples.append((time.perf_counter() - started) * 1000)
+            samples.sort()
+            results[name] = (statistics.median(samples), samples[int(len(samples) * 0.99) - 1])
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description='组合索引基准测试')
+    parser.add_argument('--rows', type=int, default=1000000, help='号码表和黑名单表的数据量')
+    parser.add_argument('--database', help='数据库URI，默认使用临时SQLite文件')
+    parser.add_argument('--repeat', type=int, default=200, help='每个查询的执行次数')
+    args = parser.parse_args()
+
+    uri = args.database or 'sqlite:///' + os.path.join(tempfile.mkdtemp(), 'bench_indexes.db')
+    engine = create_engine(uri)
+    db.metadata.drop_all(engine)
+    db.metadata.create_all(engine)
+    drop_indexes(engine)
+
+    print(f"写入测试数据: {args.rows} 行 ({uri})")
+    started = time.perf_counter()
+    user_count = populate(engine, args.rows)
+    print(f"写入完成，耗时 {time.perf_counter() - started:.1f}s")
+
+    before = measure(engine, args.rows, user_count, args.repeat)
+
+    started = time.perf_counter()
+    created = ensure_indexes(engine)
+    print(f"补建索引 {', '.join(created)}，耗时 {time.perf_counter() - started:.1f}s")
+
+    after = measure(engine, args.rows, user_count, args.repeat)
+
+    print(f"\n{'查询':<26}{'迁移前 p50/p99 (ms)':>24}{'迁移后 p50/p99 (ms)':>24}")
+    for name in before:
+        print(f"{name:<26}{before[name][0]:>12.3f}/{before[name][1]:<11.3f}{after[name][0]:>12.3f}/{after[name][1]:<11.3f}")
+
+
+if __name__ == '__main__':
+    main()
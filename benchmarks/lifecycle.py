@@ -0,0 +1,248 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+号码生命周期基准测试
+在进程内的应用上以指定并发执行 注册 -> 登录 -> 充值 -> 取号 -> 获取验证码 -> 释放/加黑，
+统计每个步骤的p50/p99延迟和整体吞吐量，并与保存的基线比较，发现routes.py中的性能回退
+
+用法: python benchmarks/lifecycle.py [--users 16] [--iterations 50] [--repeat 3] [--database URI] [--config development]
+                                    [--baseline benchmarks/baseline_lifecycle.json] [--save-baseline]
+"""
+
+import argparse
+import json
+import os
+import random
+import statistics
+import sys
+import tempfile
+import threading
+import time
+from collections import defaultdict
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+BENCHMARK_DIR = os.path.dirname(os.path.abspath(__file__))
+DEFAULT_BASELINE = os.path.join(BENCHMARK_DIR, 'baseline_lifecycle.json')
+
+# 生命周期中的步骤，按执行顺序排列
+STEPS = ('register', 'login', 'recharge', 'get_phone', 'get_sms_code', 'release_phone', 'blacklist_phone')
+
+# 与基线比较延迟时要求的最少样本数，样本太少时分位数波动大，不参与比较
+# (注册、登录等每个用户只执行一次的步骤，以及加黑等次数较少步骤的p99)
+MIN_SAMPLES = {'p50_ms': 100, 'p99_ms': 1000}
+
+
+def percentile(values, fraction):
+    """返回已排序列表的分位数"""
+    if not values:
+        return 0.0
+    index = min(len(values) - 1, max(0, int(round(fraction * len(values))) - 1))
+    return values[index]
+
+
+def run_lifecycle(app, users, iterations, blacklist_ratio, sms_polls, seed):
+    """
+    并发执行号码生命周期
+
+    返回:
+    - (步骤 -> 延迟列表, 步骤 -> 错误数, 总耗时)
+    """
+    latencies = defaultdict(list)
+    errors = defaultdict(int)
+    lock = threading.Lock()
+    run_id = f'{int(time.time())}{random.Random(seed).randrange(10 ** 6)}'
+
+    def user(index):
+        rng = random.Random(seed + index)
+        client = app.test_client()
+        local_latencies = defaultdict(list)
+        local_errors = defaultdict(int)
+
+        def call(step, path, **params):
+            started = time.perf_counter()
+            resp = client.get('/api/' + path, query_string=params)
+            local_latencies[step].append(time.perf_counter() - started)
+            body = resp.get_json(silent=True) or {}
+            if resp.status_code >= 400:
+                local_errors[step] += 1
+            return resp.status_code, body
+
+        username = f'bench_{run_id}_{index}'
+        call('register', 'register', username=username, password='bench',
+             email=f'{username}@example.com', security_question='q? a')
+        status, body = call('login', 'login', username=username, password='bench')
+        if status != 200:
+            with lock:
+                errors['login'] += 1
+            return
+        token = body['user']['token']
+        call('recharge', 'recharge', token=token, amount=iterations * 10)
+
+        for _ in range(iterations):
+            status, body = call('get_phone', 'get_phone', token=token, project_id='bench')
+            if status != 200 or not body.get('stat'):
+                continue
+            phone = body['data']
+            for _ in range(sms_polls):
+                status, body = call('get_sms_code', 'get_sms_code', token=token, project_id='bench', phone=phone)
+                if status != 200 or body.get('code'):
+                    break
+            if rng.random() < blacklist_ratio:
+                call('blacklist_phone', 'blacklist_phone', token=token, project_id='bench', phone=phone)
+            else:
+                call('release_phone', 'release_phone', token=token, project_id='bench', phone=phone)
+
+        with lock:
+            for step, values in local_latencies.items():
+                latencies[step].extend(values)
+            for step, count in local_errors.items():
+                errors[step] += count
+
+    threads = [threading.Thread(target=user, args=(i,)) for i in range(users)]
+    started = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return latencies, errors, time.perf_counter() - started
+
+
+def summarize(latencies, errors, elapsed):
+    """汇总每个步骤的延迟分位数和整体吞吐量"""
+    steps = {}
+    total = 0
+    for step in STEPS:
+        values = sorted(latencies.get(step, ()))
+        total += len(values)
+        if not values:
+            continue
+        steps[step] = {
+            'count': len(values),
+            'errors': errors.get(step, 0),
+            'p50_ms': round(statistics.median(values) * 1000, 3),
+            'p99_ms': round(percentile(values, 0.99) * 1000, 3),
+        }
+    return {
+        'requests': total,
+        'elapsed_s': round(elapsed, 3),
+        'throughput': round(total / elapsed, 1) if elapsed else 0.0,
+        'steps': steps
+    }
+
+
+def compare(result, baseline, tolerance):
+    """
+    与基线比较
+
+    返回:
+    - 回退说明列表，没有回退时为空
+    """
+    regressions = []
+    if result['throughput'] < baseline['throughput'] * (1 - tolerance):
+        regressions.append(f"吞吐量 {result['throughput']} req/s 低于基线 {baseline['throughput']} req/s")
+    for step, stats in result['steps'].items():
+        base = baseline['steps'].get(step)
+        if not base:
+            continue
+        for key in ('p50_ms', 'p99_ms'):
+            if min(stats['count'], base['count']) < MIN_SAMPLES[key]:
+                continue
+            if stats[key] > base[key] * (1 + tolerance):
+                regressions.append(f"{step} {key} {stats[key]} 高于基线 {base[key]}")
+        if stats['errors'] > base['errors']:
+            regressions.append(f"{step} 错误数 {stats['errors']} 多于基线 {base['errors']}")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description='号码生命周期基准测试')
+    parser.add_argument('--users', type=int, default=16, help='并发用户数')
+    parser.add_argument('--iterations', type=int, default=50, help='每个用户的取号次数')
+    parser.add_argument('--blacklist-ratio', type=float, default=0.1, help='加黑(而不是释放)号码的比例')
+    parser.add_argument('--sms-polls', type=int, default=3, help='每个号码最多查询验证码的次数')
+    parser.add_argument('--seed', type=int, default=0, help='随机种子')
+    parser.add_argument('--database', help='数据库URI，默认使用临时SQLite文件，也可以是本地PostgreSQL')
+    parser.add_argument('--config', default='development', help='应用配置名称，production使用生产环境的连接池参数')
+    parser.add_argument('--baseline', default=DEFAULT_BASELINE, help='基线文件路径')
+    parser.add_argument('--save-baseline', action='store_true', help='把本次结果保存为基线')
+    parser.add_argument('--repeat', type=int, default=3, help='重复执行次数，合并所有样本统计')
+    parser.add_argument('--tolerance', type=float, default=0.5, help='允许相对基线变差的比例')
+    parser.add_argument('--output', help='把本次结果写入JSON文件')
+    args = parser.parse_args()
+
+    baseline_path = os.path.abspath(args.baseline)
+    output_path = os.path.abspath(args.output) if args.output else None
+
+    workdir = tempfile.mkdtemp()
+    os.environ['DATABASE_URI'] = args.database or 'sqlite:///' + os.path.join(workdir, 'lifecycle.db')
+    os.chdir(workdir)
+
+    from app import create_app, create_tables
+    from models import db, Project
+
+    app = create_app(args.config)
+    app.config['DEBUG'] = False
+    app.config['RATE_LIMIT_ENABLED'] = False
+    create_tables(app)
+    with app.app_context():
+        if not db.session.query(Project).filter_by(project_id='bench').first():
+            db.session.add(Project(project_id='bench', name='基准测试', amount=0.1))
+            db.session.commit()
+
+    latencies, errors, elapsed = defaultdict(list), defaultdict(int), 0.0
+    for i in range(args.repeat):
+        run_latencies, run_errors, run_elapsed = run_lifecycle(
+            app, args.users, args.iterations, args.blacklist_ratio, args.sms_polls, args.seed + i * args.users)
+        for step, values in run_latencies.items():
+            latencies[step].extend(values)
+        for step, count in run_errors.items():
+            errors[step] += count
+        elapsed += run_elapsed
+    result = summarize(latencies, errors, elapsed)
+    result['params'] = {
+        'users': args.users,
+        'iterations': args.iterations,
+        'repeat': args.repeat,
+        'blacklist_ratio': args.blacklist_ratio,
+        'sms_polls': args.sms_polls,
+        'database': 'sqlite' if not args.database else args.database.split(':', 1)[0]
+    }
+
+    print(f"并发用户 {args.users}，每用户取号 {args.iterations} 次，重复 {args.repeat} 次，"
+          f"数据库 {result['params']['database']}")
+    print(f"{'步骤':<16}{'请求数':>8}{'错误':>6}{'p50(ms)':>10}{'p99(ms)':>10}")
+    for step, stats in result['steps'].items():
+        print(f"{step:<18}{stats['count']:>8}{stats['errors']:>6}{stats['p50_ms']:>10.2f}{stats['p99_ms']:>10.2f}")
+    print(f"共 {result['requests']} 个请求，耗时 {result['elapsed_s']}s，吞吐量 {result['throughput']} req/s")
+
+    if output_path:
+        with open(output_path, 'w') as f:
+            json.dump(result, f, ensure_ascii=False, indent=2)
+
+    if args.save_baseline:
+        with open(baseline_path, 'w') as f:
+            json.dump(result, f, ensure_ascii=False, indent=2)
+        print(f"已保存基线: {baseline_path}")
+        return
+
+    if not os.path.exists(baseline_path):
+        print("没有基线文件，使用 --save-baseline 保存本次结果作为基线")
+        return
+
+    with open(baseline_path) as f:
+        baseline = json.load(f)
+    if baseline.get('params') != result['params']:
+        print(f"警告: 基线参数 {baseline.get('params')} 与本次参数不同，比较结果仅供参考")
+    regressions = compare(result, baseline, args.tolerance)
+    if regressions:
+        print(f"与基线相比出现性能回退(容差 {args.tolerance:.0%}):")
+        for line in regressions:
+            print("  " + line)
+        sys.exit(1)
+    print(f"与基线相比没有性能回退(容差 {args.tolerance:.0%})")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,133 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+数据库操作线程池负载测试
+在本地多线程WSGI服务器上用大量并发客户端反复取号和释放号码，
+比较在请求线程中同步执行与交给有界线程池执行时的吞吐量、延迟和错误数
+
+用法: python benchmarks/load_async.py [--clients 64] [--duration 10] [--workers 10] [--database URI]
+"""
+
+import argparse
+import json
+import os
+import statistics
+import sys
+import tempfile
+import threading
+import time
+import urllib.error
+import urllib.parse
+import urllib.request
+from collections import Counter
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+def request(base_url, path, **params):
+    """发送GET请求，返回(状态码, 响应JSON)"""
+    url = f"{base_url}{path}?{urllib.parse.urlencode(params)}"
+    try:
+        with urllib.request.urlopen(url, timeout=60) as resp:
+            return resp.status, json.loads(resp.read())
+    except urllib.error.HTTPError as e:
+        return e.code, json.loads(e.read() or b'{}')
+
+
+def run_load(base_url, token, clients, duration):
+    """并发执行 取号 -> 释放 循环，返回统计结果"""
+    latencies = []
+    statuses = Counter()
+    lock = threading.Lock()
+    deadline = time.perf_counter() + duration
+
+    def client():
+        local_latencies = []
+        local_statuses = Counter()
+        while time.perf_counter() < deadline:
+            started = time.perf_counter()
+            status, body = request(base_url, '/api/get_phone', token=token, project_id='load')
+            local_latencies.append(time.perf_counter() - started)
+            local_statuses[status] += 1
+            if status == 200 and body.get('stat'):
+                started = time.perf_counter()
+                status, _ = request(base_url, '/api/release_phone', token=token, project_id='load', phone=body['data'])
+                local_latencies.append(time.perf_counter() - started)
+                local_statuses[status] += 1
+        with lock:
+            latencies.extend(local_latencies)
+            statuses.update(local_statuses)
+
+    threads = [threading.Thread(target=client) for _ in range(clients)]
+    started = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - started
+
+    latencies.sort()
+    return {
+        'requests': len(latencies),
+        'throughput': len(latencies) / elapsed,
+        'p50_ms': statistics.median(latencies) * 1000 if latencies else 0,
+        'p99_ms': latencies[int(len(latencies) * 0.99) - 1] * 1000 if latencies else 0,
+        'statuses': dict(statuses)
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description='数据库操作线程池负载测试')
+    parser.add_argument('--clients', type=int, default=64, help='并发客户端数')
+    parser.add_argument('--duration', type=float, default=10, help='每种模式的测试时长(秒)')
+    parser.add_argument('--workers', type=int, default=10, help='线程池工作线程数')
+    parser.add_argument('--pending', type=int, default=100, help='线程池最大排队数')
+    parser.add_argument('--database', help='数据库URI，默认使用临时SQLite文件')
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp()
+    os.environ['DATABASE_URI'] = args.database or 'sqlite:///' + os.path.join(workdir, 'load.db')
+    os.chdir(workdir)
+
+    from werkzeug.serving import make_server
+
+    import async_util
+    from app import create_app, create_tables
+    from models import db, Project, PhoneNumber, User
+
+    app = create_app('development')
+    app.config['DEBUG'] = False
+    app.config['RATE_LIMIT_ENABLED'] = False
+    create_tables(app)
+    with app.app_context():
+        db.session.query(PhoneNumber).delete()
+        db.session.query(User).filter_by(username='load').delete()
+        db.session.query(Project).filter_by(project_id='load').delete()
+        db.session.add(Project(project_id='load', name='负载测试', amount=0.1))
+        db.session.commit()
+
+    server = make_server('127.0.0.1', 0, app, threaded=True)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    base_url = f'http://127.0.0.1:{server.server_port}'
+
+    request(base_url, '/api/register', username='load', password='load',
+            email='load@example.com', security_question='q? a')
+    token = request(base_url, '/api/login', username='load', password='load')[1]['user']['token']
+    request(base_url, '/api/recharge', token=token, amount=1000000)
+
+    results = {}
+    for mode, workers in (('同步执行', 0), ('有界线程池', args.workers)):
+        async_util.configure_executor(workers, args.pending)
+        results[mode] = run_load(base_url, token, args.clients, args.duration)
+
+    server.shutdown()
+
+    print(f"并发客户端 {args.clients}，每种模式 {args.duration}s，数据库 {os.environ['DATABASE_URI']}")
+    for mode, result in results.items():
+        print(f"{mode}: {result['throughput']:.1f} req/s, p50 {result['p50_ms']:.1f}ms, "
+              f"p99 {result['p99_ms']:.1f}ms, 状态码 {result['statuses']}")
+
+
+if __name__ == '__main__':
+    main()
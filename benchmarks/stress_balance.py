@@ -0,0 +1,114 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+余额并发压力测试
+多个线程用同一账户并发取号、批量取号和释放号码，
+结束后校验余额与冻结金额之和保持不变且余额从未透支
+
+用法: python benchmarks/stress_balance.py [--threads 16] [--requests 50] [--database URI]
+"""
+
+import argparse
+import os
+import random
+import sys
+import tempfile
+import threading
+import time
+from collections import Counter
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+def main():
+    parser = argparse.ArgumentParser(description='余额并发压力测试')
+    parser.add_argument('--threads', type=int, default=16, help='并发线程数')
+    parser.add_argument('--requests', type=int, default=50, help='每个线程的请求数')
+    parser.add_argument('--recharge', type=float, default=20.0, help='初始充值金额')
+    parser.add_argument('--price', type=float, default=0.5, help='项目价格')
+    parser.add_argument('--database', help='数据库URI，默认使用临时SQLite文件')
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp()
+    os.environ['DATABASE_URI'] = args.database or 'sqlite:///' + os.path.join(workdir, 'stress.db')
+    os.chdir(workdir)
+
+    from app import create_app, create_tables
+    from billing import get_balance
+    from models import db, User, Project, PhoneNumber
+
+    app = create_app('development')
+    app.config['DEBUG'] = False
+    app.config['RATE_LIMIT_ENABLED'] = False
+    create_tables(app)
+    with app.app_context():
+        db.session.query(PhoneNumber).delete()
+        db.session.query(User).filter_by(username='stress').delete()
+        db.session.query(Project).filter_by(project_id='stress').delete()
+        db.session.add(Project(project_id='stress', name='压力测试', amount=args.price))
+        db.session.commit()
+
+    client = app.test_client()
+    client.get('/api/register', query_string={
+        'username': 'stress', 'password': 'stress', 'email': 'stress@example.com',
+        'security_question': 'q? a'})
+    token = client.get('/api/login', query_string={'username': 'stress', 'password': 'stress'}).get_json()['user']['token']
+    client.get('/api/recharge', query_string={'token': token, 'amount': args.recharge})
+
+    outcomes = Counter()
+    lock = threading.Lock()
+
+    def worker(seed):
+        rng = random.Random(seed)
+        local_client = app.test_client()
+        held = []
+        for _ in range(args.requests):
+            action = rng.random()
+            if action < 0.5:
+                resp = local_client.get('/api/get_phone', query_string={'token': token, 'project_id': 'stress'})
+                body = resp.get_json()
+                if body.get('stat'):
+                    held.append(body['data'])
+                key = ('get_phone', body.get('code'))
+            elif action < 0.7:
+                resp = local_client.get('/api/get_phones', query_string={'token': token, 'project_id': 'stress', 'count': 3})
+                body = resp.get_json()
+                if body.get('stat'):
+                    held.extend(body['data'])
+                key = ('get_phones', body.get('code'))
+            elif held:
+                phone = held.pop(rng.randrange(len(held)))
+                resp = local_client.get('/api/release_phone', query_string={'token': token, 'project_id': 'stress', 'phone': phone})
+                key = ('release_phone', resp.status_code)
+            else:
+                continue
+            with lock:
+                outcomes[key] += 1
+
+    started = time.perf_counter()
+    threads = [threading.Thread(target=worker, args=(i,)) for i in range(args.threads)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - started
+
+    with app.app_context():
+        user = db.session.query(User).filter_by(username='stress').one()
+        frozen = sum(row.frozen_amount for row in db.session.query(PhoneNumber).filter_by(user_id=user.id))
+        held_count = db.session.query(PhoneNumber).filter_by(user_id=user.id).count()
+        balance = get_balance(db.session, user.id)
+
+    print(f"耗时 {elapsed:.2f}s，请求结果:")
+    for (action, code), count in sorted(outcomes.items(), key=str):
+        print(f"  {action:<14} {str(code):<6} {count}")
+    print(f"最终余额 {balance:.2f}，持有号码 {held_count} 个，冻结金额 {frozen:.2f}")
+
+    consistent = abs(balance + frozen - args.recharge) < 1e-6 and balance >= -1e-9
+    print("余额一致性校验: " + ("通过" if consistent else "失败"))
+    sys.exit(0 if consistent else 1)
+
+
+if __name__ == '__main__':
+    main()
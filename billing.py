@@ -0,0 +1,337 @@
+import datetime
+import logging
+import math
+
+from sqlalchemy import BigInteger, Integer, String, DateTime, cast, delete, exists, func, insert, literal, select, text
+from sqlalchemy.orm import aliased
+
+from leader_worker import LeaderElectedWorker
+from models import BalanceEntry, BalanceSnapshot, User
+
+logger = logging.getLogger(__name__)
+
+# 流水类型
+REASON_RECHARGE = 'recharge'
+REASON_DEBIT = 'debit'
+REASON_REFUND = 'refund'
+
+# 流水金额列(BigInteger)可以保存的最大分数
+MAX_CENTS = 2 ** 63 - 1
+
+
+def to_cents(amount):
+    """
+    把以元为单位的金额换算为整数分
+
+    参数:
+    - amount: 金额(元)
+
+    返回:
+    - 金额(分)，非有限数或超出流水金额列范围时抛出ValueError
+    """
+    if not math.isfinite(amount):
+        raise ValueError(f'无效的金额: {amount}')
+    cents = int(round(amount * 100))
+    if abs(cents) > MAX_CENTS:
+        raise ValueError(f'金额超出范围: {amount}')
+    return cents
+
+
+def _balance_cents(user_id):
+    """
+    用户当前余额(分)的SQL表达式
+
+    余额 = 最新快照的余额 + 快照之后的流水合计；还没有快照的用户以users表中的期初余额为基数。
+    """
+    snapshot = (select(BalanceSnapshot.balance_cents)
+                .where(BalanceSnapshot.user_id == user_id)
+                .order_by(BalanceSnapshot.last_entry_id.desc())
+                .limit(1))
+    opening = select(cast(func.round(func.coalesce(User.balance, 0) * 100), BigInteger)).where(User.id == user_id)
+    base = func.coalesce(snapshot.scalar_subquery(), opening.scalar_subquery(), 0)
+    last_entry_id = func.coalesce(snapshot.with_only_columns(BalanceSnapshot.last_entry_id).scalar_subquery(), 0)
+    tail = (select(func.coalesce(func.sum(BalanceEntry.amount_cents), 0))
+            .where(BalanceEntry.user_id == user_id, BalanceEntry.id > last_entry_id)
+            .scalar_subquery())
+    return base + tail
+
+
+def lock_balances(session, user_ids):
+    """
+    取得用户余额流水的锁，直到事务结束
+
+    PostgreSQL按用户取事务级咨询锁，同一用户的扣款、入账和快照汇总依次执行，
+    汇总时不会有同一用户ID较小但尚未提交的流水；SQLite写事务天然串行，不需要按用户加锁。
+
+    参数:
+    - session: 数据库会话
+    - user_ids: 用户ID列表
+    """
+    if session.get_bind().dialect.name != 'postgresql':
+        return
+    # 按ID顺序加锁，与其他持有多个用户锁的事务之间不会死锁
+    for user_id in sorted(set(user_ids)):
+        session.execute(select(func.pg_advisory_xact_lock(user_id)))
+
+
+def debit_balance(session, user_id, amount, reason=REASON_DEBIT):
+    """
+    原子扣除用户余额
+
+    用一条INSERT ... SELECT ... WHERE 余额 >= 金额 追加扣款流水，余额不足时不插入。
+    SQLite写事务天然串行；PostgreSQL先取按用户划分的事务级咨询锁，
+    同一用户的并发扣款依次执行也不会透支。
+
+    参数:
+    - session: 数据库会话
+    - user_id: 用户ID
+    - amount: 扣除金额(元)
+    - reason: 流水类型
+
+    返回:
+    - 是否扣款成功，余额不足时返回False
+    """
+    cents = to_cents(amount)
+    lock_balances(session, [user_id])
+    result = session.execute(
+        insert(BalanceEntry).from_select(
+            ['user_id', 'amount_cents', 'reason', 'created_at'],
+            select(literal(user_id, Integer), literal(-cents, BigInteger), literal(reason, String),
+                   literal(datetime.datetime.utcnow(), DateTime))
+            .where(_balance_cents(user_id) >= cents)
+        )
+    )
+    return result.rowcount == 1
+
+
+def credit_balance(session, user_id, amount, reason=REASON_REFUND):
+    """
+    增加用户余额，用于充值和退还冻结金额
+
+    只追加一条入账流水，不更新用户行。与扣款一样取用户的流水锁，
+    快照汇总不会越过尚未提交的入账流水。
+
+    参数:
+    - session: 数据库会话
+    - user_id: 用户ID
+    - amount: 增加金额(元)
+    - reason: 流水类型
+    """
+    lock_balances(session, [user_id])
+    session.execute(insert(BalanceEntry).values(
+        user_id=user_id,
+        amount_cents=to_cents(amount),
+        reason=reason,
+        created_at=datetime.datetime.utcnow()
+    ))
+
+
+def get_balance(session, user_id):
+    """
+    查询用户当前余额
+
+    在同一事务中调用时可以读到本事务内扣款或充值后的结果。
+
+    参数:
+    - session: 数据库会话
+    - user_id: 用户ID
+
+    返回:
+    - 用户余额(元)
+    """
+    cents = session.execute(select(_balance_cents(user_id))).scalar()
+    return int(cents or 0) / 100
+
+
+class BalanceCompactor(LeaderElectedWorker):
+    """
+    余额快照汇总
+
+    后台线程定期把每个用户上一个快照之后的流水汇总为新快照，查询余额时只需合计新快照之后的少量流水。
+    流水本身保留用于对账。快照记录汇总到的最后一条流水ID，之后提交的流水ID必须更大，
+    因此汇总在持有这批用户流水锁的事务中读取流水：PostgreSQL取与扣款、入账相同的咨询锁，
+    SQLite先开始写事务，读到的都是已提交的流水，之后写入的流水ID都大于快照。
+    多个工作进程通过文件锁选出一个执行汇总。
+    """
+
+    task_name = '汇总余额快照'
+    thread_name = 'balance-compactor'
+
+    def __init__(self, interval=60, batch_size=500, lock_path='instance/balance_compactor.lock'):
+        """
+        初始化汇总器
+
+        参数:
+        - interval: 两次汇总之间的间隔(秒)
+        - batch_size: 每个事务最多汇总的用户数
+        - lock_path: 选举用的锁文件路径
+        """
+        super().__init__(interval, lock_path)
+        self.batch_size = batch_size
+        self._watermark = 0  # 上次查找需要汇总的用户时读到的最大流水ID
+        self.snapshots = 0
+
+    def configure(self, interval, batch_size, lock_path):
+        """
+        按配置设置汇总参数
+
+        参数:
+        - interval: 两次汇总之间的间隔(秒)
+        - batch_size: 每个事务最多汇总的用户数
+        - lock_path: 选举用的锁文件路径
+        """
+        self.interval = interval
+        self.batch_size = batch_size
+        self.lock_path = lock_path
+
+    def compact_users(self, session, user_ids):
+        """
+        为一批用户生成截至已提交的最后一条流水的余额快照，并删除被取代的旧快照
+
+        参数:
+        - session: 数据库会话
+        - user_ids: 用户ID列表
+
+        返回:
+        - 新生成的快照数
+        """
+        if session.get_bind().dialect.name == 'sqlite':
+            # 先取得写锁再读取流水，读取到提交快照之间不会有其他事务写入流水
+            session.execute(text('BEGIN IMMEDIATE'))
+        lock_balances(session, user_ids)
+        latest = (select(BalanceSnapshot.user_id,
+                         func.max(BalanceSnapshot.last_entry_id).label('last_entry_id'))
+                  .where(BalanceSnapshot.user_id.in_(user_ids))
+                  .group_by(BalanceSnapshot.user_id)
+                  .subquery())
+        totals = session.execute(
+            select(BalanceEntry.user_id, func.sum(BalanceEntry.amount_cents), func.max(BalanceEntry.id))
+            .outerjoin(latest, latest.c.user_id == BalanceEntry.user_id)
+            .where(BalanceEntry.user_id.in_(user_ids),
+                   BalanceEntry.id > func.coalesce(latest.c.last_entry_id, 0))
+            .group_by(BalanceEntry.user_id)
+        ).all()
+        if not totals:
+            session.commit()
+            return 0
+
+        # 新快照以旧快照为基数，没有快照的用户以期初余额为基数
+        ids = [row[0] for row in totals]
+        bases = {}
+        for user_id, last_entry_id, balance_cents in session.execute(
+                select(BalanceSnapshot.user_id, BalanceSnapshot.last_entry_id, BalanceSnapshot.balance_cents)
+                .where(BalanceSnapshot.user_id.in_(ids))):
+            if user_id not in bases or last_entry_id > bases[user_id][0]:
+                bases[user_id] = (last_entry_id, balance_cents)
+        missing = [user_id for user_id in ids if user_id not in bases]
+        if missing:
+            for user_id, balance in session.execute(select(User.id, User.balance).where(User.id.in_(missing))):
+                bases[user_id] = (0, to_cents(balance or 0))
+
+        now = datetime.datetime.utcnow()
+        session.execute(insert(BalanceSnapshot), [{
+            'user_id': user_id,
+            'last_entry_id': last_entry_id,
+            'balance_cents': bases[user_id][1] + int(amount),
+            'created_at': now
+        } for user_id, amount, last_entry_id in totals])
+
+        newer = aliased(BalanceSnapshot)
+        session.execute(
+            delete(BalanceSnapshot)
+            .where(BalanceSnapshot.user_id.in_(ids),
+                   exists().where(newer.user_id == BalanceSnapshot.user_id,
+                                  newer.last_entry_id > BalanceSnapshot.last_entry_id))
+            .execution_options(synchronize_session=False)
+        )
+        session.commit()
+        return len(totals)
+
+    def run_once(self, session):
+        """
+        汇总上次汇总之后有新流水的用户，每批一个事务
+
+        上次读到的最大流水ID只用于找出需要汇总的用户；PostgreSQL上ID较小但较晚提交的流水
+        仍计入余额，在该用户下次有新流水时汇总。
+
+        参数:
+        - session: 数据库会话
+
+        返回:
+        - 新生成的快照数
+        """
+        users = session.query(BalanceEntry.user_id, func.max(BalanceEntry.id)).filter(
+            BalanceEntry.id > self._watermark).group_by(BalanceEntry.user_id).all()
+        session.rollback()
+        total = 0
+        user_ids = sorted(row[0] for row in users)
+        for start in range(0, len(user_ids), self.batch_size):
+            try:
+                total += self.compact_users(session, user_ids[start:start + self.batch_size])
+            except Exception:
+                session.rollback()
+                raise
+        if users:
+            self._watermark = max(row[1] for row in users)
+
+        with self._lock:
+            self.runs += 1
+            self.snapshots += total
+            self.last_run_at = datetime.datetime.utcnow().isoformat()
+        if total:
+            logger.info('汇总余额快照%d个，截至流水%s', total, self._watermark)
+        return total
+
+    def reset(self):
+        """新进程重新从头汇总"""
+        super().reset()
+        self._watermark = 0
+
+    def stats(self):
+        """
+        获取汇总情况
+
+        返回:
+        - 是否负责汇总、查找需要汇总的用户时读到的最大流水ID、汇总次数、累计生成快照数、错误数、最近汇总时间
+        """
+        with self._lock:
+            return {
+                'is_leader': self.is_leader,
+                'watermark': self._watermark,
+                'runs': self.runs,
+                'snapshots': self.snapshots,
+                'errors': self.errors,
+                'last_run_at': self.last_run_at
+            }
+
+
+# 全局余额快照汇总器
+balance_compactor = BalanceCompactor()
+
+
+def start_balance_compactor(app):
+    """
+    按应用配置启动余额快照汇总线程
+
+    参数:
+    - app: Flask应用实例
+    """
+    if not app.config.get('BALANCE_COMPACTOR_ENABLED', True):
+        return
+    balance_compactor.configure(app.config['BALANCE_COMPACTOR_INTERVAL'], app.config['BALANCE_COMPACTOR_BATCH_SIZE'],
+                                app.config['BALANCE_COMPACTOR_LOCK'])
+    balance_compactor.start(app)
+
+
+def get_balance_compactor_stats():
+    """获取余额快照汇总情况"""
+    return balance_compactor.stats()
+
+
+def get_balance_compactor_counters():
+    """余额快照汇总的累计计数，用于/metrics"""
+    stats = balance_compactor.stats()
+    return {
+        'sms_api_balance_snapshots_total': stats['snapshots'],
+        'sms_api_balance_compactor_errors_total': stats['errors']
+    }
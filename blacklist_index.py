@@ -0,0 +1,162 @@
+import threading
+import time
+
+from models import BlacklistedPhone
+
+
+class _ProjectBlacklist:
+    """单个项目的黑名单集合及同步状态"""
+
+    __slots__ = ('phones', 'high_water', 'loaded_at', 'synced_at')
+
+    def __init__(self):
+        self.phones = set()
+        self.high_water = 0  # 已同步的最大黑名单记录ID
+        self.loaded_at = 0.0
+        self.synced_at = 0.0
+
+
+class BlacklistIndex:
+    """
+    按项目划分的黑名单索引
+
+    每个项目的黑名单在首次使用时整体加载为集合，之后只按记录ID增量同步，
+    成员判断为O(1)，不随黑名单规模增长。本进程内的加黑和移除操作直接更新集合；
+    其他工作进程新增的记录通过增量同步获取，移除的记录在定期全量重建时生效。
+    加载和同步只持有该项目的锁，不阻塞其他项目的查询；已有集合的项目在其他线程刷新期间继续使用旧集合。
+    """
+
+    def __init__(self, sync_interval=1.0, rebuild_interval=300):
+        """
+        初始化黑名单索引
+
+        参数:
+        - sync_interval: 增量同步的最小间隔(秒)
+        - rebuild_interval: 全量重建的间隔(秒)
+        """
+        self.sync_interval = sync_interval
+        self.rebuild_interval = rebuild_interval
+        self._projects = {}
+        self._project_locks = {}
+        self._lock = threading.Lock()  # 只保护_project_locks的创建
+
+    def _load(self, session, project_id):
+        """全量加载项目黑名单"""
+        entry = _ProjectBlacklist()
+        rows = session.query(BlacklistedPhone.id, BlacklistedPhone.phone).filter_by(project_id=project_id)
+        for row_id, phone in rows:
+            entry.phones.add(phone)
+            if row_id > entry.high_water:
+                entry.high_water = row_id
+        entry.loaded_at = entry.synced_at = time.time()
+        return entry
+
+    def _sync(self, session, entry, project_id):
+        """增量同步其他进程新增的黑名单记录"""
+        rows = session.query(BlacklistedPhone.id, BlacklistedPhone.phone).filter(
+            BlacklistedPhone.project_id == project_id,
+            BlacklistedPhone.id > entry.high_water
+        )
+        for row_id, phone in rows:
+            entry.phones.add(phone)
+            if row_id > entry.high_water:
+                entry.high_water = row_id
+        entry.synced_at = time.time()
+
+    def _project_lock(self, project_id):
+        """获取项目的锁，不存在时创建"""
+        lock = self._project_locks.get(project_id)
+        if lock is None:
+            with self._lock:
+                lock = self._project_locks.setdefault(project_id, threading.Lock())
+        return lock
+
+    def _get(self, session, project_id):
+        """获取项目黑名单集合，必要时加载或同步"""
+        entry = self._projects.get(project_id)
+        now = time.time()
+        if (entry is not None and now - entry.loaded_at < self.rebuild_interval
+                and now - entry.synced_at < self.sync_interval):
+            return entry.phones
+
+        # 首次加载时等待；已有集合时由一个线程刷新，其他线程不等待，继续使用旧集合
+        lock = self._project_lock(project_id)
+        if not lock.acquire(blocking=entry is None):
+            return entry.phones
+        try:
+            entry = self._projects.get(project_id)
+            now = time.time()
+            if entry is None or now - entry.loaded_at >= self.rebuild_interval:
+                # 只持有该项目的锁，在新集合上加载，完成后整体替换
+                entry = self._load(session, project_id)
+                self._projects[project_id] = entry
+            elif now - entry.synced_at >= self.sync_interval:
+                self._sync(session, entry, project_id)
+            return entry.phones
+        finally:
+            lock.release()
+
+    def contains(self, session, project_id, phone):
+        """
+        判断手机号是否在项目黑名单中
+
+        参数:
+        - session: 数据库会话
+        - project_id: 项目ID
+        - phone: 手机号码
+
+        返回:
+        - 是否在黑名单中
+        """
+        return phone in self._get(session, project_id)
+
+    def exclude(self, session, project_id, phones):
+        """
+        从候选号码中排除项目黑名单中的号码
+
+        参数:
+        - session: 数据库会话
+        - project_id: 项目ID
+        - phones: 候选手机号码集合
+
+        返回:
+        - 不在黑名单中的号码集合
+        """
+        blacklisted = self._get(session, project_id)
+        return {phone for phone in phones if phone not in blacklisted}
+
+    def add(self, project_id, phone):
+        """
+        记录新加黑的手机号，在加黑操作提交后调用
+
+        参数:
+        - project_id: 项目ID
+        - phone: 手机号码
+        """
+        # 等待该项目正在进行的加载完成，更新加载后的新集合
+        with self._project_lock(project_id):
+            entry = self._projects.get(project_id)
+            if entry is not None:
+                entry.phones.add(phone)
+
+    def discard(self, project_id, phone):
+        """
+        移除黑名单中的手机号，在移除操作提交后调用
+
+        参数:
+        - project_id: 项目ID
+        - phone: 手机号码
+        """
+        with self._project_lock(project_id):
+            entry = self._projects.get(project_id)
+            if entry is not None:
+                entry.phones.discard(phone)
+
+    def clear(self):
+        """清空全部索引，下次使用时重新加载"""
+        with self._lock:
+            self._projects.clear()
+
+
+# 全局黑名单索引
+blacklist_index = BlacklistIndex()
@@ -6,14 +6,17 @@ Gunicorn配置文件
 用于在生产环境中运行Flask应用
 """
 
-import multiprocessing
 import os
 
+from config import default_worker_count
+
 # 绑定的IP和端口
 bind = "0.0.0.0:5000"
 
-# 工作进程数 - 一般设置为 (2 x $num_cores) + 1
-workers = multiprocessing.cpu_count() * 2 + 1
+# 工作进程数 - 一般设置为 (2 x $num_cores) + 1，只能由GUNICORN_WORKERS设置
+# 生产环境的数据库连接池在加载应用时按GUNICORN_WORKERS分配服务器连接，
+# 命令行的 -w/--workers 不会改变连接池大小，不要使用
+workers = default_worker_count()
 
 # 工作模式 - 使用异步工作模式以提高并发能力
 worker_class = "gevent"
@@ -69,6 +72,18 @@ def on_starting(server):
     if not os.path.exists("logs"):
         os.makedirs("logs")
 
+# 主进程启动完成后运行的钩子函数
+def when_ready(server):
+    """
+    主进程启动完成后运行的钩子函数
+    工作进程数被命令行参数修改时，连接池仍按GUNICORN_WORKERS分配，所有工作进程的连接总数可能超过数据库上限
+    """
+    expected = default_worker_count()
+    if server.cfg.workers != expected:
+        server.log.warning(
+            "Gunicorn工作进程数为%d，数据库连接池按GUNICORN_WORKERS=%d分配；"
+            "请改用GUNICORN_WORKERS设置工作进程数", server.cfg.workers, expected)
+
 # 工作进程启动前运行的钩子函数
 def pre_fork(server, worker):
     """
@@ -83,6 +98,19 @@ def post_fork(server, worker):
     """
     print(f"Worker {worker.pid} has been spawned")
 
+# 工作进程初始化完成后运行的钩子函数
+def post_worker_init(worker):
+    """
+    工作进程初始化完成后运行的钩子函数
+    gevent已完成monkey patch，在此启动过期号码回收、余额快照汇总和号码池补充线程，由文件锁各选出一个工作进程执行
+    """
+    from billing import start_balance_compactor
+    from lease_reaper import start_lease_reaper
+    from number_pool import start_number_pool
+    start_lease_reaper(worker.wsgi)
+    start_balance_compactor(worker.wsgi)
+    start_number_pool(worker.wsgi)
+
 # 工作进程重启前运行的钩子函数
 def worker_abort(worker):
     """
@@ -0,0 +1,112 @@
+import logging
+import os
+import threading
+import time
+
+from models import db
+
+try:
+    import fcntl
+except ImportError:  # Windows没有fcntl，只在单进程下运行
+    fcntl = None
+
+logger = logging.getLogger(__name__)
+
+
+class LeaderElectedWorker:
+    """
+    由文件锁选举的后台任务
+
+    每个工作进程都启动一个后台线程，通过锁文件上的非阻塞排他锁选出一个进程按间隔执行run_once，
+    未当选的进程按间隔重试选举，持有锁的进程退出后由其他进程接替。
+    子类设置task_name和thread_name并实现run_once。
+    """
+
+    task_name = '后台任务'  # 日志中的任务名称
+    thread_name = 'leader-worker'
+
+    def __init__(self, interval, lock_path):
+        """
+        初始化后台任务
+
+        参数:
+        - interval: 两次执行之间的间隔(秒)
+        - lock_path: 选举用的锁文件路径
+        """
+        self.interval = interval
+        self.lock_path = lock_path
+        self._lock_file = None
+        self._thread = None
+        self._pid = None
+        self._lock = threading.Lock()
+        self.is_leader = False
+        self.runs = 0
+        self.errors = 0
+        self.last_run_at = None
+
+    def _acquire_leadership(self):
+        """尝试获取锁文件上的排他锁，获取成功的进程负责执行任务"""
+        if self.is_leader:
+            return True
+        if fcntl is None:
+            self.is_leader = True
+            return True
+
+        directory = os.path.dirname(self.lock_path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        lock_file = open(self.lock_path, 'a')
+        try:
+            fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            lock_file.close()
+            return False
+        # 锁随文件一起持有到进程退出
+        self._lock_file = lock_file
+        self.is_leader = True
+        logger.info('进程%s负责%s', os.getpid(), self.task_name)
+        return True
+
+    def run_once(self, session):
+        """
+        执行一次任务，由子类实现
+
+        参数:
+        - session: 数据库会话
+        """
+        raise NotImplementedError
+
+    def reset(self):
+        """在新进程中启动线程前重置进程内状态，子类可以扩展"""
+        self._lock_file = None
+        self.is_leader = False
+
+    def _run(self, app):
+        """后台线程：当选后按间隔执行，未当选时按间隔重试选举"""
+        while True:
+            try:
+                if self._acquire_leadership():
+                    with app.app_context():
+                        self.run_once(db.session)
+            except Exception:
+                with self._lock:
+                    self.errors += 1
+                logger.exception('%s失败', self.task_name)
+            time.sleep(self.interval)
+
+    def start(self, app):
+        """
+        在当前进程中启动后台线程，重复调用不会启动多个线程
+
+        参数:
+        - app: Flask应用实例
+        """
+        pid = os.getpid()
+        with self._lock:
+            if self._thread is not None and self._pid == pid:
+                return
+            # fork后的子进程不继承父进程的锁和线程
+            self.reset()
+            self._pid = pid
+            self._thread = threading.Thread(target=self._run, args=(app,), name=self.thread_name, daemon=True)
+            self._thread.start()
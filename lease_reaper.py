@@ -0,0 +1,169 @@
+import datetime
+import logging
+
+from billing import credit_balance
+from leader_worker import LeaderElectedWorker
+from models import PhoneNumber
+from phone_allocator import delete_phone_numbers
+
+logger = logging.getLogger(__name__)
+
+
+class LeaseReaper(LeaderElectedWorker):
+    """
+    过期号码回收
+
+    号码分配后超过租期(created_at + ttl)仍未收到验证码也未释放的视为过期，
+    后台线程按批删除过期号码并退还其冻结金额，每批在一个独立事务中完成。
+    已收到验证码的号码(status为0、冻结金额已扣除)是用户已付费的记录，不回收。
+    多个工作进程通过文件锁选出一个执行回收，持有锁的进程退出后由其他进程接替。
+    """
+
+    task_name = '回收过期号码'
+    thread_name = 'lease-reaper'
+
+    def __init__(self, ttl=1200, interval=60, batch_size=500, lock_path='instance/lease_reaper.lock'):
+        """
+        初始化回收器
+
+        参数:
+        - ttl: 号码租期(秒)
+        - interval: 两次回收之间的间隔(秒)
+        - batch_size: 每个事务最多回收的号码数
+        - lock_path: 选举用的锁文件路径
+        """
+        super().__init__(interval, lock_path)
+        self.ttl = ttl
+        self.batch_size = batch_size
+        self.reclaimed = 0
+        self.refunded_amount = 0.0
+
+    def configure(self, ttl, interval, batch_size, lock_path):
+        """
+        按配置设置租期和回收参数
+
+        参数:
+        - ttl: 号码租期(秒)
+        - interval: 两次回收之间的间隔(秒)
+        - batch_size: 每个事务最多回收的号码数
+        - lock_path: 选举用的锁文件路径
+        """
+        self.ttl = ttl
+        self.interval = interval
+        self.batch_size = batch_size
+        self.lock_path = lock_path
+
+    def reap_batch(self, session, cutoff):
+        """
+        回收一批过期号码
+
+        参数:
+        - session: 数据库会话
+        - cutoff: 在此时间之前分配的号码视为过期
+
+        返回:
+        - (回收的号码数, 退还的金额)
+        """
+        criteria = (PhoneNumber.created_at < cutoff, PhoneNumber.status == 1, PhoneNumber.frozen_amount > 0)
+        ids = [row[0] for row in session.query(PhoneNumber.id)
+               .filter(*criteria)
+               .order_by(PhoneNumber.created_at)
+               .limit(self.batch_size)]
+        if not ids:
+            return 0, 0.0
+
+        # 删除时再次检查租约未完成，期间收到验证码的号码不删除；
+        # 只为本事务实际删除的号码退款，与同时释放号码的请求不会重复退款
+        rows = delete_phone_numbers(session, PhoneNumber.id.in_(ids), *criteria)
+
+        refunds = {}
+        for user_id, _phone, frozen_amount in rows:
+            if frozen_amount and frozen_amount > 0:
+                refunds[user_id] = refunds.get(user_id, 0.0) + frozen_amount
+        for user_id, amount in refunds.items():
+            credit_balance(session, user_id, amount)
+        session.commit()
+        return len(rows), sum(refunds.values())
+
+    def run_once(self, session):
+        """
+        回收全部过期号码，每批一个事务
+
+        参数:
+        - session: 数据库会话
+
+        返回:
+        - (回收的号码数, 退还的金额)
+        """
+        cutoff = datetime.datetime.utcnow() - datetime.timedelta(seconds=self.ttl)
+        total, refunded = 0, 0.0
+        while True:
+            try:
+                count, amount = self.reap_batch(session, cutoff)
+            except Exception:
+                session.rollback()
+                raise
+            total += count
+            refunded += amount
+            if count < self.batch_size:
+                break
+
+        with self._lock:
+            self.runs += 1
+            self.reclaimed += total
+            self.refunded_amount += refunded
+            self.last_run_at = datetime.datetime.utcnow().isoformat()
+        if total:
+            logger.info('回收过期号码%d个，退还冻结金额%.2f', total, refunded)
+        return total, refunded
+
+    def stats(self):
+        """
+        获取回收情况
+
+        返回:
+        - 是否负责回收、租期、回收次数、累计回收号码数、累计退还金额、错误数、最近回收时间
+        """
+        with self._lock:
+            return {
+                'is_leader': self.is_leader,
+                'ttl': self.ttl,
+                'runs': self.runs,
+                'reclaimed': self.reclaimed,
+                'refunded_amount': round(self.refunded_amount, 2),
+                'errors': self.errors,
+                'last_run_at': self.last_run_at
+            }
+
+
+# 全局过期号码回收器
+lease_reaper = LeaseReaper()
+
+
+def start_lease_reaper(app):
+    """
+    按应用配置启动过期号码回收线程
+
+    参数:
+    - app: Flask应用实例
+    """
+    if not app.config.get('LEASE_REAPER_ENABLED', True):
+        return
+    lease_reaper.configure(app.config['PHONE_LEASE_TTL'], app.config['LEASE_REAPER_INTERVAL'],
+                           app.config['LEASE_REAPER_BATCH_SIZE'], app.config['LEASE_REAPER_LOCK'])
+    lease_reaper.start(app)
+
+
+def get_lease_reaper_stats():
+    """获取过期号码回收情况"""
+    return lease_reaper.stats()
+
+
+def get_lease_reaper_counters():
+    """过期号码回收的累计计数，用于/metrics"""
+    stats = lease_reaper.stats()
+    return {
+        'sms_api_lease_reaper_reclaimed_total': stats['reclaimed'],
+        'sms_api_lease_reaper_refunded_amount_total': stats['refunded_amount'],
+        'sms_api_lease_reaper_errors_total': stats['errors']
+    }
@@ -0,0 +1,291 @@
+import atexit
+import contextvars
+import copy
+import datetime
+import json
+import logging
+import os
+import queue
+import threading
+import time
+import uuid
+from logging.handlers import QueueHandler, QueueListener, RotatingFileHandler
+
+from flask import g, request
+
+try:
+    import fcntl
+except ImportError:  # Windows没有fcntl，只在单进程下写日志
+    fcntl = None
+
+# 当前请求的日志字段(request_id、route、method、user_id)，通过run_async复制上下文传到线程池中
+_log_context = contextvars.ContextVar('log_context', default=None)
+
+request_logger = logging.getLogger('sms_api.request')
+
+
+def bind_log_context(**fields):
+    """
+    为当前请求的后续日志补充字段，例如认证通过后的user_id
+
+    参数:
+    - fields: 字段名和值
+    """
+    context = _log_context.get()
+    if context is not None:
+        context.update(fields)
+
+
+class RequestContextFilter(logging.Filter):
+    """在产生日志的线程中把当前请求的字段附加到日志记录上"""
+
+    def filter(self, record):
+        context = _log_context.get()
+        if context:
+            for key, value in context.items():
+                if not hasattr(record, key):
+                    setattr(record, key, value)
+        return True
+
+
+class JsonFormatter(logging.Formatter):
+    """把日志记录格式化为一行JSON"""
+
+    # 日志记录上存在时输出的附加字段
+    FIELDS = ('request_id', 'route', 'method', 'user_id', 'status', 'latency_ms')
+
+    def format(self, record):
+        data = {
+            'time': datetime.datetime.utcfromtimestamp(record.created).isoformat(timespec='milliseconds') + 'Z',
+            'level': record.levelname,
+            'logger': record.name,
+            'pid': record.process,
+            'message': record.getMessage()
+        }
+        for key in self.FIELDS:
+            value = getattr(record, key, None)
+            if value is not None:
+                data[key] = value
+        if record.exc_info:
+            data['exception'] = self.formatException(record.exc_info)
+        elif record.exc_text:
+            data['exception'] = record.exc_text
+        return json.dumps(data, ensure_ascii=False, default=str)
+
+
+class MultiProcessRotatingFileHandler(RotatingFileHandler):
+    """
+    多进程共享的按大小轮转日志文件
+
+    每次写入都持有锁文件上的排他锁，在锁内检查文件是否已被其他进程轮转(inode变化时重新打开)、
+    是否需要轮转，再以追加方式写入，多个工作进程写同一个文件时不会重复轮转或写入已改名的旧文件。
+    """
+
+    def __init__(self, filename, maxBytes=0, backupCount=0, encoding='utf-8'):
+        super().__init__(filename, maxBytes=maxBytes, backupCount=backupCount, encoding=encoding, delay=True)
+        self._lock_file = None
+        self._lock_pid = None
+
+    def _acquire_file_lock(self):
+        """获取锁文件上的排他锁，fork后的子进程重新打开锁文件"""
+        if fcntl is None:
+            return
+        pid = os.getpid()
+        if self._lock_file is None or self._lock_pid != pid:
+            self._lock_file = open(self.baseFilename + '.lock', 'a')
+            self._lock_pid = pid
+        fcntl.flock(self._lock_file, fcntl.LOCK_EX)
+
+    def _release_file_lock(self):
+        if fcntl is not None and self._lock_file is not None:
+            fcntl.flock(self._lock_file, fcntl.LOCK_UN)
+
+    def _reopen_if_rotated(self):
+        """日志文件已被其他进程改名或删除时关闭旧文件，下次写入时重新打开"""
+        if self.stream is None:
+            return
+        try:
+            rotated = os.stat(self.baseFilename).st_ino != os.fstat(self.stream.fileno()).st_ino
+        except FileNotFoundError:
+            rotated = True
+        if rotated:
+            self.stream.close()
+            self.stream = None
+
+    def emit(self, record):
+        try:
+            self._acquire_file_lock()
+            try:
+                self._reopen_if_rotated()
+                if self.shouldRollover(record):
+                    self.doRollover()
+                logging.FileHandler.emit(self, record)
+            finally:
+                self._release_file_lock()
+        except Exception:
+            self.handleError(record)
+
+
+class AsyncQueueHandler(QueueHandler):
+    """
+    非阻塞日志处理器
+
+    请求线程只把日志记录放入内存队列，格式化和文件写入由每个进程的一个后台线程完成。
+    队列写满时丢弃新日志并计数，不让日志量增加请求延迟。
+    后台线程在进程首次写日志时启动，fork后的子进程重新创建队列和线程。
+    """
+
+    def __init__(self, handlers, max_queue=10000):
+        """
+        初始化处理器
+
+        参数:
+        - handlers: 后台线程中实际输出日志的处理器列表
+        - max_queue: 最大排队日志数
+        """
+        super().__init__(None)
+        self.targets = handlers
+        self.max_queue = max_queue
+        self.dropped = 0
+        self._listener = None
+        self._pid = None
+        self._setup_lock = threading.Lock()
+        self._exc_formatter = logging.Formatter()
+        self.addFilter(RequestContextFilter())
+
+    def _ensure_listener(self):
+        """启动当前进程的后台写日志线程"""
+        pid = os.getpid()
+        if self._pid != pid:
+            with self._setup_lock:
+                if self._pid != pid:
+                    self.queue = queue.Queue(self.max_queue)
+                    self._listener = QueueListener(self.queue, *self.targets, respect_handler_level=True)
+                    self._listener.start()
+                    self._pid = pid
+
+    def prepare(self, record):
+        """
+        复制日志记录并合并消息参数、展开异常堆栈，使记录可以安全地交给后台线程格式化
+        """
+        record = copy.copy(record)
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            record.exc_text = self._exc_formatter.formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+    def enqueue(self, record):
+        self._ensure_listener()
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+    def stop(self):
+        """停止当前进程的后台线程，写完队列中剩余的日志"""
+        with self._setup_lock:
+            if self._listener is not None and self._pid == os.getpid():
+                self._listener.stop()
+                self._listener = None
+                self._pid = None
+
+    def stats(self):
+        """
+        获取日志队列情况
+
+        返回:
+        - 排队中的日志数和丢弃的日志数
+        """
+        return {
+            'queued': self.queue.qsize() if self.queue is not None and self._pid == os.getpid() else 0,
+            'dropped': self.dropped
+        }
+
+
+def configure_json_logging(app):
+    """
+    为根日志记录器配置非阻塞的JSON日志，重复调用时复用已有的处理器
+
+    参数:
+    - app: Flask应用实例
+
+    返回:
+    - AsyncQueueHandler实例
+    """
+    root = logging.getLogger()
+    for handler in root.handlers:
+        if isinstance(handler, AsyncQueueHandler):
+            return handler
+
+    log_file = app.config['LOG_FILE']
+    directory = os.path.dirname(log_file)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+
+    file_handler = MultiProcessRotatingFileHandler(log_file, app.config['LOG_MAX_BYTES'],
+                                                   app.config['LOG_BACKUP_COUNT'])
+    file_handler.setFormatter(JsonFormatter())
+    file_handler.setLevel(logging.INFO)
+
+    console_handler = logging.StreamHandler()
+    console_handler.setFormatter(logging.Formatter('[%(asctime)s] %(levelname)s in %(name)s: %(message)s'))
+    console_handler.setLevel(logging.INFO if app.debug else logging.WARNING)
+    # 控制台已有开发服务器输出的访问日志，不再重复输出
+    console_handler.addFilter(lambda record: record.name != request_logger.name)
+
+    handler = AsyncQueueHandler([file_handler, console_handler], app.config['LOG_QUEUE_SIZE'])
+    root.addHandler(handler)
+    root.setLevel(logging.INFO)
+    atexit.register(handler.stop)
+    return handler
+
+
+def init_request_logging(app):
+    """
+    为api蓝图的请求设置日志字段，并在请求结束时记录一行访问日志
+
+    request_id取自X-Request-ID请求头，没有时生成，并通过响应头返回。
+
+    参数:
+    - app: Flask应用实例
+    """
+
+    @app.before_request
+    def start_request_logging():
+        if request.blueprint != 'api':
+            return
+        request_id = request.headers.get('X-Request-ID') or uuid.uuid4().hex
+        g.log_started = time.perf_counter()
+        _log_context.set({
+            'request_id': request_id[:64],
+            'route': request.endpoint,
+            'method': request.method
+        })
+
+    @app.after_request
+    def finish_request_logging(response):
+        context = _log_context.get()
+        if context is None:
+            return response
+        response.headers['X-Request-ID'] = context['request_id']
+        if app.config.get('LOG_REQUESTS', True):
+            request_logger.info('%s %s %s', request.method, request.path, response.status_code, extra={
+                'status': response.status_code,
+                'latency_ms': round((time.perf_counter() - g.log_started) * 1000, 3)
+            })
+        return response
+
+    @app.teardown_request
+    def clear_request_logging(exc):
+        # 线程可能被下一个请求复用，请求结束后清空日志字段
+        _log_context.set(None)
+
+
+def get_log_stats():
+    """获取当前进程的日志队列情况，没有配置JSON日志时返回None"""
+    for handler in logging.getLogger().handlers:
+        if isinstance(handler, AsyncQueueHandler):
+            return handler.stats()
+    return None
@@ -0,0 +1,454 @@
+import atexit
+import contextvars
+import json
+import os
+import threading
+import time
+
+from flask import Response, request
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+try:
+    import fcntl
+except ImportError:  # Windows没有fcntl，合并已退出进程的快照时不加锁
+    fcntl = None
+
+# 请求耗时和连接池等待时间的直方图分桶(秒)
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+# 每个请求数据库查询次数的直方图分桶
+QUERY_COUNT_BUCKETS = (1, 2, 3, 5, 10, 20, 50, 100)
+
+# 当前请求的数据库查询统计[次数, 耗时]，通过run_async复制上下文传到线程池中
+_request_queries = contextvars.ContextVar('request_queries', default=None)
+
+
+class Histogram:
+    """累计直方图，counts的最后一项为+Inf分桶"""
+
+    __slots__ = ('buckets', 'counts', 'sum')
+
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+
+    def observe(self, value):
+        """记录一个观测值"""
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[i] += 1
+                break
+        else:
+            self.counts[-1] += 1
+        self.sum += value
+
+    def dump(self):
+        """转换为可JSON序列化的列表：各分桶计数 + [总和]"""
+        return self.counts + [self.sum]
+
+
+class MetricsRegistry:
+    """
+    请求指标
+
+    在当前进程内记录各路由的请求数、状态码、耗时直方图、数据库查询次数和耗时，
+    以及连接池借出连接的等待时间。配置了快照目录时，每个工作进程定期把自己的指标
+    写入目录中的独立文件，/metrics读取并合并所有工作进程的快照。
+    """
+
+    def __init__(self, snapshot_dir='', write_interval=1.0):
+        """
+        初始化指标
+
+        参数:
+        - snapshot_dir: 各工作进程快照文件所在目录，为空时只统计当前进程
+        - write_interval: 写快照文件的最小间隔(秒)
+        """
+        self.snapshot_dir = snapshot_dir
+        self.write_interval = write_interval
+        self._lock = threading.Lock()
+        self._write_lock = threading.Lock()
+        self._written_at = 0.0
+        self._collectors = []
+        self._reset()
+
+    def _reset(self):
+        """清空当前进程的指标"""
+        self.requests = {}  # (路由, 方法, 状态码) -> 请求数
+        self.latency = {}  # (路由, 方法) -> 耗时直方图
+        self.queries = {}  # 路由 -> [查询次数, 查询耗时]
+        self.queries_per_request = {}  # 路由 -> 每请求查询次数直方图
+        self.pool_wait = Histogram(LATENCY_BUCKETS)
+        self._pid = os.getpid()
+
+    def _check_pid(self):
+        """fork后的子进程从零开始统计，不重复计算父进程的指标"""
+        if self._pid != os.getpid():
+            self._reset()
+
+    def configure(self, snapshot_dir, write_interval):
+        """
+        按配置设置快照目录
+
+        参数:
+        - snapshot_dir: 快照目录，为空时只统计当前进程
+        - write_interval: 写快照文件的最小间隔(秒)
+        """
+        self.snapshot_dir = snapshot_dir
+        self.write_interval = write_interval
+        if snapshot_dir:
+            os.makedirs(snapshot_dir, exist_ok=True)
+
+    def register_collector(self, collector):
+        """
+        注册额外的计数器来源
+
+        参数:
+        - collector: 无参函数，返回 指标名 -> 数值 的字典，各工作进程的数值相加
+        """
+        if collector not in self._collectors:
+            self._collectors.append(collector)
+
+    def observe_request(self, route, method, status, elapsed, queries):
+        """
+        记录一个请求
+
+        参数:
+        - route: 路由名称
+        - method: 请求方法
+        - status: 响应状态码
+        - elapsed: 请求耗时(秒)
+        - queries: [查询次数, 查询耗时]，没有统计时为None
+        """
+        with self._lock:
+            self._check_pid()
+            key = (route, method, str(status))
+            self.requests[key] = self.requests.get(key, 0) + 1
+            histogram = self.latency.get((route, method))
+            if histogram is None:
+                histogram = self.latency[(route, method)] = Histogram(LATENCY_BUCKETS)
+            histogram.observe(elapsed)
+
+            if queries is not None:
+                totals = self.queries.setdefault(route, [0, 0.0])
+                totals[0] += queries[0]
+                totals[1] += queries[1]
+                histogram = self.queries_per_request.get(route)
+                if histogram is None:
+                    histogram = self.queries_per_request[route] = Histogram(QUERY_COUNT_BUCKETS)
+                histogram.observe(queries[0])
+
+    def observe_pool_wait(self, elapsed):
+        """记录一次从连接池借出连接的等待时间"""
+        with self._lock:
+            self._check_pid()
+            self.pool_wait.observe(elapsed)
+
+    def observe_background_query(self, elapsed):
+        """记录请求之外(后台线程)执行的查询"""
+        with self._lock:
+            self._check_pid()
+            totals = self.queries.setdefault('background', [0, 0.0])
+            totals[0] += 1
+            totals[1] += elapsed
+
+    def snapshot(self):
+        """
+        获取当前进程的指标快照
+
+        返回:
+        - 可JSON序列化的字典
+        """
+        counters = {}
+        for collector in self._collectors:
+            for name, value in collector().items():
+                counters[name] = counters.get(name, 0) + value
+        with self._lock:
+            self._check_pid()
+            return {
+                'requests': {'|'.join(key): count for key, count in self.requests.items()},
+                'latency': {'|'.join(key): histogram.dump() for key, histogram in self.latency.items()},
+                'queries': {route: list(totals) for route, totals in self.queries.items()},
+                'queries_per_request': {route: histogram.dump()
+                                        for route, histogram in self.queries_per_request.items()},
+                'pool_wait': self.pool_wait.dump(),
+                'counters': counters
+            }
+
+    def _snapshot_path(self, pid):
+        return os.path.join(self.snapshot_dir, f'worker-{pid}.json')
+
+    def write_snapshot(self, force=False):
+        """
+        把当前进程的快照写入文件，距上次写入不足write_interval秒时跳过
+
+        参数:
+        - force: 是否忽略写入间隔
+        """
+        if not self.snapshot_dir:
+            return
+        now = time.monotonic()
+        if not force and now - self._written_at < self.write_interval:
+            return
+        # 同一进程只有一个线程写快照，其他线程不等待
+        if not self._write_lock.acquire(blocking=force):
+            return
+        try:
+            self._written_at = now
+            path = self._snapshot_path(os.getpid())
+            temp_path = f'{path}.tmp'
+            with open(temp_path, 'w') as f:
+                json.dump(self.snapshot(), f)
+            os.replace(temp_path, path)
+        finally:
+            self._write_lock.release()
+
+    def collect(self):
+        """
+        合并所有工作进程的快照
+
+        已退出进程的快照合并到archive.json后删除，计数器不会因工作进程重启而减少。
+
+        返回:
+        - (合并后的快照, 工作进程数)
+        """
+        if not self.snapshot_dir:
+            return self.snapshot(), 1
+
+        self.write_snapshot(force=True)
+        archive_path = os.path.join(self.snapshot_dir, 'archive.json')
+        with open(os.path.join(self.snapshot_dir, 'archive.lock'), 'a') as lock_file:
+            if fcntl is not None:
+                fcntl.flock(lock_file, fcntl.LOCK_EX)
+
+            archive = _load_snapshot(archive_path)
+            live = []
+            exited = []
+            for name in os.listdir(self.snapshot_dir):
+                if not (name.startswith('worker-') and name.endswith('.json')):
+                    continue
+                pid = int(name[len('worker-'):-len('.json')])
+                snapshot = _load_snapshot(os.path.join(self.snapshot_dir, name))
+                if snapshot is None:
+                    continue
+                if _process_alive(pid):
+                    live.append(snapshot)
+                else:
+                    archive = merge_snapshots([archive, snapshot])
+                    exited.append(name)
+
+            if exited:
+                temp_path = f'{archive_path}.tmp'
+                with open(temp_path, 'w') as f:
+                    json.dump(archive, f)
+                os.replace(temp_path, archive_path)
+                for name in exited:
+                    os.remove(os.path.join(self.snapshot_dir, name))
+
+        return merge_snapshots([archive] + live), len(live)
+
+
+def _load_snapshot(path):
+    """读取快照文件，文件不存在或不完整时返回None"""
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def _process_alive(pid):
+    """判断进程是否仍在运行"""
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+def _add_lists(a, b):
+    return [x + y for x, y in zip(a, b)] if a else list(b)
+
+
+def merge_snapshots(snapshots):
+    """
+    合并多个快照，计数和直方图逐项相加
+
+    参数:
+    - snapshots: 快照列表，None会被忽略
+
+    返回:
+    - 合并后的快照
+    """
+    merged = {'requests': {}, 'latency': {}, 'queries': {}, 'queries_per_request': {},
+              'pool_wait': [], 'counters': {}}
+    for snapshot in snapshots:
+        if not snapshot:
+            continue
+        for section in ('requests', 'counters'):
+            for key, value in snapshot.get(section, {}).items():
+                merged[section][key] = merged[section].get(key, 0) + value
+        for section in ('latency', 'queries', 'queries_per_request'):
+            for key, values in snapshot.get(section, {}).items():
+                merged[section][key] = _add_lists(merged[section].get(key), values)
+        if snapshot.get('pool_wait'):
+            merged['pool_wait'] = _add_lists(merged['pool_wait'], snapshot['pool_wait'])
+    return merged
+
+
+def _labels(**labels):
+    return '{' + ','.join(f'{name}="{value}"' for name, value in labels.items()) + '}'
+
+
+def _histogram_lines(name, buckets, values, **labels):
+    """输出一个直方图的_bucket、_sum和_count行"""
+    lines = []
+    cumulative = 0
+    for bound, count in zip(buckets, values):
+        cumulative += count
+        lines.append(f'{name}_bucket{_labels(**labels, le=bound)} {cumulative}')
+    cumulative += values[len(buckets)]
+    lines.append(f'{name}_bucket{_labels(**labels, le="+Inf")} {cumulative}')
+    lines.append(f'{name}_sum{_labels(**labels) if labels else ""} {values[-1]}')
+    lines.append(f'{name}_count{_labels(**labels) if labels else ""} {cumulative}')
+    return lines
+
+
+def render_prometheus(snapshot, workers):
+    """
+    把快照转换为Prometheus文本格式
+
+    参数:
+    - snapshot: 合并后的快照
+    - workers: 工作进程数
+
+    返回:
+    - Prometheus文本
+    """
+    lines = [
+        '# HELP sms_api_workers Number of worker processes reporting metrics',
+        '# TYPE sms_api_workers gauge',
+        f'sms_api_workers {workers}',
+        '# HELP sms_api_requests_total API requests by route, method and status',
+        '# TYPE sms_api_requests_total counter',
+    ]
+    for key, count in sorted(snapshot['requests'].items()):
+        route, method, status = key.split('|')
+        lines.append(f'sms_api_requests_total{_labels(route=route, method=method, status=status)} {count}')
+
+    lines += ['# HELP sms_api_request_duration_seconds API request latency',
+              '# TYPE sms_api_request_duration_seconds histogram']
+    for key, values in sorted(snapshot['latency'].items()):
+        route, method = key.split('|')
+        lines += _histogram_lines('sms_api_request_duration_seconds', LATENCY_BUCKETS, values,
+                                  route=route, method=method)
+
+    lines += ['# HELP sms_api_db_queries_total Database queries by route',
+              '# TYPE sms_api_db_queries_total counter']
+    for route, (count, _seconds) in sorted(snapshot['queries'].items()):
+        lines.append(f'sms_api_db_queries_total{_labels(route=route)} {count}')
+    lines += ['# HELP sms_api_db_query_seconds_total Time spent executing database queries by route',
+              '# TYPE sms_api_db_query_seconds_total counter']
+    for route, (_count, seconds) in sorted(snapshot['queries'].items()):
+        lines.append(f'sms_api_db_query_seconds_total{_labels(route=route)} {seconds}')
+
+    lines += ['# HELP sms_api_db_queries_per_request Database queries per API request',
+              '# TYPE sms_api_db_queries_per_request histogram']
+    for route, values in sorted(snapshot['queries_per_request'].items()):
+        lines += _histogram_lines('sms_api_db_queries_per_request', QUERY_COUNT_BUCKETS, values, route=route)
+
+    if snapshot['pool_wait']:
+        lines += ['# HELP sms_api_db_pool_wait_seconds Time spent waiting for a pooled database connection',
+                  '# TYPE sms_api_db_pool_wait_seconds histogram']
+        lines += _histogram_lines('sms_api_db_pool_wait_seconds', LATENCY_BUCKETS, snapshot['pool_wait'])
+
+    for name, value in sorted(snapshot['counters'].items()):
+        lines += [f'# TYPE {name} counter', f'{name} {value}']
+    return '\n'.join(lines) + '\n'
+
+
+# 全局请求指标
+metrics = MetricsRegistry()
+
+
+@event.listens_for(Engine, 'before_cursor_execute')
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault('query_started', []).append(time.perf_counter())
+
+
+@event.listens_for(Engine, 'after_cursor_execute')
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    started = conn.info['query_started'].pop()
+    elapsed = time.perf_counter() - started
+    queries = _request_queries.get()
+    if queries is None:
+        metrics.observe_background_query(elapsed)
+    else:
+        queries[0] += 1
+        queries[1] += elapsed
+
+
+@event.listens_for(Engine, 'handle_error')
+def _handle_error(exception_context):
+    connection = exception_context.connection
+    if connection is not None and connection.info.get('query_started'):
+        connection.info['query_started'].pop()
+
+
+def _instrument_pool(pool):
+    """包装连接池的_do_get，记录借出连接的等待时间"""
+    if getattr(pool, '_metrics_instrumented', False):
+        return
+    do_get = pool._do_get
+
+    def timed_do_get():
+        started = time.perf_counter()
+        try:
+            return do_get()
+        finally:
+            metrics.observe_pool_wait(time.perf_counter() - started)
+
+    pool._do_get = timed_do_get
+    pool._metrics_instrumented = True
+
+
+def init_metrics(app, db):
+    """
+    为应用启用请求指标并注册/metrics接口
+
+    只统计api蓝图的请求，配置METRICS_DIR时合并所有工作进程的指标。
+
+    参数:
+    - app: Flask应用实例
+    - db: SQLAlchemy实例
+    """
+    metrics.configure(app.config.get('METRICS_DIR', ''), app.config.get('METRICS_WRITE_INTERVAL', 1.0))
+    with app.app_context():
+        _instrument_pool(db.engine.pool)
+
+    @app.before_request
+    def start_request_metrics():
+        if request.blueprint == 'api':
+            request.environ['metrics.started'] = time.perf_counter()
+            _request_queries.set([0, 0.0])
+
+    @app.after_request
+    def record_request_metrics(response):
+        started = request.environ.pop('metrics.started', None)
+        if started is not None:
+            metrics.observe_request(request.endpoint or 'unmatched', request.method, response.status_code,
+                                    time.perf_counter() - started, _request_queries.get())
+            _request_queries.set(None)
+            metrics.write_snapshot()
+        return response
+
+    @app.route('/metrics')
+    def prometheus_metrics():
+        snapshot, workers = metrics.collect()
+        return Response(render_prometheus(snapshot, workers), mimetype='text/plain; version=0.0.4')
+
+    if metrics.snapshot_dir:
+        atexit.register(metrics.write_snapshot, True)
@@ -0,0 +1,165 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+数据库索引迁移
+为已有数据库补建模型中声明但尚不存在的索引，无需重建表；
+黑名单由全局唯一改为按项目唯一时去掉手机号上旧的唯一约束
+
+用法: python migrations.py [配置名称]
+"""
+
+import re
+import sys
+
+from sqlalchemy import inspect, text
+from sqlalchemy.schema import CreateIndex
+
+from models import db
+
+
+def missing_indexes(engine):
+    """
+    找出模型中声明但数据库中不存在的索引
+
+    参数:
+    - engine: SQLAlchemy引擎
+
+    返回:
+    - 缺失的Index对象列表
+    """
+    inspector = inspect(engine)
+    missing = []
+    for table in db.metadata.sorted_tables:
+        # 表不存在时由create_all负责创建，包括其索引
+        if not inspector.has_table(table.name):
+            continue
+        existing = {index['name'] for index in inspector.get_indexes(table.name)}
+        for index in sorted(table.indexes, key=lambda index: index.name):
+            if index.name not in existing:
+                missing.append(index)
+    return missing
+
+
+def create_index(engine, index):
+    """
+    在已有表上创建索引
+
+    PostgreSQL使用CREATE INDEX CONCURRENTLY，建索引期间不阻塞表的读写；
+    SQLite直接在原表上建索引，不需要重建表。
+
+    参数:
+    - engine: SQLAlchemy引擎
+    - index: 需要创建的Index对象
+    """
+    ddl = str(CreateIndex(index, if_not_exists=True).compile(dialect=engine.dialect))
+    if engine.dialect.name == 'postgresql':
+        # CONCURRENTLY不能在事务中执行，使用自动提交连接
+        ddl = re.sub(r'^CREATE (UNIQUE )?INDEX', r'CREATE \1INDEX CONCURRENTLY', ddl)
+        with engine.connect().execution_options(isolation_level='AUTOCOMMIT') as conn:
+            # 大表建索引可能超过连接上设置的语句超时，建完后恢复，连接归还连接池后仍受超时限制
+            conn.execute(text('SET statement_timeout = 0'))
+            try:
+                conn.execute(text(ddl))
+            finally:
+                conn.execute(text('RESET statement_timeout'))
+    else:
+        with engine.begin() as conn:
+            conn.execute(text(ddl))
+
+
+def global_blacklist_constraint(engine):
+    """
+    找出黑名单表手机号上旧的全局唯一约束
+
+    参数:
+    - engine: SQLAlchemy引擎
+
+    返回:
+    - 约束名称，不存在时返回None(SQLite的列内约束没有名称，返回空字符串)
+    """
+    inspector = inspect(engine)
+    if not inspector.has_table('blacklisted_phone'):
+        return None
+    for constraint in inspector.get_unique_constraints('blacklisted_phone'):
+        if constraint['column_names'] == ['phone']:
+            return constraint['name'] or ''
+    return None
+
+
+def relax_blacklist_uniqueness(engine, logger=None):
+    """
+    去掉黑名单表手机号上旧的全局唯一约束，同一号码可以在多个项目中加黑
+
+    SQLite不能删除约束，重建黑名单表并复制数据；其他数据库删除约束，
+    并删除原来非唯一的(项目, 手机号)索引，由ensure_indexes按唯一索引重建。
+
+    参数:
+    - engine: SQLAlchemy引擎
+    - logger: 日志记录器，可选
+
+    返回:
+    - 是否做了迁移
+    """
+    name = global_blacklist_constraint(engine)
+    if name is None:
+        return False
+
+    table = db.metadata.tables['blacklisted_phone']
+    if engine.dialect.name == 'sqlite':
+        indexes = [index['name'] for index in inspect(engine).get_indexes('blacklisted_phone')]
+        columns = ', '.join(column.name for column in table.columns)
+        with engine.begin() as conn:
+            conn.execute(text('ALTER TABLE blacklisted_phone RENAME TO blacklisted_phone_old'))
+            # 索引随表改名，先删除以免与新表的索引重名
+            for index_name in indexes:
+                conn.execute(text(f'DROP INDEX IF EXISTS {index_name}'))
+            table.create(conn)
+            conn.execute(text(f'INSERT INTO blacklisted_phone ({columns}) '
+                              f'SELECT {columns} FROM blacklisted_phone_old'))
+            conn.execute(text('DROP TABLE blacklisted_phone_old'))
+    else:
+        drop = 'DROP INDEX' if engine.dialect.name == 'mysql' else 'DROP CONSTRAINT'
+        with engine.begin() as conn:
+            conn.execute(text(f'ALTER TABLE blacklisted_phone {drop} {name}'))
+        for index in table.indexes:
+            index.drop(engine, checkfirst=True)
+
+    if logger:
+        logger.info('黑名单手机号改为按项目唯一')
+    return True
+
+
+def ensure_indexes(engine, logger=None):
+    """
+    补建所有缺失的索引
+
+    参数:
+    - engine: SQLAlchemy引擎
+    - logger: 日志记录器，可选
+
+    返回:
+    - 新建的索引名称列表
+    """
+    created = []
+    for index in missing_indexes(engine):
+        create_index(engine, index)
+        created.append(index.name)
+        if logger:
+            logger.info('创建索引: %s', index.name)
+    return created
+
+
+if __name__ == '__main__':
+    from app import create_app
+
+    config_name = sys.argv[1] if len(sys.argv) > 1 else 'default'
+    app = create_app(config_name)
+    with app.app_context():
+        if relax_blacklist_uniqueness(db.engine):
+            print("黑名单手机号已改为按项目唯一")
+        names = ensure_indexes(db.engine)
+    if names:
+        print(f"已创建索引: {', '.join(names)}")
+    else:
+        print("所有索引均已存在")
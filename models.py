@@ -2,8 +2,24 @@ import datetime
 from flask_sqlalchemy import SQLAlchemy
 
 # 初始化一个空的SQLAlchemy对象，稍后再用app对象初始化它
+# db.session是按应用上下文划分作用域的会话，会话工厂在每个进程中只创建一次
 db = SQLAlchemy()
 
+def get_pool_status():
+    """
+    获取当前数据库连接池的使用情况
+    
+    返回:
+    - 连接池类型及容量、空闲连接数、已借出连接数、溢出连接数
+    """
+    pool = db.engine.pool
+    status = {'pool_class': type(pool).__name__}
+    for name in ('size', 'checkedin', 'checkedout', 'overflow'):
+        method = getattr(pool, name, None)
+        if callable(method):
+            status[name] = method()
+    return status
+
 # 用户模型
 class User(db.Model):
     id = db.Column(db.Integer, primary_key=True)
@@ -11,8 +27,8 @@ class User(db.Model):
     password = db.Column(db.String(100), nullable=False)
     email = db.Column(db.String(100), unique=True, nullable=False)
     security_question = db.Column(db.String(200), nullable=False)
-    token = db.Column(db.String(500), nullable=True)
-    balance = db.Column(db.Float, default=0.0)
+    token = db.Column(db.String(500), nullable=True, index=True)  # 按token认证，需要索引
+    balance = db.Column(db.Float, default=0.0)  # 启用余额流水前的期初余额，当前余额见billing.get_balance
     created_at = db.Column(db.DateTime, default=datetime.datetime.utcnow)
     
     # 手机号关联
@@ -28,8 +44,7 @@ class User(db.Model):
             'id': self.id,
             'username': self.username,
             'email': self.email,
-            'token': self.token,
-            'balance': self.balance
+            'token': self.token
         }
 
 # 项目模型
@@ -53,6 +68,13 @@ class Project(db.Model):
 
 # 手机号模型
 class PhoneNumber(db.Model):
+    __table_args__ = (
+        # 按用户、项目和状态查询已分配号码
+        db.Index('ix_phone_number_user_project_status', 'user_id', 'project_id', 'status'),
+        # 按分配时间查找租期已过的号码
+        db.Index('ix_phone_number_created_at', 'created_at'),
+    )
+    
     id = db.Column(db.Integer, primary_key=True)
     phone = db.Column(db.String(20), unique=True, nullable=False)
     user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
@@ -77,13 +99,93 @@ class PhoneNumber(db.Model):
             'frozen_amount': self.frozen_amount
         }
 
+# 号码池模型，预先生成并检查过的可分配号码，分配时整行删除
+class PooledPhone(db.Model):
+    __table_args__ = (
+        # 按项目、运营商和号段类型领取号码及统计池中数量
+        db.Index('ix_pooled_phone_project_carrier_type', 'project_id', 'carrier_type', 'number_type', 'id'),
+    )
+    
+    id = db.Column(db.Integer, primary_key=True)
+    phone = db.Column(db.String(20), unique=True, nullable=False)
+    project_id = db.Column(db.String(20), nullable=False)
+    carrier_type = db.Column(db.Integer, nullable=False)  # 0=不限，1=移动，2=联通，3=电信
+    number_type = db.Column(db.Integer, nullable=False)  # 0=不限，1=正常，2=虚拟
+    created_at = db.Column(db.DateTime, default=datetime.datetime.utcnow)
+    
+    def __repr__(self):
+        return f'<PooledPhone {self.phone}>'
+
 # 黑名单手机号模型
 class BlacklistedPhone(db.Model):
+    __table_args__ = (
+        # 按项目加载黑名单及按项目判断号码是否已加黑，同一号码在每个项目中只能加黑一次
+        db.Index('ix_blacklisted_phone_project_phone', 'project_id', 'phone', unique=True),
+    )
+    
     id = db.Column(db.Integer, primary_key=True)
-    phone = db.Column(db.String(20), unique=True, nullable=False)
+    phone = db.Column(db.String(20), nullable=False)
     user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
     project_id = db.Column(db.String(20), nullable=False)
     created_at = db.Column(db.DateTime, default=datetime.datetime.utcnow)
     
     def __repr__(self):
-        return f'<BlacklistedPhone {self.phone}>' 
\ No newline at end of file
+        return f'<BlacklistedPhone {self.phone}>'
+# 短信模型
+class SmsMessage(db.Model):
+    __table_args__ = (
+        # 按号码和项目查询最新收到的短信
+        db.Index('ix_sms_message_phone_project_received', 'phone', 'project_id', 'received_at'),
+    )
+    
+    id = db.Column(db.Integer, primary_key=True)
+    phone = db.Column(db.String(20), nullable=False)
+    project_id = db.Column(db.String(20), nullable=False)
+    content = db.Column(db.Text, nullable=False)
+    code = db.Column(db.String(20), nullable=True)  # 短信中的验证码
+    received_at = db.Column(db.DateTime, default=datetime.datetime.utcnow)
+    
+    def __repr__(self):
+        return f'<SmsMessage {self.phone}>'
+    
+    def to_dict(self):
+        """将短信转换为字典"""
+        return {
+            'phone': self.phone,
+            'project_id': self.project_id,
+            'content': self.content,
+            'code': self.code,
+            'received_at': self.received_at
+        }
+
+# 余额流水模型，只追加不修改，金额以分为单位，正数为入账，负数为扣款
+class BalanceEntry(db.Model):
+    __table_args__ = (
+        # 按用户汇总快照之后的流水
+        db.Index('ix_balance_entry_user_id_id', 'user_id', 'id'),
+    )
+    
+    id = db.Column(db.Integer, primary_key=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
+    amount_cents = db.Column(db.BigInteger, nullable=False)
+    reason = db.Column(db.String(20), nullable=False)  # recharge=充值，debit=冻结扣款，refund=退还冻结金额
+    created_at = db.Column(db.DateTime, default=datetime.datetime.utcnow)
+    
+    def __repr__(self):
+        return f'<BalanceEntry {self.user_id} {self.amount_cents}>'
+
+# 余额快照模型，记录用户截至某条流水(含)的余额
+class BalanceSnapshot(db.Model):
+    __table_args__ = (
+        # 查找用户最新的快照
+        db.Index('ix_balance_snapshot_user_last_entry', 'user_id', 'last_entry_id'),
+    )
+    
+    id = db.Column(db.Integer, primary_key=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
+    last_entry_id = db.Column(db.Integer, nullable=False)  # 快照包含的最后一条流水ID
+    balance_cents = db.Column(db.BigInteger, nullable=False)
+    created_at = db.Column(db.DateTime, default=datetime.datetime.utcnow)
+    
+    def __repr__(self):
+        return f'<BalanceSnapshot {self.user_id} {self.balance_cents}>'
@@ -0,0 +1,230 @@
+import datetime
+import logging
+
+from sqlalchemy import delete, func, insert, select
+from sqlalchemy.exc import IntegrityError
+
+from blacklist_index import blacklist_index
+from leader_worker import LeaderElectedWorker
+from models import PhoneNumber, PooledPhone
+from phone_allocator import phone_allocator
+from project_cache import project_catalogue
+
+logger = logging.getLogger(__name__)
+
+
+class NumberPool(LeaderElectedWorker):
+    """
+    预生成号码池
+
+    后台线程为每个项目和配置的(运营商, 号段类型)预先生成并检查可分配的号码，保持池中号码数量；
+    分配号码时在一条语句中领取并删除池中的号码，请求内不再生成候选号码和重试，
+    号码空间占用率升高时取号耗时也保持平稳。池中号码不足时由调用方回退到号码分配器。
+    多个工作进程通过文件锁选出一个执行补充。
+    """
+
+    task_name = '补充号码池'
+    thread_name = 'number-pool'
+
+    def __init__(self, size=200, interval=2, batch_size=500, lock_path='instance/number_pool.lock'):
+        """
+        初始化号码池
+
+        参数:
+        - size: 每个项目和类型组合保持的号码数
+        - interval: 两次补充之间的间隔(秒)
+        - batch_size: 每个事务最多补充的号码数
+        - lock_path: 选举用的锁文件路径
+        """
+        super().__init__(interval, lock_path)
+        self.size = size
+        self.batch_size = batch_size
+        self.types = ()  # 需要预生成号码的(运营商, 号段类型)，为空时不使用号码池
+        self.claimed = 0
+        self.misses = 0
+        self.discarded = 0
+        self.refilled = 0
+
+    def configure(self, types, size, interval, batch_size, lock_path):
+        """
+        按配置设置号码池参数
+
+        参数:
+        - types: 需要预生成号码的(运营商, 号段类型)列表
+        - size: 每个项目和类型组合保持的号码数
+        - interval: 两次补充之间的间隔(秒)
+        - batch_size: 每个事务最多补充的号码数
+        - lock_path: 选举用的锁文件路径
+        """
+        self.types = tuple((int(carrier_type), int(number_type)) for carrier_type, number_type in types)
+        self.size = size
+        self.interval = interval
+        self.batch_size = batch_size
+        self.lock_path = lock_path
+
+    def claim(self, session, project_id, carrier_type=0, number_type=0, count=1):
+        """
+        从号码池领取号码
+
+        支持DELETE ... RETURNING的数据库用一条 DELETE ... WHERE id IN (SELECT ... FOR UPDATE SKIP LOCKED) RETURNING
+        领取，并发请求跳过彼此锁定的行，不会领到同一个号码；其他数据库先加锁查询再删除。
+        领取在调用方的事务中完成，扣款失败回滚时号码回到池中。
+        领到的号码会再排除一次补充之后加入黑名单或被占用的号码。
+
+        参数:
+        - session: 数据库会话
+        - project_id: 项目ID
+        - carrier_type: 运营商类型
+        - number_type: 号段类型
+        - count: 需要的号码数量
+
+        返回:
+        - 领到的手机号码列表，池中号码不足时少于count
+        """
+        key = (int(carrier_type), int(number_type))
+        if key not in self.types:
+            return []
+
+        criteria = (PooledPhone.project_id == project_id,
+                    PooledPhone.carrier_type == key[0],
+                    PooledPhone.number_type == key[1])
+        if session.get_bind().dialect.delete_returning:
+            ids = (select(PooledPhone.id).where(*criteria)
+                   .order_by(PooledPhone.id)
+                   .limit(count)
+                   .with_for_update(skip_locked=True))
+            phones = [row[0] for row in session.execute(
+                delete(PooledPhone).where(PooledPhone.id.in_(ids)).returning(PooledPhone.phone))]
+        else:
+            rows = session.execute(
+                select(PooledPhone.id, PooledPhone.phone).where(*criteria)
+                .order_by(PooledPhone.id)
+                .limit(count)
+                .with_for_update(skip_locked=True)
+            ).all()
+            if rows:
+                session.execute(delete(PooledPhone).where(PooledPhone.id.in_([row[0] for row in rows])))
+            phones = [row[1] for row in rows]
+
+        valid = phones
+        if phones:
+            available = blacklist_index.exclude(session, project_id, phones)
+            if available:
+                used = session.query(PhoneNumber.phone).filter(PhoneNumber.phone.in_(available)).all()
+                available.difference_update(row[0] for row in used)
+            valid = [phone for phone in phones if phone in available]
+
+        with self._lock:
+            self.claimed += len(valid)
+            self.discarded += len(phones) - len(valid)
+            if len(valid) < count:
+                self.misses += 1
+        return valid
+
+    def run_once(self, session):
+        """
+        把每个项目和类型组合的号码补充到size个，每批一个事务
+
+        参数:
+        - session: 数据库会话
+
+        返回:
+        - 补充的号码数
+        """
+        sizes = {}
+        for project_id, carrier_type, number_type, pooled in (
+                session.query(PooledPhone.project_id, PooledPhone.carrier_type, PooledPhone.number_type,
+                              func.count(PooledPhone.id))
+                .group_by(PooledPhone.project_id, PooledPhone.carrier_type, PooledPhone.number_type)):
+            sizes[(project_id, carrier_type, number_type)] = pooled
+        session.rollback()
+
+        total = 0
+        for project in project_catalogue.search(session):
+            for carrier_type, number_type in self.types:
+                missing = self.size - sizes.get((project.project_id, carrier_type, number_type), 0)
+                while missing > 0:
+                    phones = phone_allocator.allocate(session, project.project_id, carrier_type, number_type,
+                                                      min(missing, self.batch_size))
+                    if not phones:
+                        break
+                    try:
+                        session.execute(insert(PooledPhone), [{
+                            'phone': phone,
+                            'project_id': project.project_id,
+                            'carrier_type': carrier_type,
+                            'number_type': number_type
+                        } for phone in phones])
+                        session.commit()
+                    except IntegrityError:
+                        # 与回退到分配器的请求同时选中了同一号码，下次补充时重新生成
+                        session.rollback()
+                        break
+                    except Exception:
+                        session.rollback()
+                        raise
+                    total += len(phones)
+                    missing -= len(phones)
+
+        with self._lock:
+            self.runs += 1
+            self.refilled += total
+            self.last_run_at = datetime.datetime.utcnow().isoformat()
+        if total:
+            logger.info('补充号码池%d个号码', total)
+        return total
+
+    def stats(self):
+        """
+        获取号码池情况
+
+        返回:
+        - 是否负责补充、每个组合保持的号码数、领取数、未领够的次数、丢弃数、补充数、补充次数、错误数、最近补充时间
+        """
+        with self._lock:
+            return {
+                'is_leader': self.is_leader,
+                'size': self.size,
+                'claimed': self.claimed,
+                'misses': self.misses,
+                'discarded': self.discarded,
+                'refilled': self.refilled,
+                'runs': self.runs,
+                'errors': self.errors,
+                'last_run_at': self.last_run_at
+            }
+
+
+# 全局号码池
+number_pool = NumberPool()
+
+
+def start_number_pool(app):
+    """
+    按应用配置启用号码池并启动后台补充线程
+
+    参数:
+    - app: Flask应用实例
+    """
+    if not app.config.get('NUMBER_POOL_ENABLED', True):
+        return
+    number_pool.configure(app.config['NUMBER_POOL_TYPES'], app.config['NUMBER_POOL_SIZE'],
+                          app.config['NUMBER_POOL_INTERVAL'], app.config['NUMBER_POOL_BATCH_SIZE'],
+                          app.config['NUMBER_POOL_LOCK'])
+    number_pool.start(app)
+
+
+def get_number_pool_stats():
+    """获取号码池情况"""
+    return number_pool.stats()
+
+
+def get_number_pool_counters():
+    """号码池的累计计数，用于/metrics"""
+    stats = number_pool.stats()
+    return {
+        'sms_api_number_pool_claimed_total': stats['claimed'],
+        'sms_api_number_pool_misses_total': stats['misses'],
+        'sms_api_number_pool_refilled_total': stats['refilled'],
+        'sms_api_number_pool_errors_total': stats['errors']
+    }
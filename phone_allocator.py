@@ -0,0 +1,177 @@
+import math
+import random
+import threading
+
+from sqlalchemy import delete
+
+from blacklist_index import blacklist_index
+from models import PhoneNumber, PooledPhone
+from phone_utils import SUFFIX_SPACE, get_prefixes
+
+
+class PrefixCursor:
+    """
+    单个号段的无放回遍历游标
+
+    用4轮Feistel网络把递增的游标位置置换为后8位(高4位、低4位各为一半)，
+    置换是一一映射，因此在一个周期内不会重复产生同一个号码，且相邻号码之间没有规律。
+    每个进程随机选择轮密钥和起始位置，不同工作进程的遍历顺序互不相同。
+    """
+
+    ROUNDS = 4
+    HALF = math.isqrt(SUFFIX_SPACE)  # 置换的定义域为 HALF x HALF，与号段后缀空间相同
+
+    def __init__(self, rng):
+        """
+        初始化游标
+
+        参数:
+        - rng: 随机数生成器，用于选择轮密钥和起始位置
+        """
+        self.keys = [rng.getrandbits(32) for _ in range(self.ROUNDS)]
+        self.position = rng.randrange(SUFFIX_SPACE)
+
+    def _permute(self, value):
+        """把0~10^8-1之间的整数置换为另一个整数"""
+        half = self.HALF
+        left, right = divmod(value, half)
+        for key in self.keys:
+            mixed = ((right * 2654435761) ^ key) & 0xFFFFFFFF
+            left, right = right, (left + (mixed >> 7)) % half
+        return left * half + right
+
+    def take(self, n):
+        """
+        取出接下来的n个后缀
+
+        参数:
+        - n: 数量
+
+        返回:
+        - 8位数字字符串列表
+        """
+        start = self.position
+        self.position = (start + n) % SUFFIX_SPACE
+        permute = self._permute
+        return ['%08d' % permute((start + i) % SUFFIX_SPACE) for i in range(n)]
+
+
+class PhoneAllocator:
+    """
+    手机号码分配器
+
+    从符合条件的 号段 × 后8位 空间中无放回地产生候选号码，
+    每批候选号码只用一次IN查询排除已被占用的号码，不再依赖随机碰撞重试。
+    """
+
+    def __init__(self, batch_size=64, max_rounds=8, seed=None):
+        """
+        初始化分配器
+
+        参数:
+        - batch_size: 每批最少生成的候选号码数
+        - max_rounds: 最多查询的批次数
+        - seed: 随机种子，可选
+        """
+        self.batch_size = batch_size
+        self.max_rounds = max_rounds
+        self._rng = random.Random(seed)
+        self._cursors = {}
+        self._lock = threading.Lock()
+
+    def candidates(self, carrier_type, number_type, n):
+        """
+        生成一批候选号码，同一进程内不会重复
+
+        参数:
+        - carrier_type: 运营商类型，0不限，1移动，2联通，3电信
+        - number_type: 号段类型，0不限，1正常，2虚拟
+        - n: 候选号码数量
+
+        返回:
+        - 候选手机号码列表
+        """
+        prefixes = get_prefixes(carrier_type, number_type)
+        with self._lock:
+            # 按号段随机分配本批数量，保持与随机生成相同的号段分布
+            counts = {}
+            for _ in range(n):
+                prefix = self._rng.choice(prefixes)
+                counts[prefix] = counts.get(prefix, 0) + 1
+
+            phones = []
+            for prefix, count in counts.items():
+                cursor = self._cursors.get(prefix)
+                if cursor is None:
+                    cursor = self._cursors[prefix] = PrefixCursor(self._rng)
+                phones.extend(prefix + suffix for suffix in cursor.take(count))
+            # 打乱顺序，避免只取前几个时偏向某个号段
+            self._rng.shuffle(phones)
+        return phones
+
+    def allocate(self, session, project_id, carrier_type=0, number_type=0, count=1):
+        """
+        查找可分配的号码
+
+        排除项目黑名单、已被占用和已放入号码池的号码，号码空间耗尽或达到最大批次数时
+        返回已找到的部分号码。本方法只查询不写入，由调用方创建号码记录。
+
+        参数:
+        - session: 数据库会话
+        - project_id: 项目ID
+        - carrier_type: 运营商类型
+        - number_type: 号段类型
+        - count: 需要的号码数量
+
+        返回:
+        - 可用手机号码列表，长度不超过count
+        """
+        phones = []
+        for _ in range(self.max_rounds):
+            needed = count - len(phones)
+            if needed <= 0:
+                break
+
+            batch = self.candidates(carrier_type, number_type, max(needed * 2, self.batch_size))
+
+            # 排除黑名单中的号码
+            available = blacklist_index.exclude(session, project_id, batch)
+            if not available:
+                continue
+
+            # 一次IN查询排除已被占用或已放入号码池的号码
+            used = (session.query(PhoneNumber.phone).filter(PhoneNumber.phone.in_(available))
+                    .union_all(session.query(PooledPhone.phone).filter(PooledPhone.phone.in_(available)))
+                    .all())
+            available.difference_update(row[0] for row in used)
+
+            # 保持候选顺序，便于结果可复现
+            phones.extend([phone for phone in batch if phone in available][:needed])
+        return phones
+
+
+def delete_phone_numbers(session, *criteria):
+    """
+    删除符合条件的号码记录并返回实际删除的记录
+
+    支持DELETE ... RETURNING的数据库在一条语句中删除并返回被删除的记录，
+    与同时释放或回收同一号码的其他事务不会重复退款；其他数据库先加锁查询再删除。
+
+    参数:
+    - session: 数据库会话
+    - criteria: PhoneNumber的过滤条件
+
+    返回:
+    - 被删除记录的(user_id, phone, frozen_amount)列表
+    """
+    columns = (PhoneNumber.user_id, PhoneNumber.phone, PhoneNumber.frozen_amount)
+    statement = delete(PhoneNumber).where(*criteria)
+    if session.get_bind().dialect.delete_returning:
+        return session.execute(statement.returning(*columns)).all()
+    rows = session.query(*columns).filter(*criteria).with_for_update().all()
+    session.execute(statement.execution_options(synchronize_session=False))
+    return rows
+
+
+# 全局号码分配器
+phone_allocator = PhoneAllocator()
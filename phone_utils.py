@@ -29,77 +29,133 @@ VIRTUAL_PREFIX = [
     '197', '198', '199'
 ]
 
-def generate_random_phone(carrier_type=0, number_type=0):
+# 号码后8位的取值空间
+SUFFIX_SPACE = 10 ** 8
+
+def _build_prefixes(carrier_type, number_type):
     """
-    生成随机手机号码
+    计算符合运营商类型和号段类型的号码前缀，仅在模块导入时调用
     
     参数:
     - carrier_type: 运营商类型，0不限，1移动，2联通，3电信
     - number_type: 号段类型，0不限，1正常，2虚拟
     
     返回:
-    - 生成的随机手机号码
+    - 号码前缀元组
     """
-    # 选择运营商前缀
+    all_prefixes = CHINA_MOBILE_PREFIX + CHINA_UNICOM_PREFIX + CHINA_TELECOM_PREFIX
+    
     if carrier_type == 0:  # 不限运营商
         if number_type == 0:  # 不限号段类型
-            # 随机选择所有运营商的所有号段
-            all_prefixes = CHINA_MOBILE_PREFIX + CHINA_UNICOM_PREFIX + CHINA_TELECOM_PREFIX
-            prefix = random.choice(all_prefixes)
+            # 所有运营商的所有号段
+            return tuple(all_prefixes)
         elif number_type == 1:  # 正常号段
             # 排除虚拟号段
-            normal_prefixes = [p for p in (CHINA_MOBILE_PREFIX + CHINA_UNICOM_PREFIX + CHINA_TELECOM_PREFIX) 
-                               if p not in VIRTUAL_PREFIX]
-            prefix = random.choice(normal_prefixes)
-        else:  # 虚拟号段
-            prefix = random.choice(VIRTUAL_PREFIX)
-    elif carrier_type == 1:  # 移动
-        if number_type == 0 or number_type == 1:  # 不限或正常号段
-            # 移动非虚拟号段
-            normal_mobile = [p for p in CHINA_MOBILE_PREFIX if p not in VIRTUAL_PREFIX]
-            prefix = random.choice(normal_mobile)
-        else:  # 虚拟号段
-            # 移动虚拟号段
-            virtual_mobile = [p for p in VIRTUAL_PREFIX if p in CHINA_MOBILE_PREFIX]
-            # 如果没有符合条件的号段，使用普通移动号段
-            if not virtual_mobile:
-                prefix = random.choice(CHINA_MOBILE_PREFIX)
-            else:
-                prefix = random.choice(virtual_mobile)
-    elif carrier_type == 2:  # 联通
-        if number_type == 0 or number_type == 1:  # 不限或正常号段
-            # 联通非虚拟号段
-            normal_unicom = [p for p in CHINA_UNICOM_PREFIX if p not in VIRTUAL_PREFIX]
-            prefix = random.choice(normal_unicom)
-        else:  # 虚拟号段
-            # 联通虚拟号段
-            virtual_unicom = [p for p in VIRTUAL_PREFIX if p in CHINA_UNICOM_PREFIX]
-            # 如果没有符合条件的号段，使用普通联通号段
-            if not virtual_unicom:
-                prefix = random.choice(CHINA_UNICOM_PREFIX)
-            else:
-                prefix = random.choice(virtual_unicom)
-    elif carrier_type == 3:  # 电信
-        if number_type == 0 or number_type == 1:  # 不限或正常号段
-            # 电信非虚拟号段
-            normal_telecom = [p for p in CHINA_TELECOM_PREFIX if p not in VIRTUAL_PREFIX]
-            prefix = random.choice(normal_telecom)
+            return tuple(p for p in all_prefixes if p not in VIRTUAL_PREFIX)
         else:  # 虚拟号段
-            # 电信虚拟号段
-            virtual_telecom = [p for p in VIRTUAL_PREFIX if p in CHINA_TELECOM_PREFIX]
-            # 如果没有符合条件的号段，使用普通电信号段
-            if not virtual_telecom:
-                prefix = random.choice(CHINA_TELECOM_PREFIX)
-            else:
-                prefix = random.choice(virtual_telecom)
+            return tuple(VIRTUAL_PREFIX)
     
-    # 生成后8位随机数字
-    suffix = ''.join([str(random.randint(0, 9)) for _ in range(8)])
+    carrier_prefixes = {
+        1: CHINA_MOBILE_PREFIX,  # 移动
+        2: CHINA_UNICOM_PREFIX,  # 联通
+        3: CHINA_TELECOM_PREFIX  # 电信
+    }[carrier_type]
+    
+    if number_type == 0 or number_type == 1:  # 不限或正常号段
+        # 该运营商的非虚拟号段
+        return tuple(p for p in carrier_prefixes if p not in VIRTUAL_PREFIX)
+    
+    # 该运营商的虚拟号段，如果没有符合条件的号段，使用该运营商的全部号段
+    virtual_prefixes = tuple(p for p in VIRTUAL_PREFIX if p in carrier_prefixes)
+    return virtual_prefixes or tuple(carrier_prefixes)
+
+def _build_prefix_info():
+    """
+    计算 前缀 -> (运营商类型, 号段类型) 映射，仅在模块导入时调用
+    
+    同一前缀出现在多个运营商列表中时，按移动、联通、电信的顺序取第一个。
+    """
+    prefix_info = {}
+    for carrier_type, prefixes in ((1, CHINA_MOBILE_PREFIX), (2, CHINA_UNICOM_PREFIX), (3, CHINA_TELECOM_PREFIX)):
+        for prefix in prefixes:
+            if prefix not in prefix_info:
+                number_type = 2 if prefix in VIRTUAL_PREFIX else 1
+                prefix_info[prefix] = (carrier_type, number_type)
+    return prefix_info
+
+# 前缀 -> (运营商类型, 号段类型)，只包含有效的运营商前缀
+PREFIX_INFO = _build_prefix_info()
+
+# (运营商类型, 号段类型) -> 号码前缀元组
+PREFIXES_BY_TYPE = {
+    (carrier_type, number_type): _build_prefixes(carrier_type, number_type)
+    for carrier_type in (0, 1, 2, 3)
+    for number_type in (0, 1, 2)
+}
+
+def get_prefixes(carrier_type=0, number_type=0):
+    """
+    获取符合运营商类型和号段类型的号码前缀
     
-    # 组合前缀和后缀生成完整手机号
-    phone = prefix + suffix
+    参数:
+    - carrier_type: 运营商类型，0不限，1移动，2联通，3电信
+    - number_type: 号段类型，0不限，1正常，2虚拟
     
-    return phone
+    返回:
+    - 号码前缀元组
+    """
+    # 0、1以外的号段类型均按虚拟号段处理
+    if number_type != 0 and number_type != 1:
+        number_type = 2
+    try:
+        return PREFIXES_BY_TYPE[(carrier_type, number_type)]
+    except KeyError:
+        raise ValueError(f'无效的运营商类型: {carrier_type}')
+
+def generate_random_phone(carrier_type=0, number_type=0):
+    """
+    生成随机手机号码
+    
+    参数:
+    - carrier_type: 运营商类型，0不限，1移动，2联通，3电信
+    - number_type: 号段类型，0不限，1正常，2虚拟
+    
+    返回:
+    - 生成的随机手机号码
+    """
+    # 选择前缀并生成后8位随机数字
+    prefix = random.choice(get_prefixes(carrier_type, number_type))
+    return prefix + '%08d' % random.randrange(SUFFIX_SPACE)
+
+def generate_random_phones(n, carrier_type=0, number_type=0):
+    """
+    批量生成随机手机号码
+    
+    参数:
+    - n: 生成数量
+    - carrier_type: 运营商类型，0不限，1移动，2联通，3电信
+    - number_type: 号段类型，0不限，1正常，2虚拟
+    
+    返回:
+    - 随机手机号码列表，可能包含重复号码
+    """
+    prefixes = random.choices(get_prefixes(carrier_type, number_type), k=n)
+    suffixes = random.choices(range(SUFFIX_SPACE), k=n)
+    return [prefix + '%08d' % suffix for prefix, suffix in zip(prefixes, suffixes)]
+
+def classify_phone(phone):
+    """
+    一次查表获取手机号码的运营商类型和号段类型
+    
+    参数:
+    - phone: 手机号码
+    
+    返回:
+    - (运营商类型, 号段类型)，无效号码返回(0, 0)
+    """
+    if len(phone) != 11 or not phone.isdigit():
+        return (0, 0)
+    return PREFIX_INFO.get(phone[:3], (0, 0))
 
 def is_valid_phone(phone):
     """
@@ -111,20 +167,8 @@ def is_valid_phone(phone):
     返回:
     - 是否有效
     """
-    # 检查长度
-    if len(phone) != 11:
-        return False
-    
-    # 检查是否全为数字
-    if not phone.isdigit():
-        return False
-    
-    # 检查前三位是否为有效运营商前缀
-    prefix = phone[:3]
-    if prefix not in (CHINA_MOBILE_PREFIX + CHINA_UNICOM_PREFIX + CHINA_TELECOM_PREFIX):
-        return False
-    
-    return True
+    # 长度为11位、全为数字且前三位为有效运营商前缀
+    return len(phone) == 11 and phone.isdigit() and phone[:3] in PREFIX_INFO
 
 def get_carrier_type(phone):
     """
@@ -136,19 +180,7 @@ def get_carrier_type(phone):
     返回:
     - 1: 移动, 2: 联通, 3: 电信, 0: 未知
     """
-    if not is_valid_phone(phone):
-        return 0
-    
-    prefix = phone[:3]
-    
-    if prefix in CHINA_MOBILE_PREFIX:
-        return 1
-    elif prefix in CHINA_UNICOM_PREFIX:
-        return 2
-    elif prefix in CHINA_TELECOM_PREFIX:
-        return 3
-    else:
-        return 0
+    return classify_phone(phone)[0]
 
 def get_number_type(phone):
     """
@@ -160,12 +192,4 @@ def get_number_type(phone):
     返回:
     - 1: 正常号段, 2: 虚拟号段, 0: 未知
     """
-    if not is_valid_phone(phone):
-        return 0
-    
-    prefix = phone[:3]
-    
-    if prefix in VIRTUAL_PREFIX:
-        return 2
-    else:
-        return 1 
\ No newline at end of file
+    return classify_phone(phone)[1]
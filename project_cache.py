@@ -0,0 +1,132 @@
+import threading
+import time
+from collections import namedtuple
+
+from models import Project
+
+# 缓存中的项目信息
+ProjectInfo = namedtuple('ProjectInfo', ['project_id', 'name', 'amount'])
+
+# 某一时刻的项目目录，重新加载时整体替换，读取方只取一次引用
+_Catalogue = namedtuple('_Catalogue', ['rows', 'by_id', 'index', 'order'])
+
+
+def _ngrams(text):
+    """返回文本中所有长度为1和2的子串"""
+    grams = set(text)
+    grams.update(text[i:i + 2] for i in range(len(text) - 1))
+    return grams
+
+
+class ProjectCatalogue:
+    """
+    项目目录缓存
+
+    在进程内缓存全部项目，按project_id的O(1)查找和按名称的n-gram索引搜索都不访问数据库。
+    每个工作进程定期从数据库重新加载，内容有变化时重建索引，直接修改数据库中的项目最迟在一个刷新间隔后
+    对所有工作进程生效；查找不到项目时会提前重新加载一次，新增的项目无需等待定期刷新。
+    """
+
+    def __init__(self, refresh_interval=60, miss_refresh_interval=1):
+        """
+        初始化项目目录
+
+        参数:
+        - refresh_interval: 定期重新加载的间隔(秒)
+        - miss_refresh_interval: 查找不到项目时重新加载的最小间隔(秒)
+        """
+        self.refresh_interval = refresh_interval
+        self.miss_refresh_interval = miss_refresh_interval
+        # index: n-gram -> 项目ID集合，order: 项目ID -> 数据库中的顺序
+        self._catalogue = _Catalogue(rows=(), by_id={}, index={}, order={})
+        self._loaded_at = 0.0
+        self._lock = threading.Lock()
+
+    def _refresh(self, session):
+        """从数据库重新加载项目，内容有变化时重建索引"""
+        rows = tuple(session.query(Project.project_id, Project.name, Project.amount).order_by(Project.id))
+        self._loaded_at = time.time()
+        if rows == self._catalogue.rows:
+            return
+
+        by_id = {}
+        index = {}
+        order = {}
+        for position, (project_id, name, amount) in enumerate(rows):
+            by_id[project_id] = ProjectInfo(project_id, name, amount)
+            order[project_id] = position
+            for gram in _ngrams(name.lower()):
+                index.setdefault(gram, set()).add(project_id)
+
+        self._catalogue = _Catalogue(rows, by_id, index, order)
+
+    def _ensure_fresh(self, session, max_age):
+        """缓存超过max_age秒未加载时重新加载"""
+        if time.time() - self._loaded_at >= max_age:
+            with self._lock:
+                if time.time() - self._loaded_at >= max_age:
+                    self._refresh(session)
+
+    def get(self, session, project_id):
+        """
+        按项目ID查找项目
+
+        参数:
+        - session: 数据库会话，仅在需要重新加载时使用
+        - project_id: 项目ID
+
+        返回:
+        - ProjectInfo，项目不存在时返回None
+        """
+        self._ensure_fresh(session, self.refresh_interval)
+        project = self._catalogue.by_id.get(project_id)
+        if project is None:
+            self._ensure_fresh(session, self.miss_refresh_interval)
+            project = self._catalogue.by_id.get(project_id)
+        return project
+
+    def search(self, session, project_id=None, name=None):
+        """
+        搜索项目
+
+        参数:
+        - session: 数据库会话，仅在需要重新加载时使用
+        - project_id: 项目ID，可选，精确匹配
+        - name: 项目名称，可选，包含匹配(不区分大小写)
+
+        返回:
+        - 匹配的ProjectInfo列表，按数据库中的顺序排列
+        """
+        self._ensure_fresh(session, self.refresh_interval)
+        # 只读取一次目录引用，并发重新加载不会让索引和项目表来自不同版本
+        catalogue = self._catalogue
+        by_id, index, order = catalogue.by_id, catalogue.index, catalogue.order
+
+        if name:
+            keyword = name.lower()
+            # 取关键词中所有n-gram对应项目的交集，再确认名称确实包含关键词
+            grams = _ngrams(keyword) if len(keyword) < 3 else {keyword[i:i + 2] for i in range(len(keyword) - 1)}
+            candidates = None
+            for gram in sorted(grams, key=lambda gram: len(index.get(gram, ()))):
+                postings = index.get(gram)
+                if not postings:
+                    return []
+                candidates = set(postings) if candidates is None else candidates & postings
+            matched = [pid for pid in candidates if keyword in by_id[pid].name.lower()]
+        else:
+            matched = list(by_id)
+
+        if project_id:
+            matched = [pid for pid in matched if pid == project_id]
+
+        matched.sort(key=order.get)
+        return [by_id[pid] for pid in matched]
+
+    def invalidate(self):
+        """使缓存失效，下次使用时重新加载"""
+        with self._lock:
+            self._loaded_at = 0.0
+
+
+# 全局项目目录
+project_catalogue = ProjectCatalogue()
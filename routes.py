@@ -1,16 +1,48 @@
-from flask import Blueprint, request, jsonify, current_app
-import random
-import string
+from flask import Blueprint, Response, request, jsonify, current_app, stream_with_context
+import codecs
+import csv
 import jwt
 import datetime
-from models import db, User, Project, PhoneNumber, BlacklistedPhone
-from async_util import run_async
-from phone_utils import generate_random_phone, get_carrier_type, get_number_type, is_valid_phone
-from sqlalchemy.orm import sessionmaker
+import hmac
+import logging
+import time
+from sqlalchemy import insert
+from models import db, get_pool_status, User, PhoneNumber, BlacklistedPhone
+from async_util import api_rate_limiter, get_executor_stats, rate_limit, rate_limited_response, run_async
+from auth_util import authenticate, token_cache
+from billing import REASON_RECHARGE, credit_balance, to_cents, debit_balance, get_balance, get_balance_compactor_stats
+from blacklist_index import blacklist_index
+from lease_reaper import get_lease_reaper_stats
+from log_util import get_log_stats
+from number_pool import get_number_pool_stats, number_pool
+from sqlite_tuning import get_sqlite_writer_stats
+from phone_allocator import delete_phone_numbers, phone_allocator
+from phone_utils import classify_phone, is_valid_phone
+from project_cache import project_catalogue
+from sms_inbox import get_sms_provider, sms_inbox
+from sms_notify import sms_notifier
+
+logger = logging.getLogger(__name__)
 
 # 创建蓝图
 api = Blueprint('api', __name__)
 
+# 不参与全局限流的接口：服务状态接口和短信服务商推送入站短信的接口(由令牌校验)
+RATE_LIMIT_EXEMPT = frozenset({'api.index', 'api.sms_inbound'})
+
+# 全局限流
+@api.before_request
+def apply_rate_limit():
+    """按token(没有token时按客户端IP)对API请求统一限流，RATE_LIMIT_EXEMPT中的接口除外"""
+    if not current_app.config.get('RATE_LIMIT_ENABLED', True):
+        return None
+    if request.endpoint in RATE_LIMIT_EXEMPT:
+        return None
+    client_id = request.args.get('token') or request.remote_addr
+    if not api_rate_limiter.try_acquire(client_id):
+        return rate_limited_response(api_rate_limiter)
+    return None
+
 # 根路由 - 为测试添加
 @api.route('/', methods=['GET'])
 def index():
@@ -25,11 +57,25 @@ def index():
     - name: API名称
     - version: API版本
     - status: 服务状态
+    - db_pool: 数据库连接池使用情况
+    - executor: 数据库操作线程池使用情况
+    - lease_reaper: 过期号码回收情况
+    - balance_compactor: 余额快照汇总情况
+    - number_pool: 号码池情况
+    - sqlite_writer: SQLite写锁排队情况
+    - logging: 日志队列情况
     """
     return jsonify({
         'name': 'SMS API服务',
         'version': '1.0.0',
-        'status': 'running'
+        'status': 'running',
+        'db_pool': get_pool_status(),
+        'executor': get_executor_stats(),
+        'lease_reaper': get_lease_reaper_stats(),
+        'balance_compactor': get_balance_compactor_stats(),
+        'number_pool': get_number_pool_stats(),
+        'sqlite_writer': get_sqlite_writer_stats(),
+        'logging': get_log_stats()
     }), 200
 
 # 用户注册API
@@ -139,6 +185,7 @@ def login():
         'exp': datetime.datetime.utcnow() + datetime.timedelta(days=current_app.config['JWT_EXPIRATION_DAYS'])
     }, current_app.config['SECRET_KEY'])
     
+    token_cache.discard(user.token)
     user.token = token
     db.session.commit()
     
@@ -149,7 +196,7 @@ def login():
             'username': username,
             'email': user.email,
             'token': token,
-            'balance': user.balance
+            'balance': get_balance(db.session, user.id)
         }
     }), 200
 
@@ -160,11 +207,11 @@ def recharge():
     用户充值接口
     
     根据token验证用户身份，为用户账户充值指定金额。
-    充值成功后更新数据库中的用户余额。
+    充值成功后为用户追加一条充值流水。
     
     参数:
     - token: 用户登录后获取的token，必填
-    - amount: 充值金额，必填，必须大于0
+    - amount: 充值金额，必填，至少0.01元
     
     返回:
     - success: 操作是否成功
@@ -180,41 +227,32 @@ def recharge():
     if not all([token, amount_str]):
         return jsonify({'success': False, 'message': '缺少必要的充值信息'}), 400
     
-    # 验证amount是否为有效的数字
+    # 验证amount是否为有效的数字，inf、nan和超出流水金额范围的数字无效
     try:
         amount = float(amount_str)
+        cents = to_cents(amount)
     except ValueError:
         return jsonify({'success': False, 'message': '充值金额必须是有效的数字'}), 400
     
-    # 验证金额是否大于0
-    if amount <= 0:
-        return jsonify({'success': False, 'message': '充值金额必须大于0'}), 400
-    
-    # 查找具有该token的用户
-    user = User.query.filter_by(token=token).first()
+    # 验证金额换算为分后至少为1分，不足1分的充值不会入账
+    if cents < 1:
+        return jsonify({'success': False, 'message': '充值金额不能少于0.01'}), 400
     
     # 验证token是否有效
-    if not user:
-        return jsonify({'success': False, 'message': '无效的token，请重新登录'}), 401
-    
-    try:
-        # 验证token有效期
-        decoded_token = jwt.decode(token, current_app.config['SECRET_KEY'], algorithms=["HS256"])
-        # 检查token是否过期在jwt.decode中已经处理
-    except jwt.ExpiredSignatureError:
-        return jsonify({'success': False, 'message': 'token已过期，请重新登录'}), 401
-    except jwt.InvalidTokenError:
-        return jsonify({'success': False, 'message': '无效的token格式'}), 401
+    user, error = authenticate(db.session, token)
+    if error:
+        return jsonify({'success': False, 'message': error}), 401
     
     # 更新用户余额
-    user.balance += amount
+    credit_balance(db.session, user.id, amount, REASON_RECHARGE)
+    balance = get_balance(db.session, user.id)
     db.session.commit()
     
     return jsonify({
         'success': True,
         'message': '充值成功',
         'username': user.username,
-        'balance': user.balance
+        'balance': balance
     }), 200
 
 # 测试路由
@@ -256,28 +294,17 @@ def check_balance():
     if not token:
         return jsonify({'success': False, 'message': '缺少必要的token信息'}), 400
     
-    # 直接查询用户，不使用异步方式
-    user = User.query.filter_by(token=token).first()
-    
     # 验证token是否有效
-    if not user:
-        return jsonify({'success': False, 'message': '无效的token，请重新登录'}), 401
-    
-    try:
-        # 验证token有效期
-        decoded_token = jwt.decode(token, current_app.config['SECRET_KEY'], algorithms=["HS256"])
-        # 检查token是否过期在jwt.decode中已经处理
-    except jwt.ExpiredSignatureError:
-        return jsonify({'success': False, 'message': 'token已过期，请重新登录'}), 401
-    except jwt.InvalidTokenError:
-        return jsonify({'success': False, 'message': '无效的token格式'}), 401
+    user, error = authenticate(db.session, token)
+    if error:
+        return jsonify({'success': False, 'message': error}), 401
     
     # 返回用户余额信息
     return jsonify({
         'success': True,
         'message': '查询成功',
         'username': user.username,
-        'balance': user.balance
+        'balance': get_balance(db.session, user.id)
     }), 200
 
 # 修改密码API
@@ -342,6 +369,7 @@ def change_password():
     user.password = new_password
     
     # 使原token作废（设置为空或生成一个无效token）
+    token_cache.discard(user.token)
     user.token = ""
     
     # 保存更改到数据库
@@ -380,34 +408,15 @@ def search_projects():
         return jsonify({'success': False, 'message': '缺少必要的token信息'}), 400
     
     # 验证token是否有效
-    user = User.query.filter_by(token=token).first()
-    if not user:
-        return jsonify({'success': False, 'message': '无效的token，请重新登录'}), 401
-    
-    try:
-        # 验证token有效期
-        decoded_token = jwt.decode(token, current_app.config['SECRET_KEY'], algorithms=["HS256"])
-    except jwt.ExpiredSignatureError:
-        return jsonify({'success': False, 'message': 'token已过期，请重新登录'}), 401
-    except jwt.InvalidTokenError:
-        return jsonify({'success': False, 'message': '无效的token格式'}), 401
-    
-    # 构建查询
-    query = Project.query
+    user, error = authenticate(db.session, token)
+    if error:
+        return jsonify({'success': False, 'message': error}), 401
     
-    # 按项目ID搜索（精确匹配）
-    if project_id:
-        query = query.filter(Project.project_id == project_id)
-    
-    # 按项目名称搜索（模糊匹配）
-    if name:
-        query = query.filter(Project.name.like(f'%{name}%'))
-    
-    # 执行查询
-    projects = query.all()
+    # 从项目目录缓存中搜索，项目ID精确匹配，项目名称模糊匹配
+    projects = project_catalogue.search(db.session, project_id=project_id, name=name)
     
     # 将结果转换为字典列表
-    result = [project.to_dict() for project in projects]
+    result = [project._asdict() for project in projects]
     
     # 修改所有项目的金额为固定值0.1
     for project_dict in result:
@@ -478,6 +487,73 @@ def get_phone():
     # 返回结果
     return jsonify(result), status_code
 
+# 批量获取手机号码API
+@api.route('/get_phones', methods=['GET'])
+def get_phones():
+    """
+    批量获取手机号码接口
+
+    根据项目ID一次获取多个随机可用的手机号码，所有号码在同一事务中分配。
+    账户余额需足够支付 count * 项目价格，实际只按分配到的号码数扣除余额。
+    号码不足时返回已分配到的部分号码。
+
+    参数:
+    - token: 用户登录后获取的token，必填
+    - project_id: 项目ID，必填
+    - count: 获取数量，必填，1到MAX_BATCH_PHONES之间
+    - carrier_type: 运营商类型，可选，默认0(不限)，可选值1=移动，2=联通，3=电信
+    - number_type: 号码类型，可选，默认0(不限)，可选值1=普通，2=虚拟
+
+    返回成功:
+    - stat: true
+    - message: "ok"，号码不足时为部分分配的说明
+    - code: 1
+    - data: 手机号码列表
+
+    返回失败:
+    - stat: false
+    - message: 错误原因
+    - code: 错误代码
+    - data: null
+    """
+    # 从URL参数获取数据
+    token = request.args.get('token')
+    project_id = request.args.get('project_id')
+    count = request.args.get('count')
+    carrier_type = request.args.get('carrier_type', '0')
+    number_type = request.args.get('number_type', '0')
+
+    # 检查是否提供了token、project_id和count
+    if not token or not project_id or not count:
+        return jsonify({
+            'stat': False,
+            'message': '缺少必要的参数',
+            'code': -1,
+            'data': None
+        }), 400
+
+    # 验证数量是否有效
+    try:
+        count = int(count)
+    except ValueError:
+        count = 0
+    if count < 1 or count > current_app.config['MAX_BATCH_PHONES']:
+        return jsonify({
+            'stat': False,
+            'message': f"获取数量必须在1到{current_app.config['MAX_BATCH_PHONES']}之间",
+            'code': -1,
+            'data': None
+        }), 400
+
+    # 使用异步任务处理
+    result = run_async(lambda: async_get_phones(token, project_id, carrier_type, number_type, count))
+
+    # 提取状态码并从结果中移除
+    status_code = result.pop('status_code', 200)
+
+    # 返回结果
+    return jsonify(result), status_code
+
 # 获取指定手机号码API
 @api.route('/get_specified_phone', methods=['GET'])
 def get_specified_phone():
@@ -524,35 +600,17 @@ def get_specified_phone():
         }), 400
     
     # 验证token是否有效
-    user = User.query.filter_by(token=token).first()
-    if not user:
+    user, error = authenticate(db.session, token)
+    if error:
         return jsonify({
             'stat': False,
-            'message': '无效的token，请重新登录',
-            'code': -1,
-            'data': None
-        }), 401
-    
-    try:
-        # 验证token有效期
-        decoded_token = jwt.decode(token, current_app.config['SECRET_KEY'], algorithms=["HS256"])
-    except jwt.ExpiredSignatureError:
-        return jsonify({
-            'stat': False,
-            'message': 'token已过期，请重新登录',
-            'code': -1,
-            'data': None
-        }), 401
-    except jwt.InvalidTokenError:
-        return jsonify({
-            'stat': False,
-            'message': '无效的token格式',
+            'message': error,
             'code': -1,
             'data': None
         }), 401
     
     # 检查项目是否存在
-    project = Project.query.filter_by(project_id=project_id).first()
+    project = project_catalogue.get(db.session, project_id)
     if not project:
         return jsonify({
             'stat': False,
@@ -563,7 +621,7 @@ def get_specified_phone():
     
     # 检查用户余额是否足够
     project_amount = project.amount  # 项目价格
-    if user.balance < project_amount:
+    if get_balance(db.session, user.id) < project_amount:
         return jsonify({
             'stat': False,
             'message': '账户余额不足',
@@ -581,8 +639,7 @@ def get_specified_phone():
         }), 400
     
     # 自动检测手机号的运营商和号段类型
-    detected_carrier_type = get_carrier_type(phone)
-    detected_number_type = get_number_type(phone)
+    detected_carrier_type, detected_number_type = classify_phone(phone)
     
     # 如果用户指定了运营商类型和号段类型，则验证手机号是否匹配
     if carrier_type != 0 and carrier_type != detected_carrier_type:
@@ -611,14 +668,22 @@ def get_specified_phone():
             'data': None
         }), 200
     
-    # 检查手机号是否在黑名单中，如果在则从黑名单中移除
-    blacklisted_phone = BlacklistedPhone.query.filter_by(phone=phone).first()
+    # 原子扣除用户余额，并发请求已用完余额时扣款失败
+    if not debit_balance(db.session, user.id, project_amount):
+        db.session.rollback()
+        return jsonify({
+            'stat': False,
+            'message': '账户余额不足',
+            'code': -2,
+            'data': None
+        }), 200
+    
+    # 检查手机号是否在本项目的黑名单中，如果在则从黑名单中移除
+    blacklisted_phone = BlacklistedPhone.query.filter_by(phone=phone, project_id=project_id).first()
     if blacklisted_phone:
         # 移除黑名单记录
         db.session.delete(blacklisted_phone)
-    
-    # 扣除用户余额并创建冻结记录
-    user.balance -= project_amount
+        blacklisted_project_id = blacklisted_phone.project_id
     
     # 创建新的手机号码记录，包含冻结金额
     new_phone = PhoneNumber(
@@ -634,6 +699,10 @@ def get_specified_phone():
     db.session.add(new_phone)
     db.session.commit()
     
+    # 同步更新黑名单索引
+    if blacklisted_phone:
+        blacklist_index.discard(blacklisted_project_id, phone)
+    
     # 返回成功响应
     return jsonify({
         'stat': True,
@@ -644,17 +713,21 @@ def get_specified_phone():
 
 # 获取短信验证码API
 @api.route('/get_sms_code', methods=['GET'])
+@rate_limit(max_calls=3, time_frame=60, key='phone')
+@rate_limit(max_calls=50, time_frame=60, key='ip')
 def get_sms_code():
     """
     获取短信验证码接口
     
     通过手机号获取短信验证码，需要指定项目ID。
     每个手机号每分钟最多请求3次，每个IP每分钟最多请求50次。
+    指定wait时以长轮询方式等待，直到收到验证码或超时才返回。
     
     参数:
     - token: 用户登录后获取的token，必填
     - project_id: 项目ID，必填
     - phone: 手机号码，必填
+    - wait: 没有短信时最长等待的秒数，可选，默认0(立即返回)，不超过SMS_LONG_POLL_MAX_WAIT
     
     返回成功:
     - message: "ok"
@@ -679,9 +752,34 @@ def get_sms_code():
             'data': None
         }), 400
     
+    # 检查长轮询等待时间
+    max_wait = current_app.config.get('SMS_LONG_POLL_MAX_WAIT', 30)
+    try:
+        wait = float(request.args.get('wait', 0))
+    except ValueError:
+        wait = -1
+    if not 0 <= wait <= max_wait:
+        return jsonify({
+            'message': f'等待时间必须在0到{max_wait}秒之间',
+            'code': -1,
+            'data': None
+        }), 400
+    
     # 使用异步任务处理
     result = run_async(lambda: async_get_sms_code(token, project_id, phone))
     
+    # 长轮询：没有短信时在请求线程中等待，不占用线程池和数据库连接
+    if wait > 0:
+        interval = current_app.config.get('SMS_LONG_POLL_INTERVAL', 2)
+        deadline = time.monotonic() + wait
+        while result.get('stat') and not result.get('code'):
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            # 收到本进程的到达通知时立即复查，否则按间隔复查其他工作进程收到的短信
+            sms_notifier.wait(phone, min(remaining, interval))
+            result = run_async(lambda: async_get_sms_code(token, project_id, phone))
+    
     # 提取状态码并从结果中移除
     status_code = result.pop('status_code', 200)
     
@@ -778,39 +876,367 @@ def blacklist_phone():
     # 返回结果
     return jsonify(result), status_code
 
+# 批量释放手机号码API
+@api.route('/release_phones', methods=['GET'])
+def release_phones():
+    """
+    批量释放手机号码接口
+    
+    一次释放多个手机号码，所有号码在同一事务中删除，冻结金额合并退还。
+    
+    参数:
+    - token: 用户登录后获取的token，必填
+    - project_id: 项目ID，必填
+    - phones: 手机号码，多个号码用英文逗号分隔，必填，最多MAX_BATCH_PHONES个
+    
+    返回成功:
+    - message: "ok"
+    - code: 1
+    - data: 每个号码的处理结果列表，包含phone、stat和message
+    
+    返回失败:
+    - message: 错误原因
+    - code: -1
+    - data: null
+    """
+    # 从URL参数获取数据
+    token = request.args.get('token')
+    project_id = request.args.get('project_id')
+    phones = parse_phone_list(request.args.get('phones'))
+    
+    # 检查参数
+    error = check_phone_list(token, project_id, phones)
+    if error:
+        return error
+    
+    # 使用异步任务处理
+    result = run_async(lambda: async_release_phones(token, project_id, phones))
+    
+    # 提取状态码并从结果中移除
+    status_code = result.pop('status_code', 200)
+    
+    # 返回结果
+    return jsonify(result), status_code
+
+# 批量加黑手机号码API
+@api.route('/blacklist_phones', methods=['GET'])
+def blacklist_phones():
+    """
+    批量加黑手机号码接口
+    
+    一次将多个手机号码加入黑名单，所有号码在同一事务中处理。
+    用户持有的号码会同时被释放，冻结金额合并退还。
+    
+    参数:
+    - token: 用户登录后获取的token，必填
+    - project_id: 项目ID，必填
+    - phones: 手机号码，多个号码用英文逗号分隔，必填，最多MAX_BATCH_PHONES个
+    
+    返回成功:
+    - message: "ok"
+    - code: 1
+    - data: 每个号码的处理结果列表，包含phone、stat和message
+    
+    返回失败:
+    - message: 错误原因
+    - code: -1
+    - data: null
+    """
+    # 从URL参数获取数据
+    token = request.args.get('token')
+    project_id = request.args.get('project_id')
+    phones = parse_phone_list(request.args.get('phones'))
+    
+    # 检查参数
+    error = check_phone_list(token, project_id, phones)
+    if error:
+        return error
+    
+    # 使用异步任务处理
+    result = run_async(lambda: async_blacklist_phones(token, project_id, phones))
+    
+    # 提取状态码并从结果中移除
+    status_code = result.pop('status_code', 200)
+    
+    # 返回结果
+    return jsonify(result), status_code
+
+def parse_phone_list(value):
+    """把逗号分隔的手机号码解析为去重后的列表，保持原有顺序"""
+    phones = [phone.strip() for phone in (value or '').split(',')]
+    return list(dict.fromkeys(phone for phone in phones if phone))
+
+def parse_received_at(value):
+    """
+    解析入站短信的接收时间
+
+    参数:
+    - value: ISO 8601格式的时间字符串，不带时区时视为UTC，可为空
+
+    返回:
+    - 不带时区的UTC时间，value为空时返回None，格式错误时抛出ValueError
+    """
+    if value is None or value == '':
+        return None
+    if not isinstance(value, str):
+        raise ValueError(value)
+    received_at = datetime.datetime.fromisoformat(value.replace('Z', '+00:00'))
+    if received_at.tzinfo is not None:
+        received_at = received_at.astimezone(datetime.timezone.utc).replace(tzinfo=None)
+    return received_at
+
+def check_phone_list(token, project_id, phones):
+    """检查批量号码接口的参数，有错误时返回错误响应"""
+    if not token or not project_id or not phones:
+        return jsonify({
+            'message': '缺少必要的参数',
+            'code': -1,
+            'data': None
+        }), 400
+    
+    max_phones = current_app.config['MAX_BATCH_PHONES']
+    if len(phones) > max_phones:
+        return jsonify({
+            'message': f'号码数量不能超过{max_phones}个',
+            'code': -1,
+            'data': None
+        }), 400
+    return None
+
+# 黑名单导入API
+@api.route('/blacklist_import', methods=['POST'])
+def blacklist_import():
+    """
+    黑名单导入接口
+    
+    以流的方式读取请求体中的手机号码并按块写入项目黑名单，内存占用与文件大小无关。
+    请求体每行一个号码，或CSV格式(取第一列，表头等非手机号的行计为无效)。
+    每块号码校验格式并去重后用一次批量插入写入，并在独立的事务中提交。
+    
+    参数:
+    - token: 用户登录后获取的token，必填
+    - project_id: 项目ID，必填
+    - 请求体: 手机号码列表，UTF-8编码
+    
+    返回成功:
+    - message: "ok"
+    - code: 1
+    - data: received(读取的行数)、invalid(格式无效)、duplicates(重复或已在黑名单中)、added(新增数)
+    
+    返回失败:
+    - message: 错误原因
+    - code: -1
+    - data: 已处理部分的统计(处理中途失败时)或null
+    """
+    # 从URL参数获取数据
+    token = request.args.get('token')
+    project_id = request.args.get('project_id')
+    
+    # 检查是否提供了token和project_id
+    if not token or not project_id:
+        return jsonify({
+            'message': '缺少必要的参数',
+            'code': -1,
+            'data': None
+        }), 400
+    
+    # 验证token是否有效
+    user, error = authenticate(db.session, token)
+    if error:
+        return jsonify({
+            'message': error,
+            'code': -1,
+            'data': None
+        }), 401
+    user_id = user.id
+    db.session.close()
+    
+    chunk_size = current_app.config['BLACKLIST_IMPORT_CHUNK']
+    totals = {'received': 0, 'invalid': 0, 'duplicates': 0, 'added': 0}
+    
+    def import_chunk(chunk):
+        """把一块号码交给线程池写入，返回是否成功"""
+        result = run_async(lambda: async_import_blacklist_chunk(user_id, project_id, chunk))
+        if result.get('status_code', 200) != 200:
+            return result
+        for key in ('invalid', 'duplicates', 'added'):
+            totals[key] += result['data'][key]
+        return None
+    
+    chunk = []
+    reader = csv.reader(codecs.iterdecode(request.stream, 'utf-8', errors='replace'))
+    for row in reader:
+        if not row:
+            continue
+        totals['received'] += 1
+        chunk.append(row[0].strip())
+        if len(chunk) >= chunk_size:
+            failed = import_chunk(chunk)
+            if failed:
+                failed['data'] = totals
+                return jsonify(failed), failed.pop('status_code')
+            chunk = []
+    if chunk:
+        failed = import_chunk(chunk)
+        if failed:
+            failed['data'] = totals
+            return jsonify(failed), failed.pop('status_code')
+    
+    return jsonify({
+        'message': 'ok',
+        'code': 1,
+        'data': totals
+    }), 200
+
+# 黑名单导出API
+@api.route('/blacklist_export', methods=['GET'])
+def blacklist_export():
+    """
+    黑名单导出接口
+    
+    使用服务器端游标分批读取项目黑名单并以流的方式返回，内存占用与黑名单大小无关。
+    
+    参数:
+    - token: 用户登录后获取的token，必填
+    - project_id: 项目ID，必填
+    - format: 导出格式，可选，txt(默认，每行一个号码)或csv(phone,created_at)
+    
+    返回成功:
+    - 文本文件
+    
+    返回失败:
+    - message: 错误原因
+    - code: -1
+    - data: null
+    """
+    # 从URL参数获取数据
+    token = request.args.get('token')
+    project_id = request.args.get('project_id')
+    export_format = request.args.get('format', 'txt')
+    
+    # 检查参数
+    if not token or not project_id:
+        return jsonify({
+            'message': '缺少必要的参数',
+            'code': -1,
+            'data': None
+        }), 400
+    if export_format not in ('txt', 'csv'):
+        return jsonify({
+            'message': '导出格式必须是txt或csv',
+            'code': -1,
+            'data': None
+        }), 400
+    
+    # 验证token是否有效
+    user, error = authenticate(db.session, token)
+    if error:
+        return jsonify({
+            'message': error,
+            'code': -1,
+            'data': None
+        }), 401
+    
+    batch_size = current_app.config['BLACKLIST_EXPORT_BATCH']
+    
+    def generate():
+        if export_format == 'csv':
+            yield 'phone,created_at\n'
+        query = (db.session.query(BlacklistedPhone.phone, BlacklistedPhone.created_at)
+                 .filter(BlacklistedPhone.project_id == project_id)
+                 .order_by(BlacklistedPhone.id)
+                 .execution_options(stream_results=True, yield_per=batch_size))
+        lines = []
+        for phone, created_at in query:
+            if export_format == 'csv':
+                lines.append(f"{phone},{created_at.isoformat() if created_at else ''}\n")
+            else:
+                lines.append(phone + '\n')
+            if len(lines) >= batch_size:
+                yield ''.join(lines)
+                lines = []
+        if lines:
+            yield ''.join(lines)
+    
+    mimetype = 'text/csv' if export_format == 'csv' else 'text/plain'
+    return Response(stream_with_context(generate()), mimetype=mimetype, headers={
+        'Content-Disposition': f'attachment; filename=blacklist_{project_id}.{export_format}'
+    })
+
+# 入站短信API
+@api.route('/sms_inbound', methods=['POST'])
+def sms_inbound():
+    """
+    入站短信接口
+    
+    短信服务商按批推送收到的短信，短信放入收件箱队列后立即返回，由后台批量写入数据库。
+    需要在配置中设置SMS_INBOUND_TOKEN，并在请求头X-Inbound-Token中携带。
+    
+    参数(JSON请求体):
+    - messages: 短信列表，每条包含phone、project_id、content，可选code、received_at(ISO 8601，不带时区时视为UTC)
+    
+    返回成功(状态码202):
+    - message: "ok"
+    - data: accepted(接收数)、rejected(因队列已满被拒绝的数量)
+    
+    队列已满时返回503，服务商应从第accepted条开始重新推送。
+    """
+    inbound_token = current_app.config.get('SMS_INBOUND_TOKEN')
+    if not inbound_token:
+        return jsonify({'error': '资源未找到'}), 404
+    # 按字节比较，请求头含非ASCII字符时compare_digest不会因字符串参数报错
+    if not hmac.compare_digest(request.headers.get('X-Inbound-Token', '').encode(), inbound_token.encode()):
+        return jsonify({
+            'message': '无效的入站令牌',
+            'code': -1,
+            'data': None
+        }), 401
+    
+    # 检查短信格式
+    payload = request.get_json(silent=True) or {}
+    messages = payload.get('messages')
+    if not isinstance(messages, list) or not all(
+            isinstance(message, dict) and all(isinstance(message.get(field), str) and message.get(field)
+                                              for field in ('phone', 'project_id', 'content'))
+            and isinstance(message.get('code'), (str, type(None)))
+            for message in messages):
+        return jsonify({
+            'message': '短信格式错误，每条短信必须包含phone、project_id和content',
+            'code': -1,
+            'data': None
+        }), 400
+    
+    # 接收时间统一转换为datetime，格式错误的短信不进入收件箱
+    try:
+        messages = [dict(message, received_at=parse_received_at(message.get('received_at')))
+                    for message in messages]
+    except ValueError:
+        return jsonify({
+            'message': '短信接收时间格式错误，received_at应为ISO 8601格式',
+            'code': -1,
+            'data': None
+        }), 400
+    
+    accepted = sms_inbox.submit(messages)
+    rejected = len(messages) - accepted
+    return jsonify({
+        'message': 'ok' if not rejected else '服务器繁忙，请稍后重新推送未接收的短信',
+        'code': 1 if not rejected else -1,
+        'data': {'accepted': accepted, 'rejected': rejected}
+    }), 202 if not rejected else 503
+
 # 异步处理释放手机号请求
 def async_release_phone(token, project_id, phone):
     """异步处理释放手机号的请求"""
-    from flask import current_app
-    
-    # 创建独立会话
-    Session = sessionmaker(bind=db.engine)  # 使用全局db.engine而不是app
-    session = Session()
+    # 使用进程内共享的作用域会话，请求结束时由Flask-SQLAlchemy回收
+    session = db.session
     
     try:
         # 验证token是否有效
-        user = session.query(User).filter_by(token=token).first()
-        if not user:
+        user, error = authenticate(session, token)
+        if error:
             return {
-                'message': '无效的token，请重新登录',
-                'code': -1,
-                'data': None,
-                'status_code': 401
-            }
-        
-        try:
-            # 验证token有效期
-            decoded_token = jwt.decode(token, current_app.config['SECRET_KEY'], algorithms=["HS256"])
-        except jwt.ExpiredSignatureError:
-            return {
-                'message': 'token已过期，请重新登录',
-                'code': -1,
-                'data': None,
-                'status_code': 401
-            }
-        except jwt.InvalidTokenError:
-            return {
-                'message': '无效的token格式',
+                'message': error,
                 'code': -1,
                 'data': None,
                 'status_code': 401
@@ -827,13 +1253,13 @@ def async_release_phone(token, project_id, phone):
                 'status_code': 404
             }
         
-        # 如果手机号有冻结金额，退还给用户
-        if phone_record.frozen_amount > 0:
-            user.balance += phone_record.frozen_amount
-            print(f"退还用户({user.username})冻结金额: {phone_record.frozen_amount}")
-        
-        # 删除手机号记录
-        session.delete(phone_record)
+        # 删除手机号记录，按实际删除的记录退款：号码已被过期回收删除时不再重复退款，
+        # 期间已收到验证码(冻结金额已清零)时不再退款
+        deleted = delete_phone_numbers(session, PhoneNumber.id == phone_record.id)
+        refund = sum(row.frozen_amount for row in deleted if row.frozen_amount and row.frozen_amount > 0)
+        if refund > 0:
+            credit_balance(session, user.id, refund)
+            logger.info('退还用户(%s)冻结金额: %s', user.username, refund)
         session.commit()
         
         return {
@@ -841,9 +1267,9 @@ def async_release_phone(token, project_id, phone):
             'data': [],
             'status_code': 200
         }
-    except Exception as e:
+    except Exception:
         session.rollback()
-        print(f"释放手机号异常: {str(e)}")
+        logger.exception('释放手机号异常')
         return {
             'message': '释放手机号时发生错误',
             'code': -1,
@@ -856,36 +1282,16 @@ def async_release_phone(token, project_id, phone):
 # 异步处理加黑手机号请求
 def async_blacklist_phone(token, project_id, phone):
     """异步处理加黑手机号的请求"""
-    from flask import current_app
     
-    # 创建独立会话
-    Session = sessionmaker(bind=db.engine)  # 使用全局db.engine而不是app
-    session = Session()
+    # 使用进程内共享的作用域会话，请求结束时由Flask-SQLAlchemy回收
+    session = db.session
     
     try:
         # 验证token是否有效
-        user = session.query(User).filter_by(token=token).first()
-        if not user:
-            return {
-                'message': '无效的token，请重新登录',
-                'code': -1,
-                'data': None,
-                'status_code': 401
-            }
-        
-        try:
-            # 验证token有效期
-            decoded_token = jwt.decode(token, current_app.config['SECRET_KEY'], algorithms=["HS256"])
-        except jwt.ExpiredSignatureError:
-            return {
-                'message': 'token已过期，请重新登录',
-                'code': -1,
-                'data': None,
-                'status_code': 401
-            }
-        except jwt.InvalidTokenError:
+        user, error = authenticate(session, token)
+        if error:
             return {
-                'message': '无效的token格式',
+                'message': error,
                 'code': -1,
                 'data': None,
                 'status_code': 401
@@ -900,9 +1306,6 @@ def async_blacklist_phone(token, project_id, phone):
                 'status_code': 400
             }
         
-        # 查找手机号记录
-        phone_record = session.query(PhoneNumber).filter_by(phone=phone, user_id=user.id).first()
-        
         # 检查是否已经在黑名单中
         existing_blacklist = session.query(BlacklistedPhone).filter_by(phone=phone, project_id=project_id).first()
         if existing_blacklist:
@@ -921,26 +1324,27 @@ def async_blacklist_phone(token, project_id, phone):
         )
         session.add(blacklisted_phone)
         
-        # 如果手机号在用户的手机号列表中，释放它
-        if phone_record:
-            # 如果手机号有冻结金额，退还给用户
-            if phone_record.frozen_amount > 0:
-                user.balance += phone_record.frozen_amount
-                print(f"退还用户({user.username})冻结金额: {phone_record.frozen_amount}")
-            
-            # 删除手机号记录
-            session.delete(phone_record)
+        # 如果手机号在用户的手机号列表中，释放它；只为本事务实际删除的号码退款，
+        # 号码已被过期回收删除时不再重复退款
+        deleted = delete_phone_numbers(session, PhoneNumber.user_id == user.id, PhoneNumber.phone == phone)
+        refund = sum(row.frozen_amount for row in deleted if row.frozen_amount and row.frozen_amount > 0)
+        if refund > 0:
+            credit_balance(session, user.id, refund)
+            logger.info('退还用户(%s)冻结金额: %s', user.username, refund)
         
         session.commit()
         
+        # 同步更新黑名单索引
+        blacklist_index.add(project_id, phone)
+        
         return {
             'message': 'ok',
             'data': [],
             'status_code': 200
         }
-    except Exception as e:
+    except Exception:
         session.rollback()
-        print(f"加黑手机号异常: {str(e)}")
+        logger.exception('加黑手机号异常')
         return {
             'message': '加黑手机号时发生错误',
             'code': -1,
@@ -950,49 +1354,205 @@ def async_blacklist_phone(token, project_id, phone):
     finally:
         session.close()
 
-# 异步处理获取手机号请求
-def async_get_phone(token, project_id, carrier_type, number_type):
-    """异步获取手机号功能"""
-    from flask import current_app
-    
-    # 创建独立会话
-    Session = sessionmaker(bind=db.engine)  # 使用全局db.engine而不是app
-    session = Session()
+# 异步处理批量释放手机号请求
+def async_release_phones(token, project_id, phones):
+    """异步处理批量释放手机号的请求"""
+    # 使用进程内共享的作用域会话，请求结束时由Flask-SQLAlchemy回收
+    session = db.session
     
     try:
         # 验证token是否有效
-        user = session.query(User).filter_by(token=token).first()
-        if not user:
+        user, error = authenticate(session, token)
+        if error:
             return {
-                'stat': False,
-                'message': '无效的token，请重新登录',
+                'message': error,
                 'code': -1,
                 'data': None,
                 'status_code': 401
             }
         
-        try:
-            # 验证token有效期
-            decoded_token = jwt.decode(token, current_app.config['SECRET_KEY'], algorithms=["HS256"])
-        except jwt.ExpiredSignatureError:
+        # 一条语句删除属于当前用户和项目的号码，只为实际删除的号码退款
+        deleted = delete_phone_numbers(session,
+                                       PhoneNumber.user_id == user.id,
+                                       PhoneNumber.project_id == project_id,
+                                       PhoneNumber.phone.in_(phones))
+        released = {row.phone for row in deleted}
+        
+        # 合并退还冻结金额
+        refund = sum(row.frozen_amount for row in deleted if row.frozen_amount and row.frozen_amount > 0)
+        if refund > 0:
+            credit_balance(session, user.id, refund)
+            logger.info('退还用户(%s)冻结金额: %s', user.username, refund)
+        session.commit()
+        
+        return {
+            'message': 'ok',
+            'code': 1,
+            'data': [{
+                'phone': phone,
+                'stat': phone in released,
+                'message': 'ok' if phone in released else '该手机号不存在或不属于当前用户'
+            } for phone in phones],
+            'status_code': 200
+        }
+    except Exception:
+        session.rollback()
+        logger.exception('批量释放手机号异常')
+        return {
+            'message': '释放手机号时发生错误',
+            'code': -1,
+            'data': None,
+            'status_code': 500
+        }
+    finally:
+        session.close()
+
+# 异步处理批量加黑手机号请求
+def async_blacklist_phones(token, project_id, phones):
+    """异步处理批量加黑手机号的请求"""
+    # 使用进程内共享的作用域会话，请求结束时由Flask-SQLAlchemy回收
+    session = db.session
+    
+    try:
+        # 验证token是否有效
+        user, error = authenticate(session, token)
+        if error:
             return {
-                'stat': False,
-                'message': 'token已过期，请重新登录',
+                'message': error,
                 'code': -1,
                 'data': None,
                 'status_code': 401
             }
-        except jwt.InvalidTokenError:
+        
+        results = {}
+        valid = []
+        for phone in phones:
+            if is_valid_phone(phone):
+                valid.append(phone)
+            else:
+                results[phone] = '无效的手机号码格式'
+        
+        # 一次IN查询找出已在黑名单中的号码
+        if valid:
+            existing = session.query(BlacklistedPhone.phone).filter(
+                BlacklistedPhone.project_id == project_id,
+                BlacklistedPhone.phone.in_(valid)
+            ).all()
+            for (phone,) in existing:
+                results[phone] = '该手机号已在黑名单中'
+        added = [phone for phone in valid if phone not in results]
+        
+        if added:
+            # 批量添加到黑名单
+            session.bulk_insert_mappings(BlacklistedPhone, [
+                {'phone': phone, 'user_id': user.id, 'project_id': project_id} for phone in added
+            ])
+            
+            # 释放用户持有的这些号码，合并退还冻结金额
+            deleted = delete_phone_numbers(session,
+                                           PhoneNumber.user_id == user.id,
+                                           PhoneNumber.phone.in_(added))
+            refund = sum(row.frozen_amount for row in deleted if row.frozen_amount and row.frozen_amount > 0)
+            if refund > 0:
+                credit_balance(session, user.id, refund)
+                logger.info('退还用户(%s)冻结金额: %s', user.username, refund)
+        session.commit()
+        
+        # 同步更新黑名单索引
+        for phone in added:
+            blacklist_index.add(project_id, phone)
+        
+        return {
+            'message': 'ok',
+            'code': 1,
+            'data': [{
+                'phone': phone,
+                'stat': phone not in results,
+                'message': results.get(phone, 'ok')
+            } for phone in phones],
+            'status_code': 200
+        }
+    except Exception:
+        session.rollback()
+        logger.exception('批量加黑手机号异常')
+        return {
+            'message': '加黑手机号时发生错误',
+            'code': -1,
+            'data': None,
+            'status_code': 500
+        }
+    finally:
+        session.close()
+
+# 异步处理黑名单导入的一块号码
+def async_import_blacklist_chunk(user_id, project_id, phones):
+    """异步处理黑名单导入的一块号码"""
+    # 使用进程内共享的作用域会话，请求结束时由Flask-SQLAlchemy回收
+    session = db.session
+    
+    try:
+        # 校验格式并在块内去重
+        valid = [phone for phone in phones if is_valid_phone(phone)]
+        invalid = len(phones) - len(valid)
+        valid = list(dict.fromkeys(valid))
+        
+        # 一次IN查询排除已在黑名单中的号码
+        existing = set()
+        if valid:
+            existing = {row[0] for row in session.query(BlacklistedPhone.phone)
+                        .filter(BlacklistedPhone.project_id == project_id, BlacklistedPhone.phone.in_(valid))}
+        added = [phone for phone in valid if phone not in existing]
+        
+        # executemany批量插入，黑名单索引通过增量同步读取新增的记录
+        if added:
+            session.execute(insert(BlacklistedPhone), [
+                {'phone': phone, 'user_id': user_id, 'project_id': project_id} for phone in added
+            ])
+        session.commit()
+        
+        return {
+            'message': 'ok',
+            'code': 1,
+            'data': {
+                'invalid': invalid,
+                'duplicates': len(phones) - invalid - len(added),
+                'added': len(added)
+            },
+            'status_code': 200
+        }
+    except Exception:
+        session.rollback()
+        logger.exception('导入黑名单异常')
+        return {
+            'message': '导入黑名单时发生错误',
+            'code': -1,
+            'data': None,
+            'status_code': 500
+        }
+    finally:
+        session.close()
+
+# 异步处理获取手机号请求
+def async_get_phone(token, project_id, carrier_type, number_type):
+    """异步获取手机号功能"""
+    
+    # 使用进程内共享的作用域会话，请求结束时由Flask-SQLAlchemy回收
+    session = db.session
+    
+    try:
+        # 验证token是否有效
+        user, error = authenticate(session, token)
+        if error:
             return {
                 'stat': False,
-                'message': '无效的token格式',
+                'message': error,
                 'code': -1,
                 'data': None,
                 'status_code': 401
             }
         
         # 检查项目是否存在
-        project = session.query(Project).filter_by(project_id=project_id).first()
+        project = project_catalogue.get(session, project_id)
         if not project:
             return {
                 'stat': False,
@@ -1004,7 +1564,7 @@ def async_get_phone(token, project_id, carrier_type, number_type):
         
         # 检查用户余额是否足够
         project_amount = project.amount  # 项目价格
-        if user.balance < project_amount:
+        if get_balance(session, user.id) < project_amount:
             return {
                 'stat': False,
                 'message': '账户余额不足',
@@ -1013,44 +1573,11 @@ def async_get_phone(token, project_id, carrier_type, number_type):
                 'status_code': 200
             }
         
-        # 检查黑名单手机号
-        blacklisted_phones = session.query(BlacklistedPhone.phone).filter_by(project_id=project_id).all()
-        blacklisted_phones = [bp[0] for bp in blacklisted_phones]
-        
-        # 已分配给当前用户的手机号
-        user_phones = session.query(PhoneNumber.phone).filter_by(
-            user_id=user.id, 
-            project_id=project_id, 
-            status=1
-        ).all()
-        user_phones = [up[0] for up in user_phones]
-        
-        # 获取手机号(尝试3次)
-        phone = None
-        for _ in range(3):
-            # 生成随机手机号
-            phone = generate_random_phone(
-                carrier_type=int(carrier_type),
-                number_type=int(number_type)
-            )
-            
-            # 检查是否在黑名单中
-            if phone in blacklisted_phones:
-                continue
-            
-            # 检查是否已分配
-            if phone in user_phones:
-                continue
-            
-            # 检查是否已被其他用户使用
-            existing_phone = session.query(PhoneNumber).filter_by(phone=phone).first()
-            if existing_phone:
-                continue
-            
-            # 找到可用手机号
-            break
-        else:
-            # 尝试3次都失败
+        # 优先从号码池领取，池中没有号码时从号码空间中查找一个可用号码
+        phones = number_pool.claim(session, project_id, int(carrier_type), int(number_type))
+        if not phones:
+            phones = phone_allocator.allocate(session, project_id, int(carrier_type), int(number_type))
+        if not phones:
             return {
                 'stat': False,
                 'message': '没有可用号码',
@@ -1058,9 +1585,18 @@ def async_get_phone(token, project_id, carrier_type, number_type):
                 'data': None,
                 'status_code': 200
             }
+        phone = phones[0]
         
-        # 冻结用户余额
-        user.balance -= project_amount
+        # 原子冻结用户余额，并发请求已用完余额时扣款失败
+        if not debit_balance(session, user.id, project_amount):
+            session.rollback()
+            return {
+                'stat': False,
+                'message': '账户余额不足',
+                'code': -2,
+                'data': None,
+                'status_code': 200
+            }
         
         # 创建手机号记录
         new_phone = PhoneNumber(
@@ -1084,9 +1620,9 @@ def async_get_phone(token, project_id, carrier_type, number_type):
             'data': phone,
             'status_code': 200
         }
-    except Exception as e:
+    except Exception:
         session.rollback()
-        print(f"获取手机号异常: {str(e)}")
+        logger.exception('获取手机号异常')
         return {
             'stat': False,
             'message': '获取手机号时发生错误',
@@ -1097,42 +1633,124 @@ def async_get_phone(token, project_id, carrier_type, number_type):
     finally:
         session.close()
 
-# 异步处理获取短信验证码请求
-def async_get_sms_code(token, project_id, phone):
-    """异步获取短信验证码"""
-    from flask import current_app
-    
-    # 创建独立会话
-    Session = sessionmaker(bind=db.engine)  # 使用全局db.engine而不是app
-    session = Session()
-    
+# 异步处理批量获取手机号请求
+def async_get_phones(token, project_id, carrier_type, number_type, count):
+    """异步批量获取手机号功能"""
+
+    # 使用进程内共享的作用域会话，请求结束时由Flask-SQLAlchemy回收
+    session = db.session
+
     try:
         # 验证token是否有效
-        user = session.query(User).filter_by(token=token).first()
-        if not user:
+        user, error = authenticate(session, token)
+        if error:
             return {
                 'stat': False,
-                'message': '无效的token，请重新登录',
+                'message': error,
                 'code': -1,
                 'data': None,
                 'status_code': 401
             }
-        
-        try:
-            # 验证token有效期
-            decoded_token = jwt.decode(token, current_app.config['SECRET_KEY'], algorithms=["HS256"])
-        except jwt.ExpiredSignatureError:
+
+        # 检查项目是否存在
+        project = project_catalogue.get(session, project_id)
+        if not project:
             return {
                 'stat': False,
-                'message': 'token已过期，请重新登录',
+                'message': '无效的项目ID',
                 'code': -1,
                 'data': None,
-                'status_code': 401
+                'status_code': 404
             }
-        except jwt.InvalidTokenError:
+
+        # 检查用户余额是否足够支付全部号码
+        project_amount = project.amount  # 项目价格
+        if get_balance(session, user.id) < project_amount * count:
+            return {
+                'stat': False,
+                'message': '账户余额不足',
+                'code': -2,
+                'data': None,
+                'status_code': 200
+            }
+
+        # 优先从号码池领取，不足的部分从号码空间中批量查找
+        phones = number_pool.claim(session, project_id, int(carrier_type), int(number_type), count)
+        if len(phones) < count:
+            phones += phone_allocator.allocate(session, project_id, int(carrier_type), int(number_type),
+                                               count - len(phones))
+
+        if not phones:
+            return {
+                'stat': False,
+                'message': '没有可用号码',
+                'code': -3,
+                'data': None,
+                'status_code': 200
+            }
+
+        # 一次性原子冻结全部号码的余额
+        if not debit_balance(session, user.id, project_amount * len(phones)):
+            session.rollback()
+            return {
+                'stat': False,
+                'message': '账户余额不足',
+                'code': -2,
+                'data': None,
+                'status_code': 200
+            }
+
+        # 批量创建手机号记录
+        session.bulk_insert_mappings(PhoneNumber, [{
+            'phone': phone,
+            'user_id': user.id,
+            'project_id': project_id,
+            'carrier_type': int(carrier_type),
+            'number_type': int(number_type),
+            'frozen_amount': project_amount,
+            'status': 1  # 有效状态
+        } for phone in phones])
+        session.commit()
+
+        if len(phones) < count:
+            message = f'可用号码不足，已分配{len(phones)}个'
+        else:
+            message = 'ok'
+
+        return {
+            'stat': True,
+            'message': message,
+            'code': 1,
+            'data': phones,
+            'status_code': 200
+        }
+    except Exception:
+        session.rollback()
+        logger.exception('批量获取手机号异常')
+        return {
+            'stat': False,
+            'message': '批量获取手机号时发生错误',
+            'code': -1,
+            'data': None,
+            'status_code': 500
+        }
+    finally:
+        session.close()
+
+# 异步处理获取短信验证码请求
+def async_get_sms_code(token, project_id, phone):
+    """异步获取短信验证码"""
+    
+    # 使用进程内共享的作用域会话，请求结束时由Flask-SQLAlchemy回收
+    session = db.session
+    
+    try:
+        # 验证token是否有效
+        user, error = authenticate(session, token)
+        if error:
             return {
                 'stat': False,
-                'message': '无效的token格式',
+                'message': error,
                 'code': -1,
                 'data': None,
                 'status_code': 401
@@ -1159,15 +1777,15 @@ def async_get_sms_code(token, project_id, phone):
                 'status_code': 400
             }
         
-        # 模拟短信接收过程
-        # 有70%的概率接收到短信验证码
-        if random.random() < 0.7:
-            # 生成6位数字验证码
-            verification_code = ''.join(random.choices('0123456789', k=6))
-            
-            # 模拟短信内容
-            sms_content = f"【酷狗音乐】您的登录验证码{verification_code}。如非本人操作，请不要把验证码泄露给任何人。"
-            
+        # 一次索引查询读取号码分配之后收到的最新短信，重复查询返回同一条短信
+        message = sms_inbox.latest(session, phone, project_id, since=phone_record.created_at)
+        if message is None:
+            # 向短信服务商查询新短信并放入收件箱
+            provider = get_sms_provider()
+            if provider is not None and sms_inbox.submit(provider.poll(session, phone, project_id)):
+                message = sms_inbox.latest(session, phone, project_id, since=phone_record.created_at)
+        
+        if message is not None and message['code']:
             # 更新手机号状态，将冻结余额正式扣除
             if phone_record.frozen_amount > 0:
                 # 已经扣除了余额，现在只需标记为已使用即可
@@ -1179,10 +1797,10 @@ def async_get_sms_code(token, project_id, phone):
             return {
                 'stat': True,
                 'message': 'ok',
-                'code': verification_code,
+                'code': message['code'],
                 'data': [{
                     'project_id': project_id,
-                    'modle': sms_content,
+                    'modle': message['content'],
                     'phone': phone,
                     'project_type': '1'
                 }],
@@ -1197,9 +1815,9 @@ def async_get_sms_code(token, project_id, phone):
                 'data': [],
                 'status_code': 200
             }
-    except Exception as e:
+    except Exception:
         session.rollback()
-        print(f"获取短信验证码异常: {str(e)}")
+        logger.exception('获取短信验证码异常')
         return {
             'stat': False,
             'message': '获取短信验证码时发生错误',
@@ -0,0 +1,140 @@
+import re
+import threading
+
+# 模板中验证码占位符匹配的内容
+CODE_PATTERN = r'[0-9A-Za-z]{4,8}'
+
+# 通用规则：先找“验证码”等关键词后面的数字，再退而求其次找独立的4~8位数字
+GENERIC_KEYWORD_RE = re.compile(
+    r'(?:验证码|校验码|确认码|动态码|动态密码|激活码|verification code|code)'
+    r'\D{0,12}?(?<![0-9])([0-9]{4,8})(?![0-9])',
+    re.IGNORECASE)
+GENERIC_DIGITS_RE = re.compile(r'(?<![0-9])([0-9]{4,8})(?![0-9])')
+
+
+def compile_template(template, index=0):
+    """
+    把短信模板转换为正则表达式片段
+
+    模板是短信原文，验证码位置写作{code}，其余文字按字面匹配，
+    例如"【酷狗音乐】您的登录验证码{code}。"。
+
+    参数:
+    - template: 短信模板
+    - index: 模板序号，用于生成唯一的分组名
+
+    返回:
+    - 正则表达式片段，验证码位于分组code<index>
+    """
+    if template.count('{code}') != 1:
+        raise ValueError(f'短信模板必须且只能包含一个{{code}}: {template}')
+    prefix, suffix = template.split('{code}')
+    return f'{re.escape(prefix)}(?P<code{index}>{CODE_PATTERN}){re.escape(suffix)}'
+
+
+class CodeExtractor:
+    """
+    短信验证码提取器
+
+    每个项目的全部模板预先编译成一个多选分支的正则表达式，一次扫描即可匹配任意模板；
+    没有注册模板或模板都不匹配时使用通用规则。
+    """
+
+    def __init__(self):
+        """初始化提取器"""
+        self._templates = {}  # 项目ID -> 模板列表
+        self._compiled = {}  # 项目ID -> 编译后的正则表达式
+        self._lock = threading.Lock()
+
+    def register(self, project_id, *templates):
+        """
+        注册项目的短信模板
+
+        参数:
+        - project_id: 项目ID
+        - templates: 一个或多个短信模板，验证码位置写作{code}
+        """
+        with self._lock:
+            merged = self._templates.get(project_id, []) + list(templates)
+            pattern = '|'.join(compile_template(template, i) for i, template in enumerate(merged))
+            compiled = re.compile(pattern)
+            self._templates[project_id] = merged
+            self._compiled[project_id] = compiled
+
+    def clear(self):
+        """清除所有已注册的模板"""
+        with self._lock:
+            self._templates = {}
+            self._compiled = {}
+
+    def extract(self, project_id, content):
+        """
+        从短信内容中提取验证码
+
+        参数:
+        - project_id: 项目ID
+        - content: 短信内容
+
+        返回:
+        - 验证码，没有找到时返回None
+        """
+        compiled = self._compiled.get(project_id)
+        if compiled is not None:
+            match = compiled.search(content)
+            if match:
+                return match.group(match.lastgroup)
+
+        match = GENERIC_KEYWORD_RE.search(content) or GENERIC_DIGITS_RE.search(content)
+        return match.group(1) if match else None
+
+    def extract_many(self, messages):
+        """
+        批量提取验证码
+
+        参数:
+        - messages: 短信字典列表，包含project_id和content
+
+        返回:
+        - 与messages一一对应的验证码列表，没有找到的位置为None
+        """
+        compiled_by_project = self._compiled
+        keyword_search = GENERIC_KEYWORD_RE.search
+        digits_search = GENERIC_DIGITS_RE.search
+        codes = []
+        for message in messages:
+            content = message['content']
+            compiled = compiled_by_project.get(message['project_id'])
+            if compiled is not None:
+                match = compiled.search(content)
+                if match:
+                    codes.append(match.group(match.lastgroup))
+                    continue
+            match = keyword_search(content) or digits_search(content)
+            codes.append(match.group(1) if match else None)
+        return codes
+
+    def stats(self):
+        """
+        获取已注册的模板数量
+
+        返回:
+        - 项目ID -> 模板数
+        """
+        with self._lock:
+            return {project_id: len(templates) for project_id, templates in self._templates.items()}
+
+
+# 全局验证码提取器
+code_extractor = CodeExtractor()
+
+
+def configure_code_extractor(templates):
+    """
+    按配置注册短信模板
+
+    参数:
+    - templates: 项目ID -> 模板列表的字典
+    """
+    code_extractor.clear()
+    for project_id, project_templates in (templates or {}).items():
+        code_extractor.register(project_id, *project_templates)
@@ -0,0 +1,308 @@
+import datetime
+import logging
+import os
+import queue
+import random
+import threading
+import time
+
+from flask import current_app
+from sqlalchemy.exc import OperationalError
+
+from models import db, SmsMessage
+from project_cache import project_catalogue
+from sms_extract import code_extractor
+from sms_notify import sms_notifier
+
+logger = logging.getLogger(__name__)
+
+
+class SmsInbox:
+    """
+    短信收件箱
+
+    收到的短信先放入内存队列和待写入缓冲区后立即返回，不阻塞请求线程；
+    后台写入线程把队列中的短信按批用一次bulk insert写入数据库。
+    短信写入数据库之前，本进程内的查询直接从待写入缓冲区读取。
+    """
+
+    def __init__(self, batch_size=500, max_queue=10000):
+        """
+        初始化收件箱
+
+        参数:
+        - batch_size: 每批最多写入的短信数
+        - max_queue: 最大排队短信数，0表示在调用线程中直接写入数据库
+        """
+        self.batch_size = batch_size
+        self.max_queue = max_queue
+        self._queue = None
+        self._writer = None
+        self._pid = None
+        self._app = None
+        self._pending = {}  # (手机号, 项目ID) -> 尚未写入数据库的短信列表
+        self._lock = threading.Lock()
+        self.accepted = 0
+        self.rejected = 0
+        self.written = 0
+        self.dropped = 0
+
+    def configure(self, batch_size, max_queue):
+        """
+        按配置设置批量大小和队列容量
+
+        参数:
+        - batch_size: 每批最多写入的短信数
+        - max_queue: 最大排队短信数，0表示同步写入
+        """
+        self.batch_size = batch_size
+        self.max_queue = max_queue
+
+    def _ensure_writer(self):
+        """启动当前进程的后台写入线程，fork后的子进程重新创建队列和线程"""
+        pid = os.getpid()
+        if self._writer is None or self._pid != pid:
+            with self._lock:
+                if self._writer is None or self._pid != pid:
+                    self._queue = queue.Queue(self.max_queue)
+                    self._pending = {}
+                    self._pid = pid
+                    self._writer = threading.Thread(target=self._run, name='sms-inbox-writer', daemon=True)
+                    self._writer.start()
+        return self._queue
+
+    def submit(self, messages):
+        """
+        接收一批短信
+
+        参数:
+        - messages: 短信字典列表，包含phone、project_id、content，可选code、received_at(datetime，UTC)，
+          没有code时从content中提取
+
+        返回:
+        - 接收的短信数，队列已满时多出的短信被拒绝
+        """
+        self._app = current_app._get_current_object()
+        now = datetime.datetime.utcnow()
+        rows = [{
+            'phone': message['phone'],
+            'project_id': message['project_id'],
+            'content': message['content'],
+            'code': message.get('code'),
+            'received_at': message.get('received_at') or now
+        } for message in messages]
+
+        # 服务商没有提供验证码的短信按项目模板从内容中提取
+        missing = [row for row in rows if not row['code']]
+        for row, code in zip(missing, code_extractor.extract_many(missing)):
+            row['code'] = code
+
+        if self.max_queue <= 0:
+            self._write(rows)
+            accepted = rows
+        else:
+            inbox = self._ensure_writer()
+            accepted = []
+            for row in rows:
+                try:
+                    inbox.put_nowait(row)
+                except queue.Full:
+                    break
+                accepted.append(row)
+            with self._lock:
+                for row in accepted:
+                    self._pending.setdefault((row['phone'], row['project_id']), []).append(row)
+
+        with self._lock:
+            self.accepted += len(accepted)
+            self.rejected += len(rows) - len(accepted)
+        for phone in {row['phone'] for row in accepted}:
+            sms_notifier.notify(phone)
+        return len(accepted)
+
+    def _run(self):
+        """后台写入线程：每次取出队列中已有的短信(最多batch_size条)批量写入"""
+        inbox = self._queue
+        while True:
+            batch = [inbox.get()]
+            while len(batch) < self.batch_size:
+                try:
+                    batch.append(inbox.get_nowait())
+                except queue.Empty:
+                    break
+
+            remaining = batch
+            delay = 0.1
+            while remaining:
+                try:
+                    self._write(remaining)
+                    break
+                except Exception:
+                    logger.exception('批量写入短信失败，改为逐条写入')
+                remaining = self._write_each(remaining)
+                if remaining:
+                    # 数据库暂时不可用时保留这些短信，退避后重试；队列写满后新短信会被拒绝
+                    logger.warning('%d条短信写入失败，%.1f秒后重试', len(remaining), delay)
+                    time.sleep(delay)
+                    delay = min(delay * 2, 5)
+
+            with self._lock:
+                for row in batch:
+                    key = (row['phone'], row['project_id'])
+                    rows = self._pending.get(key)
+                    if rows is not None:
+                        rows.remove(row)
+                        if not rows:
+                            del self._pending[key]
+
+    def _write_each(self, rows):
+        """
+        逐条写入短信，无法写入的短信记录日志后丢弃，不再阻塞后续短信
+
+        参数:
+        - rows: 短信字典列表
+
+        返回:
+        - 因数据库暂时不可用而未写入、需要重试的短信列表
+        """
+        remaining = []
+        for row in rows:
+            try:
+                self._write([row])
+            except OperationalError:
+                remaining.append(row)
+            except Exception:
+                logger.exception('丢弃无法写入的短信: %r', row)
+                with self._lock:
+                    self.dropped += 1
+        return remaining
+
+    def _write(self, rows):
+        """在独立的应用上下文中用一次bulk insert写入一批短信"""
+        with self._app.app_context():
+            try:
+                db.session.bulk_insert_mappings(SmsMessage, rows)
+                db.session.commit()
+            except Exception:
+                db.session.rollback()
+                raise
+        with self._lock:
+            self.written += len(rows)
+
+    def latest(self, session, phone, project_id, since):
+        """
+        查询号码在项目下收到的最新短信
+
+        参数:
+        - session: 数据库会话
+        - phone: 手机号码
+        - project_id: 项目ID
+        - since: 只返回此时间之后收到的短信，用于排除号码上一个使用者的短信
+
+        返回:
+        - 短信字典(phone、project_id、content、code、received_at)，没有短信时返回None
+        """
+        with self._lock:
+            pending = [row for row in self._pending.get((phone, project_id), ()) if row['received_at'] >= since]
+        if pending:
+            return max(pending, key=lambda row: row['received_at'])
+
+        message = (session.query(SmsMessage)
+                   .filter(SmsMessage.phone == phone,
+                           SmsMessage.project_id == project_id,
+                           SmsMessage.received_at >= since)
+                   .order_by(SmsMessage.received_at.desc())
+                   .first())
+        return message.to_dict() if message else None
+
+    def stats(self):
+        """
+        获取收件箱使用情况
+
+        返回:
+        - 排队中的短信数、累计接收数、拒绝数、写入数和因数据错误丢弃的数量
+        """
+        with self._lock:
+            return {
+                'queued': self._queue.qsize() if self._queue is not None and self._pid == os.getpid() else 0,
+                'accepted': self.accepted,
+                'rejected': self.rejected,
+                'written': self.written,
+                'dropped': self.dropped
+            }
+
+
+class SimulatedSmsProvider:
+    """
+    模拟短信服务商
+
+    查询没有短信的号码时，按一定概率为该号码生成一条验证码短信，
+    代替真实服务商推送的入站短信，便于本地开发和测试。
+    """
+
+    def __init__(self, probability=0.7):
+        """
+        初始化模拟服务商
+
+        参数:
+        - probability: 每次查询生成短信的概率
+        """
+        self.probability = probability
+
+    def poll(self, session, phone, project_id):
+        """
+        查询号码的新短信
+
+        参数:
+        - session: 数据库会话
+        - phone: 手机号码
+        - project_id: 项目ID
+
+        返回:
+        - 新短信字典列表
+        """
+        if random.random() >= self.probability:
+            return []
+
+        # 生成6位数字验证码
+        verification_code = ''.join(random.choices('0123456789', k=6))
+        project = project_catalogue.get(session, project_id)
+        name = project.name if project else '酷狗音乐'
+        return [{
+            'phone': phone,
+            'project_id': project_id,
+            'content': f"【{name}】您的登录验证码{verification_code}。如非本人操作，请不要把验证码泄露给任何人。"
+        }]
+
+
+# 可选的短信服务商，none表示只接收通过入站接口推送的短信
+SMS_PROVIDERS = {
+    'simulator': SimulatedSmsProvider,
+    'none': None
+}
+
+# 全局短信收件箱和服务商
+sms_inbox = SmsInbox()
+sms_provider = SimulatedSmsProvider()
+
+
+def configure_sms_inbox(batch_size, max_queue, provider='simulator'):
+    """
+    按配置设置全局收件箱和短信服务商
+
+    参数:
+    - batch_size: 每批最多写入的短信数
+    - max_queue: 最大排队短信数，0表示同步写入
+    - provider: 短信服务商名称，见SMS_PROVIDERS
+    """
+    global sms_provider
+    if provider not in SMS_PROVIDERS:
+        raise ValueError(f'未知的短信服务商: {provider}')
+    sms_inbox.configure(batch_size, max_queue)
+    provider_class = SMS_PROVIDERS[provider]
+    sms_provider = provider_class() if provider_class else None
+
+
+def get_sms_provider():
+    """获取当前配置的短信服务商，没有时返回None"""
+    return sms_provider
@@ -0,0 +1,64 @@
+import threading
+
+
+class SmsNotifier:
+    """
+    短信到达通知
+
+    长轮询请求按手机号登记等待，收到该号码的短信时立即唤醒所有等待者。
+    每个等待者使用独立的Event，唤醒一个号码不会惊动其他号码的等待者。
+    通知只在当前进程内有效，其他工作进程收到的短信由等待方定期复查发现。
+    """
+
+    def __init__(self):
+        """初始化通知器"""
+        self._waiters = {}  # 手机号 -> 等待中的Event集合
+        self._lock = threading.Lock()
+
+    def wait(self, phone, timeout):
+        """
+        等待指定号码的短信到达通知
+
+        参数:
+        - phone: 手机号码
+        - timeout: 最长等待时间(秒)
+
+        返回:
+        - 是否在超时前收到通知
+        """
+        event = threading.Event()
+        with self._lock:
+            self._waiters.setdefault(phone, set()).add(event)
+        try:
+            return event.wait(timeout)
+        finally:
+            with self._lock:
+                waiters = self._waiters.get(phone)
+                if waiters is not None:
+                    waiters.discard(event)
+                    if not waiters:
+                        del self._waiters[phone]
+
+    def notify(self, phone):
+        """
+        唤醒等待指定号码短信的所有请求
+
+        参数:
+        - phone: 手机号码
+
+        返回:
+        - 被唤醒的等待者数量
+        """
+        with self._lock:
+            waiters = self._waiters.pop(phone, ())
+        for event in waiters:
+            event.set()
+        return len(waiters)
+
+    def __len__(self):
+        """当前有等待者的号码数"""
+        return len(self._waiters)
+
+
+# 全局短信到达通知器
+sms_notifier = SmsNotifier()
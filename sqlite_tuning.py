@@ -0,0 +1,150 @@
+import logging
+import re
+import threading
+import time
+
+from sqlalchemy import event
+
+logger = logging.getLogger(__name__)
+
+# 需要写锁的语句，BEGIN IMMEDIATE在读取之前就取得SQLite的写锁
+_WRITE_STATEMENT = re.compile(r'^\s*(INSERT|UPDATE|DELETE|REPLACE|CREATE|DROP|ALTER|BEGIN\s+IMMEDIATE)\b',
+                              re.IGNORECASE)
+
+
+class SqliteWriter:
+    """
+    SQLite单写入者
+
+    SQLite同一时刻只允许一个写事务，多个线程同时写入时后来者在busy_timeout内反复休眠重试，
+    超时后报database is locked。本类在进程内用一把普通的锁让写事务排队：连接执行第一条写语句前取得写锁，
+    提交或回滚完成、连接归还连接池时释放，进程内的写入依次执行，只有不同进程之间才依靠busy_timeout等待。
+    写事务不合并也不批量提交，每个事务仍各自提交。
+    pysqlite在第一条写语句前才开始事务，读语句不持有快照，取得写锁后开始的写事务不会因快照过期而失败；
+    WAL模式下读不阻塞写，读请求不经过写锁。
+    """
+
+    def __init__(self):
+        self.timeout = 5.0
+        self._lock = threading.Lock()
+        self._stats_lock = threading.Lock()
+        self.transactions = 0
+        self.waits = 0
+        self.wait_seconds = 0.0
+        self.timeouts = 0
+
+    def acquire(self, conn_info):
+        """
+        为连接取得写锁，连接已持有写锁时直接返回
+
+        参数:
+        - conn_info: 连接的info字典，用于记录是否持有写锁
+        """
+        if conn_info.get('sqlite_writer'):
+            return
+        if self._lock.acquire(blocking=False):
+            waited = 0.0
+        else:
+            started = time.perf_counter()
+            acquired = self._lock.acquire(timeout=self.timeout)
+            waited = time.perf_counter() - started
+            if not acquired:
+                # 交给SQLite自身的busy_timeout处理
+                with self._stats_lock:
+                    self.timeouts += 1
+                logger.warning('等待SQLite写锁超过%.1f秒', self.timeout)
+                return
+        conn_info['sqlite_writer'] = True
+        with self._stats_lock:
+            self.transactions += 1
+            if waited:
+                self.waits += 1
+                self.wait_seconds += waited
+
+    def release(self, conn_info):
+        """
+        事务结束后释放连接持有的写锁
+
+        参数:
+        - conn_info: 连接的info字典
+        """
+        if conn_info.pop('sqlite_writer', False):
+            self._lock.release()
+
+    def stats(self):
+        """
+        获取写锁情况
+
+        返回:
+        - 写事务数、需要排队的次数、累计排队时间、排队超时次数
+        """
+        with self._stats_lock:
+            return {
+                'transactions': self.transactions,
+                'waits': self.waits,
+                'wait_seconds': round(self.wait_seconds, 3),
+                'timeouts': self.timeouts
+            }
+
+
+# 全局SQLite单写入者
+sqlite_writer = SqliteWriter()
+
+
+def configure_sqlite(engine, config):
+    """
+    为SQLite文件数据库启用高并发模式
+
+    每个新连接设置WAL日志、synchronous=NORMAL、busy_timeout和mmap_size。
+    WAL模式下读写互不阻塞，synchronous=NORMAL时提交不再逐个fsync，由检查点统一刷盘；
+    配置SQLITE_SINGLE_WRITER时进程内的写事务通过SqliteWriter排队执行。
+    其他数据库和内存数据库不做处理。
+
+    参数:
+    - engine: SQLAlchemy引擎
+    - config: 应用配置
+    """
+    if engine.dialect.name != 'sqlite' or not config.get('SQLITE_TUNING_ENABLED', True):
+        return
+    if engine.url.database in (None, '', ':memory:'):
+        return
+
+    busy_timeout = config['SQLITE_BUSY_TIMEOUT_MS']
+    mmap_size = config['SQLITE_MMAP_SIZE']
+
+    @event.listens_for(engine, 'connect')
+    def _set_pragmas(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        try:
+            cursor.execute('PRAGMA journal_mode=WAL')
+            cursor.execute('PRAGMA synchronous=NORMAL')
+            cursor.execute(f'PRAGMA busy_timeout={int(busy_timeout)}')
+            cursor.execute(f'PRAGMA mmap_size={int(mmap_size)}')
+        finally:
+            cursor.close()
+
+    if not config.get('SQLITE_SINGLE_WRITER', True):
+        return
+    sqlite_writer.timeout = busy_timeout / 1000
+
+    @event.listens_for(engine, 'before_cursor_execute')
+    def _acquire_writer(conn, cursor, statement, parameters, context, executemany):
+        if _WRITE_STATEMENT.match(statement):
+            sqlite_writer.acquire(conn.info)
+
+    # 事务结束的commit/rollback事件在DBAPI提交之前触发，此时释放写锁会让下一个写事务与未完成的提交争用SQLite的锁；
+    # 连接归还连接池时提交或回滚已经完成，在此释放写锁
+    @event.listens_for(engine, 'checkin')
+    def _release_on_checkin(dbapi_connection, connection_record):
+        sqlite_writer.release(connection_record.info)
+
+    @event.listens_for(engine, 'invalidate')
+    def _release_on_invalidate(dbapi_connection, connection_record, exception):
+        sqlite_writer.release(connection_record.info)
+
+    logger.info('SQLite高并发模式: WAL, busy_timeout=%sms, 进程内单写入者', busy_timeout)
+
+
+def get_sqlite_writer_stats():
+    """获取SQLite写锁情况"""
+    return sqlite_writer.stats()
@@ -0,0 +1,65 @@
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app import create_app
+from blacklist_index import blacklist_index
+from config import TestingConfig, config
+from models import db, Project, User
+from project_cache import project_catalogue
+
+
+@pytest.fixture
+def make_app(tmp_path, monkeypatch):
+    """创建使用临时SQLite文件的测试应用，多个线程可以各自使用独立连接；关键字参数覆盖配置项"""
+    monkeypatch.chdir(tmp_path)
+    apps = []
+
+    def make(**overrides):
+        settings = {
+            'SQLALCHEMY_DATABASE_URI': 'sqlite:///' + str(tmp_path / 'test.db'),
+            'RATE_LIMIT_ENABLED': False,
+            'LOG_REQUESTS': False
+        }
+        settings.update(overrides)
+        name = f'file_testing_{len(apps)}'
+        monkeypatch.setitem(config, name, type('FileTestingConfig', (TestingConfig,), settings))
+        app = create_app(name)
+        with app.app_context():
+            db.create_all()
+        project_catalogue.invalidate()
+        blacklist_index.clear()
+        apps.append(app)
+        return app
+
+    yield make
+    for app in apps:
+        with app.app_context():
+            db.session.remove()
+            db.engine.dispose()
+
+
+@pytest.fixture
+def app(make_app):
+    return make_app()
+
+
+@pytest.fixture
+def user_id(app):
+    """创建一个测试用户，返回用户ID"""
+    with app.app_context():
+        user = User(username='tester', password='x', email='tester@example.com', security_question='q? a')
+        db.session.add(user)
+        db.session.add(Project(project_id='p1', name='测试项目', amount=0.5))
+        db.session.commit()
+        return user.id
+
+
+@pytest.fixture
+def token(app, user_id):
+    """测试用户登录后的token"""
+    resp = app.test_client().get('/api/login', query_string={'username': 'tester', 'password': 'x'})
+    return resp.get_json()['user']['token']
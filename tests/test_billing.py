@@ -0,0 +1,90 @@
+import threading
+
+from sqlalchemy import insert
+
+from billing import BalanceCompactor, _balance_cents, credit_balance, debit_balance, get_balance
+from models import db, BalanceEntry, BalanceSnapshot
+
+
+def test_concurrent_debits_never_overdraw(app, user_id):
+    with app.app_context():
+        credit_balance(db.session, user_id, 1.0)
+        db.session.commit()
+
+    results = []
+    start = threading.Barrier(20)
+
+    def debit():
+        with app.app_context():
+            start.wait()
+            ok = debit_balance(db.session, user_id, 0.1)
+            db.session.commit()
+            results.append(ok)
+
+    threads = [threading.Thread(target=debit) for _ in range(20)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert results.count(True) == 10
+    with app.app_context():
+        assert get_balance(db.session, user_id) == 0.0
+
+
+def test_compaction_keeps_balance(app, user_id):
+    with app.app_context():
+        credit_balance(db.session, user_id, 5.0)
+        debit_balance(db.session, user_id, 1.25)
+        credit_balance(db.session, user_id, 0.5)
+        db.session.commit()
+        before = db.session.execute(db.select(_balance_cents(user_id))).scalar()
+
+        assert BalanceCompactor().run_once(db.session) == 1
+
+        assert db.session.execute(db.select(_balance_cents(user_id))).scalar() == before == 425
+        assert db.session.query(BalanceSnapshot).filter_by(user_id=user_id).one().balance_cents == 425
+
+        # 快照之后的流水计入余额，再次汇总只保留最新快照
+        debit_balance(db.session, user_id, 0.25)
+        db.session.commit()
+        assert BalanceCompactor().run_once(db.session) == 1
+        assert get_balance(db.session, user_id) == 4.0
+        assert db.session.query(BalanceSnapshot).filter_by(user_id=user_id).count() == 1
+
+
+def test_compaction_waits_for_slow_commit_with_lower_id(app, user_id):
+    """
+    较晚提交的流水ID小于已提交的流水时(PostgreSQL的序列不按提交顺序)，
+    快照不能越过它；这里用显式ID在SQLite上模拟
+    """
+    def entry(entry_id, cents):
+        return insert(BalanceEntry).values(id=entry_id, user_id=user_id, amount_cents=cents, reason='refund')
+
+    with app.app_context():
+        db.session.execute(entry(1, 100))
+        db.session.execute(entry(3, 300))
+        db.session.commit()
+
+    inserted = threading.Event()
+
+    def slow_writer():
+        with app.app_context():
+            db.session.execute(entry(2, 200))
+            inserted.set()
+            threading.Event().wait(0.3)
+            db.session.commit()
+
+    writer = threading.Thread(target=slow_writer)
+    writer.start()
+    inserted.wait()
+    try:
+        with app.app_context():
+            BalanceCompactor().run_once(db.session)
+    finally:
+        writer.join()
+
+    with app.app_context():
+        assert get_balance(db.session, user_id) == 6.0
+        snapshot = db.session.query(BalanceSnapshot).filter_by(user_id=user_id).one()
+        assert (snapshot.last_entry_id, snapshot.balance_cents) == (3, 600)
@@ -0,0 +1,66 @@
+from models import db, BlacklistedPhone, Project
+
+
+def _blacklisted(project_id):
+    return sorted(row.phone for row in BlacklistedPhone.query.filter_by(project_id=project_id))
+
+
+def _add_project(app, project_id):
+    with app.app_context():
+        db.session.add(Project(project_id=project_id, name=project_id, amount=0.5))
+        db.session.commit()
+
+
+def test_blacklist_phones_is_per_project(app, user_id, token):
+    _add_project(app, 'p2')
+    client = app.test_client()
+    phones = '13800000001,13800000002'
+    client.get('/api/blacklist_phones', query_string={'token': token, 'project_id': 'p1', 'phones': '13800000001'})
+
+    resp = client.get('/api/blacklist_phones', query_string={'token': token, 'project_id': 'p2', 'phones': phones})
+
+    assert resp.status_code == 200
+    assert all(item['stat'] for item in resp.get_json()['data'])
+    with app.app_context():
+        assert _blacklisted('p1') == ['13800000001']
+        assert _blacklisted('p2') == ['13800000001', '13800000002']
+
+
+def test_blacklist_import_is_per_project(app, user_id, token):
+    _add_project(app, 'p2')
+    client = app.test_client()
+    client.post('/api/blacklist_import', query_string={'token': token, 'project_id': 'p1'},
+                data='13800000001\n')
+
+    resp = client.post('/api/blacklist_import', query_string={'token': token, 'project_id': 'p2'},
+                       data='13800000001\n13800000002\n')
+
+    assert resp.status_code == 200
+    assert resp.get_json()['data']['added'] == 2
+    with app.app_context():
+        assert _blacklisted('p2') == ['13800000001', '13800000002']
+
+
+def test_relax_blacklist_uniqueness_rebuilds_sqlite_table(app, user_id):
+    from sqlalchemy import text
+    from migrations import global_blacklist_constraint, relax_blacklist_uniqueness
+
+    with app.app_context():
+        # 模拟按旧模型创建的黑名单表
+        with db.engine.begin() as conn:
+            conn.execute(text('DROP TABLE blacklisted_phone'))
+            conn.execute(text('CREATE TABLE blacklisted_phone (id INTEGER PRIMARY KEY, phone VARCHAR(20) NOT NULL, '
+                              'user_id INTEGER NOT NULL, project_id VARCHAR(20) NOT NULL, created_at DATETIME, '
+                              'UNIQUE (phone))'))
+            conn.execute(text('CREATE INDEX ix_blacklisted_phone_project_phone ON blacklisted_phone (project_id, phone)'))
+            conn.execute(text("INSERT INTO blacklisted_phone (phone, user_id, project_id) "
+                              "VALUES ('13800000001', :user_id, 'p1')"), {'user_id': user_id})
+        assert global_blacklist_constraint(db.engine) == ''
+
+        assert relax_blacklist_uniqueness(db.engine)
+
+        assert global_blacklist_constraint(db.engine) is None
+        db.session.add(BlacklistedPhone(phone='13800000001', user_id=user_id, project_id='p2'))
+        db.session.commit()
+        assert _blacklisted('p1') == ['13800000001']
+        assert _blacklisted('p2') == ['13800000001']
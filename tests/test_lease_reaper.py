@@ -0,0 +1,37 @@
+import datetime
+
+from lease_reaper import LeaseReaper
+from billing import get_balance
+from models import db, PhoneNumber
+
+
+def _add_phone(phone, user_id, status, frozen_amount, age_seconds):
+    db.session.add(PhoneNumber(
+        phone=phone, user_id=user_id, project_id='p1', status=status, frozen_amount=frozen_amount,
+        created_at=datetime.datetime.utcnow() - datetime.timedelta(seconds=age_seconds)))
+
+
+def test_reaper_reclaims_expired_unfinished_leases(app, user_id):
+    with app.app_context():
+        _add_phone('13800000001', user_id, 1, 0.5, 3600)
+        _add_phone('13800000002', user_id, 1, 0.5, 10)
+        db.session.commit()
+
+        reclaimed, refunded = LeaseReaper(ttl=60).run_once(db.session)
+
+        assert (reclaimed, refunded) == (1, 0.5)
+        assert [row.phone for row in db.session.query(PhoneNumber)] == ['13800000002']
+        assert get_balance(db.session, user_id) == 0.5
+
+
+def test_reaper_keeps_used_numbers(app, user_id):
+    with app.app_context():
+        # 已收到验证码的号码：状态为已使用，冻结金额已扣除
+        _add_phone('13800000003', user_id, 0, 0.0, 3600)
+        db.session.commit()
+
+        reclaimed, refunded = LeaseReaper(ttl=60).run_once(db.session)
+
+        assert (reclaimed, refunded) == (0, 0.0)
+        assert db.session.query(PhoneNumber).filter_by(phone='13800000003').count() == 1
+        assert get_balance(db.session, user_id) == 0.0
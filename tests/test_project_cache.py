@@ -0,0 +1,27 @@
+from models import db, Project
+from project_cache import ProjectCatalogue
+
+
+def test_catalogue_picks_up_database_changes(app):
+    catalogue = ProjectCatalogue(refresh_interval=0)
+    with app.app_context():
+        db.session.add(Project(project_id='p1', name='微信注册', amount=0.5))
+        db.session.commit()
+        assert [project.name for project in catalogue.search(db.session, name='微信')] == ['微信注册']
+
+        # 其他进程直接修改数据库后，下次刷新时生效
+        db.session.query(Project).filter_by(project_id='p1').update({'name': '支付宝注册', 'amount': 0.8})
+        db.session.commit()
+
+        assert catalogue.search(db.session, name='微信') == []
+        assert catalogue.get(db.session, 'p1').amount == 0.8
+
+
+def test_catalogue_reloads_on_miss(app):
+    catalogue = ProjectCatalogue(refresh_interval=3600, miss_refresh_interval=0)
+    with app.app_context():
+        assert catalogue.get(db.session, 'p2') is None
+        db.session.add(Project(project_id='p2', name='新项目', amount=1.0))
+        db.session.commit()
+
+        assert catalogue.get(db.session, 'p2').name == '新项目'
@@ -0,0 +1,59 @@
+import pytest
+
+from async_util import RateLimiter, api_rate_limiter
+
+
+def _reset_counts():
+    for stripe in api_rate_limiter._stripes:
+        stripe[1].clear()
+
+
+@pytest.fixture
+def limited_app(app):
+    """启用全局限流，每个测试使用新的进程内计数"""
+    app.config['RATE_LIMIT_ENABLED'] = True
+    _reset_counts()
+    return app
+
+
+def test_limiter_refuses_101st_call_within_window(limited_app):
+    client = limited_app.test_client()
+    statuses = [client.get('/api/search_projects', query_string={'token': 'limit'}).status_code
+                for _ in range(101)]
+
+    assert 429 not in statuses[:100]
+    assert statuses[100] == 429
+
+
+def test_limiter_allows_101st_call_in_a_later_window(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr('async_util.time.monotonic', lambda: now[0])
+    limiter = RateLimiter(max_calls=100, time_frame=60)
+
+    assert all(limiter.try_acquire('client') for _ in range(100))
+    assert not limiter.try_acquire('client')
+    # 两个窗口之后上一窗口的请求不再计入
+    now[0] += 120
+    assert limiter.try_acquire('client')
+
+
+def test_exempt_endpoints_are_not_limited(limited_app):
+    client = limited_app.test_client()
+    for _ in range(101):
+        client.get('/api/search_projects')
+
+    assert client.get('/api/search_projects').status_code == 429
+    assert client.get('/api/').status_code == 200
+    assert client.post('/api/sms_inbound', json={'messages': []}).status_code != 429
+    assert client.get('/metrics').status_code == 200
+
+
+def test_trusted_proxy_supplies_client_ip(make_app):
+    app = make_app(RATE_LIMIT_ENABLED=True, TRUSTED_PROXY_COUNT=1)
+    _reset_counts()
+    client = app.test_client()
+
+    for _ in range(100):
+        client.get('/api/search_projects', headers={'X-Forwarded-For': '203.0.113.1'})
+    assert client.get('/api/search_projects', headers={'X-Forwarded-For': '203.0.113.1'}).status_code == 429
+    assert client.get('/api/search_projects', headers={'X-Forwarded-For': '203.0.113.2'}).status_code != 429
@@ -0,0 +1,21 @@
+import pytest
+
+
+@pytest.fixture
+def inbound_app(make_app):
+    return make_app(SMS_INBOUND_TOKEN='inbound-secret')
+
+
+@pytest.mark.parametrize('header', ['wrong', 'inbound-secrét', ''])
+def test_sms_inbound_rejects_bad_tokens(inbound_app, header):
+    resp = inbound_app.test_client().post('/api/sms_inbound', json={'messages': []},
+                                          headers={'X-Inbound-Token': header})
+
+    assert resp.status_code == 401
+
+
+def test_sms_inbound_accepts_configured_token(inbound_app):
+    resp = inbound_app.test_client().post('/api/sms_inbound', json={'messages': []},
+                                          headers={'X-Inbound-Token': 'inbound-secret'})
+
+    assert resp.status_code == 202
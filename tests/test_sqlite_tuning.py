@@ -0,0 +1,29 @@
+from sqlite_tuning import sqlite_writer
+from models import db, Project
+
+
+def test_writer_lock_held_until_commit_completes(app, monkeypatch):
+    with app.app_context():
+        dialect = db.engine.dialect
+        do_commit = dialect.do_commit
+        held = []
+
+        def record_commit(dbapi_connection):
+            held.append(sqlite_writer._lock.locked())
+            do_commit(dbapi_connection)
+
+        monkeypatch.setattr(dialect, 'do_commit', record_commit)
+        db.session.add(Project(project_id='p2', name='写锁', amount=1.0))
+        db.session.commit()
+
+        assert held == [True]
+        assert not sqlite_writer._lock.locked()
+
+
+def test_writer_lock_released_after_rollback(app):
+    with app.app_context():
+        db.session.add(Project(project_id='p3', name='回滚', amount=1.0))
+        db.session.flush()
+        assert sqlite_writer._lock.locked()
+        db.session.rollback()
+        assert not sqlite_writer._lock.locked()